@@ -0,0 +1,194 @@
+"""
+智能体共享状态模块
+多个工作进程共享同一份智能体状态，任何进程都可以根据状态重建智能体对象：
+- 对话记忆：RedisMemory（agent_memory:<会话>）
+- 会话状态：Redis哈希（agent_state:<会话>），如导游讲解风格、信息收集结果
+- 滚动摘要：agent_summary:<会话> 和待摘要列表 agent_memory_overflow:<会话>，随会话一起删除
+- 跨进程失效：Redis 发布/订阅（agent_invalidate 频道），登出或清空历史时通知所有进程丢弃本地缓存的智能体对象
+
+Redis 不可用时退化为进程内字典，失效通知只在当前进程内生效。
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+import metrics
+
+try:
+    from .redis_memory import get_redis_memory_manager
+except ImportError:
+    from agent.redis_memory import get_redis_memory_manager
+
+STATE_PREFIX = 'agent_state:'
+INVALIDATE_CHANNEL = 'agent_invalidate'
+
+AGENT_INVALIDATIONS = metrics.registry.counter(
+    'agent_state_invalidations_total', '智能体本地缓存失效次数', ('scope', 'source'))
+
+
+def escape_pattern(value: str) -> str:
+    """转义 Redis glob 模式中的特殊字符"""
+    return re.sub(r'([*?\[\]\\])', r'\\\1', value)
+
+
+class AgentStateStore:
+    """会话状态存储 + 跨进程失效通知"""
+
+    def __init__(self, redis_memory=None):
+        self.memory = redis_memory or get_redis_memory_manager()
+        self.redis = self.memory.redis_client if self.memory.use_redis else None
+        self.ttl = self.memory.memory_ttl
+
+        self._fallback_state: Dict[str, Dict[str, str]] = {}
+        self._listeners: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        # 本进程发出的通知已在本地处理过，收到时跳过
+        self._origin = uuid.uuid4().hex
+
+        if self.redis is not None:
+            threading.Thread(target=self._listen_loop, name="agent-invalidate", daemon=True).start()
+
+    # ---------------- 会话状态 ----------------
+    def get(self, session_key: str) -> Dict[str, str]:
+        """读取会话状态（不存在时返回空字典）"""
+        if self.redis is None:
+            with self._lock:
+                return dict(self._fallback_state.get(session_key, {}))
+        try:
+            with metrics.REDIS_SECONDS.time(operation='get_state'):
+                return self.redis.hgetall(f"{STATE_PREFIX}{session_key}") or {}
+        except Exception as e:
+            print(f"Redis读取智能体状态失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='get_state')
+            return {}
+
+    def update(self, session_key: str, **fields) -> bool:
+        """更新会话状态的若干字段（值统一按字符串存储）"""
+        values = {name: value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+                  for name, value in fields.items()}
+        if self.redis is None:
+            with self._lock:
+                self._fallback_state.setdefault(session_key, {}).update(values)
+            return True
+        try:
+            key = f"{STATE_PREFIX}{session_key}"
+            with metrics.REDIS_SECONDS.time(operation='update_state'):
+                pipe = self.redis.pipeline()
+                pipe.hset(key, mapping=values)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Redis写入智能体状态失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='update_state')
+            return False
+
+    def delete(self, session_key: str) -> bool:
+        """删除单个会话的记忆和状态"""
+        if self.redis is None:
+            with self._lock:
+                self._fallback_state.pop(session_key, None)
+            return self.memory.clear_session(session_key)
+        try:
+            with metrics.REDIS_SECONDS.time(operation='delete_state'):
+                self.redis.delete(*self.memory.session_keys(session_key), f"{STATE_PREFIX}{session_key}")
+            return True
+        except Exception as e:
+            print(f"Redis删除会话失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='delete_state')
+            return False
+
+    def delete_sessions(self, prefix: str) -> int:
+        """
+        删除以 prefix 开头的所有会话的记忆和状态（不限于当前进程创建的会话）
+
+        Returns:
+            int: 删除的会话记忆数量
+        """
+        if self.redis is None:
+            with self._lock:
+                for session_key in [k for k in self._fallback_state if k.startswith(prefix)]:
+                    del self._fallback_state[session_key]
+            session_keys = [k for k in self.memory._fallback_memory if k.startswith(prefix)]
+            for session_key in session_keys:
+                self.memory.clear_session(session_key)
+            return len(session_keys)
+
+        pattern = escape_pattern(prefix) + '*'
+        try:
+            with metrics.REDIS_SECONDS.time(operation='delete_sessions'):
+                memory_keys = list(self.redis.scan_iter(f"{self.memory.key_prefix}{pattern}", count=500))
+                other_keys = [key for key_prefix in (STATE_PREFIX, self.memory.summary_prefix, self.memory.overflow_prefix)
+                              for key in self.redis.scan_iter(f"{key_prefix}{pattern}", count=500)]
+                if memory_keys or other_keys:
+                    self.redis.delete(*memory_keys, *other_keys)
+            return len(memory_keys)
+        except Exception as e:
+            print(f"Redis删除会话失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='delete_sessions')
+            return 0
+
+    # ---------------- 跨进程失效 ----------------
+    def subscribe(self, scope: str, callback: Callable[[str], None]):
+        """登记本地缓存失效回调：callback(email)，重复登记同一回调无效"""
+        with self._lock:
+            self._listeners.setdefault(scope, set()).add(callback)
+
+    def invalidate(self, scope: str, email: str):
+        """立即使本进程的缓存失效，并通知其他进程"""
+        self._dispatch(scope, email, 'local')
+        if self.redis is None:
+            return
+        try:
+            payload = json.dumps({'scope': scope, 'email': email, 'origin': self._origin})
+            with metrics.REDIS_SECONDS.time(operation='publish_invalidate'):
+                self.redis.publish(INVALIDATE_CHANNEL, payload)
+        except Exception as e:
+            print(f"发布智能体失效通知失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='publish_invalidate')
+
+    def _dispatch(self, scope: str, email: str, source: str):
+        with self._lock:
+            callbacks = list(self._listeners.get(scope, ()))
+        AGENT_INVALIDATIONS.inc(scope=scope, source=source)
+        for callback in callbacks:
+            try:
+                callback(email)
+            except Exception as e:
+                print(f"处理智能体失效通知失败: {e}")
+
+    def _listen_loop(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message:
+                        continue
+                    payload = json.loads(message['data'])
+                    if payload.get('origin') != self._origin:
+                        self._dispatch(payload['scope'], payload['email'], 'remote')
+            except Exception as e:
+                print(f"智能体失效订阅中断，稍后重连: {e}")
+                metrics.ERRORS.inc(component='redis', operation='subscribe_invalidate')
+                pubsub.close()
+                time.sleep(1)
+
+
+# 全局状态存储实例
+_agent_state_store: Optional[AgentStateStore] = None
+_agent_state_store_lock = threading.Lock()
+
+def get_agent_state_store() -> AgentStateStore:
+    """获取全局智能体状态存储（懒加载）"""
+    global _agent_state_store
+    if _agent_state_store is None:
+        with _agent_state_store_lock:
+            if _agent_state_store is None:
+                _agent_state_store = AgentStateStore()
+    return _agent_state_store
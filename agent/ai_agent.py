@@ -2,9 +2,12 @@ import warnings
 import os
 import asyncio
 import time
+import hashlib
 import traceback
-import concurrent.futures
-from typing import Dict, Any, List, Optional, Generator
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Generator, Tuple
 
 # 抑制LangChain弃用警告
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -13,31 +16,49 @@ from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, SystemMessage, BaseMessage
 from dotenv import load_dotenv
 
-# MCP 工具导入
-try:
-    from mcp import ClientSession, StdioServerParameters
-    from mcp.client.stdio import stdio_client
-    from langchain_mcp_adapters.tools import load_mcp_tools
-    from langgraph.prebuilt import create_react_agent
-    MCP_AVAILABLE = True
-except ImportError:
+# MCP 工具依赖较重（mcp、langchain_mcp_adapters、langgraph），这里只检测是否安装，
+# 真正的导入推迟到首次加载工具/创建信息收集智能体时，缩短应用启动时间
+MCP_AVAILABLE = all(importlib.util.find_spec(name) is not None
+                    for name in ('mcp', 'langchain_mcp_adapters', 'langgraph'))
+if not MCP_AVAILABLE:
     print("MCP工具不可用，将使用备用模式")
-    MCP_AVAILABLE = False
 
-# PDF生成类和提示词导入
-from agent.pdf_generator import PDFGeneratorTool
+# 提示词导入（PDF任务队列在 PdfAgent 中按需导入）
+import metrics
 try:
     from .prompts import (
         GENERAL_SYSTEM_PROMPT, TRAVEL_SYSTEM_PROMPT, PDF_PROMPT,
-        INFORMATION_COLLECTOR_PROMPT, ITINERARY_PLANNER_PROMPT
+        INFORMATION_COLLECTOR_PROMPT, ITINERARY_PLANNER_PROMPT, MEMORY_SUMMARY_PROMPT
     )
     from .redis_memory import get_redis_memory_manager, SimpleMemory as RedisSimpleMemory
+    from .agent_state import get_agent_state_store
+    from .event_loop import get_background_loop
+    from .prefetch import TravelPrefetchAgent
+    from .llm_pool import get_llm_registry
+    from .session_cache import SessionCache
+    from .context_builder import ContextBuilder, count_tokens, truncate_to_tokens
+    from .response_cache import ResponseCache, get_response_cache, is_context_dependent, replay_text, areplay_text
+    from .similarity_index import SimilarityIndex, SimilarMatch, get_similarity_index
+    from .memory_summary import get_rolling_summarizer, format_messages
+    from .trip_context import CollectionPlan, collector_cache_fields, get_collector_reuse, REUSE, EXTEND, COLLECT
+    from .collector_cache import get_collector_cache, COLLECTOR_TOPIC
 except ImportError:
     from agent.prompts import (
         GENERAL_SYSTEM_PROMPT, TRAVEL_SYSTEM_PROMPT, PDF_PROMPT,
-        INFORMATION_COLLECTOR_PROMPT, ITINERARY_PLANNER_PROMPT
+        INFORMATION_COLLECTOR_PROMPT, ITINERARY_PLANNER_PROMPT, MEMORY_SUMMARY_PROMPT
     )
     from agent.redis_memory import get_redis_memory_manager, SimpleMemory as RedisSimpleMemory
+    from agent.agent_state import get_agent_state_store
+    from agent.event_loop import get_background_loop
+    from agent.prefetch import TravelPrefetchAgent
+    from agent.llm_pool import get_llm_registry
+    from agent.session_cache import SessionCache
+    from agent.context_builder import ContextBuilder, count_tokens, truncate_to_tokens
+    from agent.response_cache import ResponseCache, get_response_cache, is_context_dependent, replay_text, areplay_text
+    from agent.similarity_index import SimilarityIndex, SimilarMatch, get_similarity_index
+    from agent.memory_summary import get_rolling_summarizer, format_messages
+    from agent.trip_context import CollectionPlan, collector_cache_fields, get_collector_reuse, REUSE, EXTEND, COLLECT
+    from agent.collector_cache import get_collector_cache, COLLECTOR_TOPIC
 
 # =============================================================================
 # 1. Component and Utility Classes (The Foundation)
@@ -52,12 +73,20 @@ class ConfigManager:
         self.base_url = os.getenv("OPENAI_API_URL")
         self.searchapi_key = os.getenv("SEARCHAPI_API_KEY", "")
         self.mcp_server_path = "agent/mcp_server.py"
+        self.mcp_transport = os.getenv("MCP_TRANSPORT", "stdio")
+        self.mcp_server_url = os.getenv("MCP_SERVER_URL") or None
+        self.mcp_pool_size = int(os.getenv("MCP_POOL_SIZE", "2"))
+        self.mcp_health_interval = float(os.getenv("MCP_HEALTH_INTERVAL", "30"))
+        self.session_max_entries = int(os.getenv("AGENT_SESSION_MAX", "1000"))
+        self.session_idle_ttl = float(os.getenv("AGENT_SESSION_IDLE_TTL", "1800"))
+        self.memory_summary_max_chars = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", "800"))
         
         if not self.api_key:
             raise ValueError("未配置OpenAI API密钥")
     
-    def get_server_params(self) -> StdioServerParameters:
+    def get_server_params(self) -> 'StdioServerParameters':
         """获取MCP服务器参数"""
+        from mcp import StdioServerParameters
         return StdioServerParameters(
             command="python",
             args=[self.mcp_server_path],
@@ -65,34 +94,75 @@ class ConfigManager:
         )
 
 class LLMFactory:
-    """LLM实例工厂"""
+    """LLM实例工厂（实例由进程内的LLM客户端注册表共享，所有实例共用一个HTTP连接池）"""
     def __init__(self, config: ConfigManager):
         self.config = config
+        self.registry = get_llm_registry()
+
+    @property
+    def http_client(self):
+        return self.registry.http_client
     
     def create_llm(self, model: str = "gpt-4.1-nano", temperature: float = 0.1, 
                    streaming: bool = False) -> ChatOpenAI:
-        """创建LLM实例"""
-        return ChatOpenAI(
-            api_key=self.config.api_key,
-            model=model,
-            base_url=self.config.base_url,
-            temperature=temperature,
-            streaming=streaming
-        )
+        """获取LLM实例（同一组参数在进程内共享）"""
+        return self.registry.get(model=model, temperature=temperature, streaming=streaming)
+
+    def warmup(self) -> int:
+        """预先与LLM服务端建立连接（完成DNS解析和TLS握手），返回HTTP状态码"""
+        return self.registry.warmup()
 
 class MCPManager:
     """MCP连接和工具管理"""
     def __init__(self, config: ConfigManager):
         self.config = config
+        self._pool = None
+
+    @property
+    def pool(self):
+        """长连接MCP会话池（首次访问时创建，load_pooled_tools 时才真正启动）"""
+        if self._pool is None:
+            from agent.mcp_pool import MCPSessionPool
+            self._pool = MCPSessionPool(
+                server_params=self.config.get_server_params() if self.config.mcp_transport == "stdio" else None,
+                transport=self.config.mcp_transport,
+                url=self.config.mcp_server_url,
+                size=self.config.mcp_pool_size,
+                health_interval=self.config.mcp_health_interval,
+            )
+        return self._pool
+
+    def load_pooled_tools(self) -> List[Any]:
+        """启动会话池并返回绑定到池的工具（工具调用复用常驻会话）"""
+        if not MCP_AVAILABLE:
+            print("MCP依赖库不可用，返回空工具列表")
+            return []
+        if self.config.mcp_transport == "stdio" and not os.path.exists(self.config.mcp_server_path):
+            print(f"警告: MCP服务器文件不存在: {self.config.mcp_server_path}")
+            return []
+        try:
+            tools = self.pool.load_tools()
+            print(f"MCP会话池已就绪（{self.config.mcp_transport} x{self.config.mcp_pool_size}），加载了 {len(tools)} 个工具")
+            return tools
+        except Exception as e:
+            print(f"启动MCP会话池失败: {e}")
+            return []
+
+    def get_pool_stats(self) -> Optional[Dict[str, Any]]:
+        return self._pool.get_stats() if self._pool is not None else None
     
     async def load_tools_async(self) -> List[Any]:
-        """异步加载MCP工具"""
+        """[一次性加载] 异步加载MCP工具（会话随即关闭，工具无法在此之后调用，仅保留兼容）"""
         if not MCP_AVAILABLE or not os.path.exists(self.config.mcp_server_path):
             if not MCP_AVAILABLE: print("MCP依赖库不可用，返回空工具列表")
             else: print(f"警告: MCP服务器文件不存在: {self.config.mcp_server_path}")
             return []
             
         try:
+            from mcp import ClientSession
+            from mcp.client.stdio import stdio_client
+            from langchain_mcp_adapters.tools import load_mcp_tools
+
             server_params = self.config.get_server_params()
             async with stdio_client(server_params) as (read, write):
                 async with ClientSession(read, write) as session:
@@ -107,29 +177,18 @@ class MCPManager:
     def load_tools_sync(self) -> List[Any]:
         """同步加载MCP工具的包装器"""
         try:
-            # Note: Using asyncio.run() is simpler and safer than managing loops directly
-            return asyncio.run(self.load_tools_async())
+            return get_background_loop().run(self.load_tools_async())
         except Exception as e:
             print(f"同步加载MCP工具失败: {e}")
             return []
 
 class AsyncSyncWrapper:
-    """异步同步转换工具"""
+    """异步同步转换工具（兼容接口，现在由进程内常驻的后台事件循环执行）"""
     @staticmethod
     def run_async_in_thread(async_func_or_coro, timeout: int = 60):
-        """在线程池中运行异步函数或协程"""
-        def sync_wrapper():
-            if callable(async_func_or_coro):
-                # 如果是函数，调用它来获得协程
-                coro = async_func_or_coro()
-            else:
-                # 如果已经是协程，直接使用
-                coro = async_func_or_coro
-            return asyncio.run(coro)
-        
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(sync_wrapper)
-            return future.result(timeout=timeout)
+        """在后台事件循环中运行异步函数或协程并等待结果"""
+        coro = async_func_or_coro() if callable(async_func_or_coro) else async_func_or_coro
+        return get_background_loop().run(coro, timeout)
 
 class StreamingUtils:
     """流式输出工具"""
@@ -139,6 +198,24 @@ class StreamingUtils:
         for i in range(0, len(text), chunk_size):
             yield text[i:i+chunk_size]
 
+def history_to_messages(history: List[Dict[str, Any]]) -> List[BaseMessage]:
+    """把Redis记忆中的历史消息转换为LangChain消息"""
+    messages = []
+    for msg in history:
+        role = msg.get('role', '')
+        content = msg.get('content', '')
+        if role == 'user':
+            messages.append(HumanMessage(content=content))
+        elif role == 'assistant':
+            messages.append(AIMessage(content=content))
+    return messages
+
+def summary_messages(summary: str) -> List[BaseMessage]:
+    """滚动摘要作为一条系统消息放在历史对话之前（没有摘要时为空列表）"""
+    if not summary:
+        return []
+    return [SystemMessage(content=f"以下是与用户更早对话的摘要（这些对话的原文已不在上下文中）：\n{summary}")]
+
 class ResponseExtractor:
     """响应内容提取工具"""
     @staticmethod
@@ -163,129 +240,412 @@ class InformationCollectorAgent:
     def __init__(self, llm: ChatOpenAI, tools: List[Any]):
         self.llm = llm
         self.tools = tools
+        if self.tools:
+            from langgraph.prebuilt import create_react_agent
         self.agent = create_react_agent(self.llm, self.tools) if self.tools else None
         print(f"信息收集智能体已创建，可用工具数量: {len(self.tools)}")
     
     async def collect_information_async(self, user_request: str) -> str:
+        collected_info = ""
+        async for kind, value in self.astream_collect(user_request):
+            if kind == "result":
+                collected_info = value
+        return collected_info
+
+    async def astream_collect(self, user_request: str):
+        """
+        通过 LangGraph 事件流运行信息收集，边执行边产出进度
+
+        Yields:
+            ("progress", dict): 进度事件，type 为 collecting / tool_start / tool_end / finding / collected
+            ("result", str): 最后一项，收集到的信息
+        """
         if not self.agent:
-            return f"信息收集智能体不可用（工具加载失败），无法处理请求: {user_request}"
-        
+            yield "result", f"信息收集智能体不可用（工具加载失败），无法处理请求: {user_request}"
+            return
+
+        started = time.perf_counter()
+        yield "progress", {"type": "collecting"}
+
         collector_request = f"{INFORMATION_COLLECTOR_PROMPT}\n用户需求:{user_request}"
-        response = await self.agent.ainvoke({"messages": [{"role": "user", "content": collector_request}]})
-        return ResponseExtractor.extract_agent_response(response)
+        tool_started = {}
+        output = None
+        async for event in self.agent.astream_events(
+                {"messages": [{"role": "user", "content": collector_request}]}, version="v2"):
+            kind = event["event"]
+            if kind == "on_tool_start":
+                tool_started[event["run_id"]] = time.perf_counter()
+                yield "progress", {"type": "tool_start", "tool": event["name"],
+                                   "input": self._preview(event["data"].get("input"))}
+            elif kind == "on_tool_end":
+                elapsed = time.perf_counter() - tool_started.pop(event["run_id"], time.perf_counter())
+                yield "progress", {"type": "tool_end", "tool": event["name"], "ms": int(elapsed * 1000),
+                                   "preview": self._preview(event["data"].get("output"))}
+            elif kind == "on_chat_model_end":
+                # 模型在两次工具调用之间的阶段性结论
+                message = event["data"].get("output")
+                content = getattr(message, "content", "")
+                if isinstance(content, str) and content.strip():
+                    yield "progress", {"type": "finding", "text": self._preview(content, 300)}
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                output = event["data"].get("output")
+
+        yield "progress", {"type": "collected", "ms": int((time.perf_counter() - started) * 1000)}
+        yield "result", ResponseExtractor.extract_agent_response(output)
+
+    @staticmethod
+    def _preview(value: Any, limit: int = 200) -> str:
+        """把工具输入输出截断成适合推送给前端的预览文本"""
+        if value is None:
+            return ""
+        text = getattr(value, "content", value)
+        if not isinstance(text, str):
+            text = str(text)
+        text = " ".join(text.split())
+        return text if len(text) <= limit else text[:limit] + "…"
     
     def get_response_stream(self, message: str):
         """获取响应流"""
         try:
-            full_response = AsyncSyncWrapper.run_async_in_thread(
-                lambda: self.collect_information_async(message)
-            )
+            full_response = get_background_loop().run(self.collect_information_async(message), timeout=60)
             yield from StreamingUtils.stream_text(full_response)
         except Exception as e:
             yield f"处理请求时出现错误: {str(e)}"
 
+    async def aget_response_stream(self, message: str):
+        """获取异步响应流（直接在当前事件循环中运行）"""
+        try:
+            full_response = await self.collect_information_async(message)
+            for chunk in StreamingUtils.stream_text(full_response):
+                yield chunk
+        except Exception as e:
+            yield f"处理请求时出现错误: {str(e)}"
+
 class PlannerAgent:
     """行程规划智能体"""
     def __init__(self, llm_streaming: ChatOpenAI, llm_normal: ChatOpenAI):
         self.llm_streaming = llm_streaming
         self.llm_normal = llm_normal
+        self.context_builder = ContextBuilder('planner')
         print("行程规划智能体已创建")
         
-    def get_response_stream(self, message: str, collected_info: str = "", conversation_history: list = None):
-        """获取真流式响应（支持对话记忆）"""
+    def _build_messages(self, message: str, collected_info: str = "", conversation_history: list = None,
+                        summary: str = "") -> List[BaseMessage]:
+        """构建规划请求的消息列表"""
         # 构建规划请求内容
         if collected_info:
             planning_content = f"用户原始需求：\n{message}\n\n信息收集智能体提供的详细信息：\n{collected_info}"
         else:
             planning_content = f"用户需求：\n{message}"
         
-        # 构建包含历史记忆的消息列表
-        messages = [SystemMessage(content=ITINERARY_PLANNER_PROMPT)]
-        
-        # 添加历史对话记忆（关于旅行规划的上下文）
-        if conversation_history:
-            for msg in conversation_history[-8:]:  # 旅行规划可能需要更多上下文，但控制数量
-                role = msg.get('role', '')
-                content = msg.get('content', '')
-                if role == 'user':
-                    messages.append(HumanMessage(content=content))
-                elif role == 'assistant':
-                    messages.append(AIMessage(content=content))
+        # 构建包含历史记忆的消息列表（在token预算内从最新往前放入历史对话）
+        context = self.context_builder.build(ITINERARY_PLANNER_PROMPT, conversation_history, planning_content, summary)
+        messages = [SystemMessage(content=ITINERARY_PLANNER_PROMPT), *summary_messages(summary)]
+        messages.extend(history_to_messages(context.history))
         
         # 添加当前规划请求
         messages.append(HumanMessage(content=planning_content))
+        return messages
+        
+    def get_response_stream(self, message: str, collected_info: str = "", conversation_history: list = None,
+                            summary: str = ""):
+        """获取真流式响应（支持对话记忆）"""
+        messages = self._build_messages(message, collected_info, conversation_history, summary)
         
         # 真流式调用LLM
         for chunk in self.llm_streaming.stream(messages):
             if hasattr(chunk, 'content') and chunk.content:
                 yield chunk.content
 
+    async def aget_response_stream(self, message: str, collected_info: str = "", conversation_history: list = None,
+                                   summary: str = ""):
+        """获取异步真流式响应（支持对话记忆）"""
+        messages = self._build_messages(message, collected_info, conversation_history, summary)
+        
+        async for chunk in self.llm_streaming.astream(messages):
+            if hasattr(chunk, 'content') and chunk.content:
+                yield chunk.content
+
 class PdfAgent:
-    """PDF生成智能体"""
-    def __init__(self, llm: ChatOpenAI):
+    """PDF生成智能体：攻略边生成边流式输出，对话总结同时进行；PDF交给后台任务队列渲染，渲染完成后以 {"pdf": ...} 事件给出下载链接"""
+    def __init__(self, llm: ChatOpenAI, llm_streaming: ChatOpenAI):
+        from agent.pdf_jobs import get_pdf_job_queue
         self.llm = llm
-        self.pdf_generator = PDFGeneratorTool()
+        self.llm_streaming = llm_streaming
+        self.job_queue = get_pdf_job_queue()
+        # 流式响应里最多等待渲染的时间，超时后前端凭任务ID轮询结果
+        self.wait_timeout = float(os.getenv("PDF_JOB_WAIT_TIMEOUT", "120"))
+        self.context_builder = ContextBuilder('pdf')
+        # 对话总结在线程中与攻略的流式生成并发执行
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pdf-summary")
         print("PDF生成智能体已创建")
 
-    def generate_pdf(self, user_request: str, conversation_history: list = None) -> str:
-        """生成PDF旅游攻略"""
-        if not conversation_history:
-            return "暂无对话历史记录，无法生成PDF报告。"
-        
+    def _prepare(self, user_request: str, conversation_history: list, summary: str = "") -> str:
+        """发给LLM的对话文本：按token预算裁剪（两次生成共用，按较长的攻略生成提示词计算），PDF中仍收录完整对话"""
+        context = self.context_builder.build(PDF_PROMPT, conversation_history, self._guide_prompt("", user_request), summary)
+        prompt_text = self._format_conversation_history(context.history)
+        if summary:
+            prompt_text = f"**更早对话的摘要**: {summary}\n\n{prompt_text}"
+        return prompt_text
+
+    def _submit(self, conversation_history: list, summary: str, detailed_guide: str, owner: str) -> str:
+        """提交PDF渲染任务，返回任务ID（队列已满时抛出 PdfJobQueueFullError）"""
         conversation_text = self._format_conversation_history(conversation_history)
-        summary = self._generate_conversation_summary(conversation_text, user_request)
-        detailed_guide = self._generate_travel_guide(conversation_text, user_request)
         full_content = f"# 旅行对话记录\n\n{conversation_text}\n\n---\n\n# 详细旅游攻略\n\n{detailed_guide}"
-        pdf_result = self.pdf_generator.generate_travel_pdf(conversation_data=full_content, summary=summary, user_info="user") # user_info can be enhanced
-        return f"📄{pdf_result}"
+        return self.job_queue.submit(owner, full_content, summary=summary, user_info="user") # user_info can be enhanced
+
+    @staticmethod
+    def _job_event(job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        任务状态对应的推送事件：进行中为 {"pdf_job": 状态}；
+        结束后为 {"pdf": {"message": PDF生成结果}, "transcript": 记入对话记录的文本}
+        """
+        if job['status'] == 'done':
+            message = job['result']
+        elif job['status'] == 'failed':
+            message = f"PDF生成失败: {job['error']}"
+        else:
+            return {"pdf_job": {"id": job['id'], "status": job['status'], "position": job.get('position')}}
+        return {"pdf": {"message": message, "job_id": job['id']}, "transcript": f"\n\n📄{message}"}
+
+    @staticmethod
+    def _pending_event(job_id: str) -> Dict[str, Any]:
+        """等待超时：任务仍在后台渲染，前端凭任务ID继续轮询"""
+        return {"pdf_job": {"id": job_id, "status": "pending"},
+                "transcript": f"\n\n📄PDF仍在生成中（任务 {job_id}），完成后可在页面上下载"}
+
+    def _follow_job(self, conversation_history: list, summary: str, detailed_guide: str, owner: str):
+        """提交渲染任务并跟随其状态变化产出事件"""
+        from agent.pdf_jobs import PdfJobQueueFullError, TERMINAL_STATES
+        try:
+            job_id = self._submit(conversation_history, summary, detailed_guide, owner)
+        except PdfJobQueueFullError as e:
+            yield {"pdf": {"message": str(e)}, "transcript": f"\n\n📄{e}"}
+            return
+        job = None
+        for job in self.job_queue.iter_status(job_id, timeout=self.wait_timeout):
+            yield self._job_event(job)
+        if job is None or job['status'] not in TERMINAL_STATES:
+            yield self._pending_event(job_id)
+
+    async def _afollow_job(self, conversation_history: list, summary: str, detailed_guide: str, owner: str):
+        """_follow_job 的异步版本（提交和状态查询不阻塞事件循环）"""
+        from agent.pdf_jobs import PdfJobQueueFullError, TERMINAL_STATES
+        try:
+            job_id = await asyncio.to_thread(self._submit, conversation_history, summary, detailed_guide, owner)
+        except PdfJobQueueFullError as e:
+            yield {"pdf": {"message": str(e)}, "transcript": f"\n\n📄{e}"}
+            return
+        job = None
+        async for job in self.job_queue.aiter_status(job_id, timeout=self.wait_timeout):
+            yield self._job_event(job)
+        if job is None or job['status'] not in TERMINAL_STATES:
+            yield self._pending_event(job_id)
+
+    def generate_pdf(self, user_request: str, conversation_history: list = None, summary: str = "", owner: str = "") -> str:
+        """生成PDF旅游攻略（非流式，返回PDF生成结果）"""
+        result = ""
+        for item in self.generate_pdf_stream(user_request, conversation_history, summary, owner):
+            if isinstance(item, dict) and "transcript" in item:
+                result = item["transcript"].strip()
+        return result or "暂无对话历史记录，无法生成PDF报告。"
+
+    def generate_pdf_stream(self, user_request: str, conversation_history: list = None, summary: str = "", owner: str = ""):
+        """
+        生成PDF旅游攻略：对话总结在线程中进行，同时流式产出攻略正文，最后提交后台渲染任务并跟随其状态
+
+        Yields:
+            str: 攻略正文的文本块
+            dict: {"pdf_job": 任务状态}；最后一项为 {"pdf": {"message": PDF生成结果}, "transcript": 记入对话记录的文本}，
+                  等待超时时为带 transcript 的 {"pdf_job": {"status": "pending"}}
+        """
+        if not conversation_history:
+            yield "暂无对话历史记录，无法生成PDF报告。"
+            return
+
+        prompt_text = self._prepare(user_request, conversation_history, summary)
+        summary_future = self.executor.submit(self._generate_conversation_summary, prompt_text, user_request)
+        detailed_guide = ""
+        for chunk in self.llm_streaming.stream(self._guide_messages(prompt_text, user_request)):
+            if hasattr(chunk, 'content') and chunk.content:
+                detailed_guide += chunk.content
+                yield chunk.content
+        yield from self._follow_job(conversation_history, summary_future.result(), detailed_guide, owner)
+
+    async def agenerate_pdf_stream(self, user_request: str, conversation_history: list = None, summary: str = "",
+                                   owner: str = ""):
+        """generate_pdf_stream 的异步版本"""
+        if not conversation_history:
+            yield "暂无对话历史记录，无法生成PDF报告。"
+            return
+
+        prompt_text = self._prepare(user_request, conversation_history, summary)
+        summary_task = asyncio.ensure_future(self._agenerate_conversation_summary(prompt_text, user_request))
+        try:
+            detailed_guide = ""
+            async for chunk in self.llm_streaming.astream(self._guide_messages(prompt_text, user_request)):
+                if hasattr(chunk, 'content') and chunk.content:
+                    detailed_guide += chunk.content
+                    yield chunk.content
+            conversation_summary = await summary_task
+        finally:
+            summary_task.cancel()
+        async for item in self._afollow_job(conversation_history, conversation_summary, detailed_guide, owner):
+            yield item
     
     def _format_conversation_history(self, conversation_history: list) -> str:
         return "\n\n".join([f"**{msg.get('role', '未知')}**: {msg.get('content', '')}" for msg in conversation_history])
 
-    def _generate_conversation_summary(self, conversation_text: str, user_request: str) -> str:
+    @staticmethod
+    def _summary_messages(conversation_text: str, user_request: str) -> List[BaseMessage]:
         prompt = f"请对以下旅行对话进行总结，提取关键信息：\n{conversation_text}\n当前请求：{user_request}\n总结应简洁明了，不超过200字。"
-        response = self.llm.invoke([SystemMessage(content="你是一个专业的旅行顾问，擅长总结和提炼信息。"), HumanMessage(content=prompt)])
-        return response.content
+        return [SystemMessage(content="你是一个专业的旅行顾问，擅长总结和提炼信息。"), HumanMessage(content=prompt)]
+
+    @staticmethod
+    def _summary_failed(error: Exception) -> str:
+        """对话总结失败时PDF照常生成，只是不含总结"""
+        print(f"生成对话总结失败: {error}")
+        metrics.ERRORS.inc(component='agent', operation='pdf_summary')
+        return ""
+
+    def _generate_conversation_summary(self, conversation_text: str, user_request: str) -> str:
+        try:
+            return self.llm.invoke(self._summary_messages(conversation_text, user_request)).content
+        except Exception as e:
+            return self._summary_failed(e)
+
+    async def _agenerate_conversation_summary(self, conversation_text: str, user_request: str) -> str:
+        try:
+            return (await self.llm.ainvoke(self._summary_messages(conversation_text, user_request))).content
+        except Exception as e:
+            return self._summary_failed(e)
         
-    def _generate_travel_guide(self, conversation_text: str, user_request: str) -> str:
-        prompt = f"基于以下对话内容，生成一份详细的旅游攻略：\n{conversation_text}\n当前需求:{user_request}\n请生成一份完整的旅游攻略,使用能让pdfkit渲染的markdown格式。"
-        response = self.llm.invoke([SystemMessage(content=PDF_PROMPT), HumanMessage(content=prompt)])
-        return response.content
+    @staticmethod
+    def _guide_prompt(conversation_text: str, user_request: str) -> str:
+        return f"基于以下对话内容，生成一份详细的旅游攻略：\n{conversation_text}\n当前需求:{user_request}\n请生成一份完整的旅游攻略,使用能让pdfkit渲染的markdown格式。"
+
+    def _guide_messages(self, conversation_text: str, user_request: str) -> List[BaseMessage]:
+        return [SystemMessage(content=PDF_PROMPT), HumanMessage(content=self._guide_prompt(conversation_text, user_request))]
     
-    def get_response_stream(self, message: str, conversation_history: list):
-        """获取响应流"""
-        full_response = self.generate_pdf(message, conversation_history)
-        yield from StreamingUtils.stream_text(full_response)
+    def get_response_stream(self, message: str, conversation_history: list, summary: str = "", owner: str = ""):
+        """获取响应流：攻略正文实时流式输出，最后产出PDF任务事件"""
+        yield from self.generate_pdf_stream(message, conversation_history, summary, owner)
+
+    async def aget_response_stream(self, message: str, conversation_history: list, summary: str = "", owner: str = ""):
+        """获取异步响应流"""
+        async for item in self.agenerate_pdf_stream(message, conversation_history, summary, owner):
+            yield item
 
 class NormalAgent:
-    """普通对话智能体"""
-    def __init__(self, llm_streaming: ChatOpenAI):
+    """普通对话智能体（可选：前置精确匹配的回复缓存和相似问题索引）"""
+    def __init__(self, llm_streaming: ChatOpenAI, response_cache: Optional[ResponseCache] = None,
+                 similarity_index: Optional[SimilarityIndex] = None):
         self.llm_streaming = llm_streaming
-        print("普通对话智能体已创建")
+        self.context_builder = ContextBuilder('normal')
+        self.response_cache = response_cache
+        self.similarity_index = similarity_index
+        self.replay_cps = float(os.getenv("RESPONSE_CACHE_REPLAY_CPS", "300"))
+        # 系统提示词或模型变化后旧的缓存回复自动失效
+        model = getattr(llm_streaming, 'model_name', '')
+        self.prompt_version = hashlib.sha1(f"{model}\n{GENERAL_SYSTEM_PROMPT}".encode('utf-8')).hexdigest()[:12]
+        print(f"普通对话智能体已创建{'（启用回复缓存）' if response_cache else ''}{'（启用相似问题索引）' if similarity_index else ''}")
 
-    def get_response_stream(self, message: str, conversation_history: list = None):
-        """获取真流式响应（支持对话记忆）"""
-        # 构建包含历史记忆的消息列表
-        messages = [SystemMessage(content=GENERAL_SYSTEM_PROMPT)]
-        
-        # 添加历史对话记忆
-        if conversation_history:
-            for msg in conversation_history[-10:]:  # 只取最近10条消息避免token过多
-                role = msg.get('role', '')
-                content = msg.get('content', '')
-                if role == 'user':
-                    messages.append(HumanMessage(content=content))
-                elif role == 'assistant':
-                    messages.append(AIMessage(content=content))
+    def _build_messages(self, message: str, conversation_history: list = None, summary: str = "",
+                        reference: Optional[SimilarMatch] = None) -> List[BaseMessage]:
+        """构建包含历史记忆的消息列表（reference 为相似历史问题的回答，作为参考放在系统消息中）"""
+        reference_messages = []
+        if reference is not None:
+            answer = truncate_to_tokens(reference.answer, self.context_builder.max_message_tokens)
+            reference_messages.append(SystemMessage(content=(
+                f"以下是一个相似问题的历史回答，可以参考其中的信息，但要针对用户当前的问题作答：\n"
+                f"问题：{reference.question}\n回答：{answer}")))
+        system_prompt = "\n".join([GENERAL_SYSTEM_PROMPT, *(m.content for m in reference_messages)])
+        context = self.context_builder.build(system_prompt, conversation_history, message, summary)
+        messages = [SystemMessage(content=GENERAL_SYSTEM_PROMPT), *summary_messages(summary), *reference_messages]
+        messages.extend(history_to_messages(context.history))
         
         # 添加当前用户消息
         messages.append(HumanMessage(content=message))
+        return messages
+
+    def _cache_key(self, message: str, conversation_history: list, summary: str, agent_type: str) -> Optional[str]:
+        return self.response_cache.make_key(message, agent_type, self.prompt_version, conversation_history, summary)
+
+    def _cache_put(self, key: Optional[str], messages: List[BaseMessage], response: str):
+        prompt_tokens = sum(count_tokens(m.content) for m in messages)
+        self.response_cache.put(key, response, prompt_tokens, count_tokens(response))
+
+    def _find_similar(self, message: str, conversation_history: list, summary: str,
+                      agent_type: str) -> Tuple[str, Optional[SimilarMatch]]:
+        """查询相似问题索引；有历史对话时依赖上下文的问题不查询，其他问题也只把历史回答作为参考、不直接回放"""
+        if self.similarity_index is None:
+            return 'miss', None
+        has_context = bool(conversation_history or summary)
+        if has_context and is_context_dependent(message):
+            return 'bypass', None
+        result, match = self.similarity_index.lookup(message, agent_type, self.prompt_version, allow_serve=not has_context)
+        if match is not None:
+            print(f"相似问题索引 {result}（相似度 {match.score}）: {match.question[:30]}")
+        return result, match
+
+    def get_response_stream(self, message: str, conversation_history: list = None, summary: str = "",
+                            agent_type: str = "general"):
+        """获取真流式响应（支持对话记忆）；缓存或相似问题命中时按流式速度回放已有的回答"""
+        key = None
+        if self.response_cache is not None:
+            key = self._cache_key(message, conversation_history, summary, agent_type)
+            cached = self.response_cache.get(key, agent_type)
+            if cached is not None:
+                yield from self.response_cache.replay(cached['response'])
+                return
+
+        result, match = self._find_similar(message, conversation_history, summary, agent_type)
+        if result == 'serve':
+            yield from replay_text(match.answer, self.replay_cps)
+            return
+
+        messages = self._build_messages(message, conversation_history, summary, match)
         
         # 流式生成响应
+        response = ""
         for chunk in self.llm_streaming.stream(messages):
             if hasattr(chunk, 'content') and chunk.content:
+                response += chunk.content
+                yield chunk.content
+
+        # 只缓存完整生成的回复（中途出错或客户端断开不会走到这里）
+        if self.response_cache is not None:
+            self._cache_put(key, messages, response)
+
+    async def aget_response_stream(self, message: str, conversation_history: list = None, summary: str = "",
+                                   agent_type: str = "general"):
+        """获取异步真流式响应（支持对话记忆，缓存的读写放到线程中执行）"""
+        key = None
+        if self.response_cache is not None:
+            key = self._cache_key(message, conversation_history, summary, agent_type)
+            cached = await asyncio.to_thread(self.response_cache.get, key, agent_type)
+            if cached is not None:
+                async for chunk in self.response_cache.areplay(cached['response']):
+                    yield chunk
+                return
+
+        result, match = self._find_similar(message, conversation_history, summary, agent_type)
+        if result == 'serve':
+            async for chunk in areplay_text(match.answer, self.replay_cps):
+                yield chunk
+            return
+
+        messages = self._build_messages(message, conversation_history, summary, match)
+        
+        response = ""
+        async for chunk in self.llm_streaming.astream(messages):
+            if hasattr(chunk, 'content') and chunk.content:
+                response += chunk.content
                 yield chunk.content
 
+        if self.response_cache is not None:
+            await asyncio.to_thread(self._cache_put, key, messages, response)
+
 # =============================================================================
 # 3. AgentService (The Conductor)
 # 这是一个新的核心类，负责所有组件的初始化、管理和协同工作。
@@ -299,55 +659,171 @@ class AgentService:
         self.llm_factory = LLMFactory(self.config)
         self.mcp_manager = MCPManager(self.config)
         
-        # 懒加载：不在初始化时立即加载MCP工具
+        # 懒加载：不在初始化时立即加载MCP工具（可通过 prewarm() 在启动时提前加载）
         self._mcp_tools = None
         self._tools_loaded = False
+        self._tools_lock = threading.Lock()
+        self._agents = None
+        self._agents_lock = threading.Lock()
         
         # 初始化Redis记忆管理器
         if redis_config is None:
             redis_config = {}
         self.redis_memory_manager = get_redis_memory_manager(**redis_config)
+        # 滑出记忆窗口的旧消息由后台增量折叠进每个会话的滚动摘要
+        self.summarizer = get_rolling_summarizer(self.redis_memory_manager, self._summarize_memory)
+        # 同一对话的旅行参数没变时沿用上次的信息收集结果
+        self.collector_reuse = get_collector_reuse()
+        # 跨用户共享的信息收集结果缓存（按规范化旅行参数）
+        self.collector_cache = get_collector_cache()
         
-        self.agent_sessions: Dict[str, Dict[str, Any]] = {}
+        # 会话记忆和状态都在Redis中，agent_sessions 只是本进程内可随时重建的会话对象缓存（LRU + 空闲TTL）；
+        # 其他进程清除用户会话时通过失效通知丢弃本地缓存
+        self.state_store = get_agent_state_store()
+        self.state_store.subscribe('agent', self._drop_local_sessions)
+        self.agent_sessions = SessionCache(
+            'agent', max_entries=self.config.session_max_entries, idle_ttl=self.config.session_idle_ttl)
         print("AgentService 初始化完成（使用懒加载模式 + Redis记忆）。")
 
     @property
     def mcp_tools(self) -> List[Any]:
-        """懒加载MCP工具"""
+        """懒加载MCP工具（并发的首次请求只会启动一次MCP子进程）"""
         if not self._tools_loaded:
-            print("首次请求MCP工具，开始加载...")
-            self._mcp_tools = self.mcp_manager.load_tools_sync()
-            self._tools_loaded = True
-            print(f"MCP工具加载完成，共 {len(self._mcp_tools)} 个工具")
+            with self._tools_lock:
+                if not self._tools_loaded:
+                    print("首次请求MCP工具，开始加载...")
+                    self._mcp_tools = self.mcp_manager.load_pooled_tools()
+                    self._tools_loaded = True
+                    print(f"MCP工具加载完成，共 {len(self._mcp_tools)} 个工具")
         return self._mcp_tools
 
+    def prewarm(self) -> Dict[str, Any]:
+        """
+        启动预热：加载MCP工具、检查Redis连接、与LLM服务端建立连接、同步相似问题索引、启动PDF任务队列
+
+        每一步单独计时，失败不会中断后续步骤。
+
+        Returns:
+            Dict: 各步骤的结果 {step: {'ok': bool, 'ms': int, ...}}
+        """
+        def mcp_tools():
+            return {'tools': len(self.mcp_tools)}
+
+        def redis():
+            manager = self.redis_memory_manager
+            if manager.use_redis:
+                manager.redis_client.ping()
+            return {'using_redis': manager.use_redis}
+
+        def llm():
+            self.agents  # 提前创建共享的LLM实例和智能体对象
+            return {'status': self.llm_factory.warmup()}
+
+        def similarity_index():
+            index = get_similarity_index()
+            return {'added': index.refresh(), 'documents': len(index.docs)} if index else {'enabled': False}
+
+        def pdf_jobs():
+            # 启动渲染进程池的调度线程，接手租约已过期的任务
+            from agent.pdf_jobs import get_pdf_job_queue
+            job_queue = get_pdf_job_queue()
+            job_queue.start()
+            return {'recovered': job_queue.recover(), 'workers': job_queue.workers}
+
+        results = {}
+        for name, step in (('mcp_tools', mcp_tools), ('redis', redis), ('llm', llm),
+                           ('similarity_index', similarity_index), ('pdf_jobs', pdf_jobs)):
+            started = time.perf_counter()
+            try:
+                results[name] = {'ok': True, **step()}
+            except Exception as e:
+                print(f"预热步骤 {name} 失败: {e}")
+                metrics.ERRORS.inc(component='prewarm', operation=name)
+                results[name] = {'ok': False, 'error': str(e)}
+            results[name]['ms'] = int((time.perf_counter() - started) * 1000)
+        return results
+
+    def _summarize_memory(self, previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+        """把新滑出窗口的消息折叠进已有摘要（滚动摘要后台线程调用）"""
+        max_chars = self.config.memory_summary_max_chars
+        llm = self.llm_factory.create_llm(streaming=False)
+        content = f"已有摘要：\n{previous_summary or '（无）'}\n\n新的对话：\n{format_messages(messages)}"
+        response = llm.invoke([SystemMessage(content=MEMORY_SUMMARY_PROMPT.format(max_chars=max_chars)),
+                               HumanMessage(content=content)])
+        return response.content.strip()[:max_chars * 2]
+
+    @property
+    def agents(self) -> Dict[str, Any]:
+        """进程内共享的智能体对象（无状态，对话历史由调用方传入），首次访问时创建"""
+        if self._agents is None:
+            with self._agents_lock:
+                if self._agents is None:
+                    llm_normal = self.llm_factory.create_llm(streaming=False)
+                    llm_streaming = self.llm_factory.create_llm(streaming=True)
+                    collector = InformationCollectorAgent(llm_normal, self.mcp_tools)  # 这里才会触发工具加载
+                    self._agents = {
+                        'collector': collector,
+                        'prefetcher': TravelPrefetchAgent(self.mcp_tools, collector, self.collector_cache),
+                        'planner': PlannerAgent(llm_streaming, llm_normal),
+                        'pdf_agent': PdfAgent(llm_normal, llm_streaming),
+                        'normal_agent': NormalAgent(llm_streaming, get_response_cache(), get_similarity_index()),
+                    }
+        return self._agents
+
     def _create_agent_session(self, user_email: str, conv_id: str) -> Dict[str, Any]:
-        """为新用户创建一套完整的智能体和记忆"""
+        """为新会话创建记忆；智能体对象是进程内共享的，会话只持有自己的记忆"""
         print(f"为用户 {user_email} 创建新的智能体 Session...")
-        llm_normal = self.llm_factory.create_llm(streaming=False)
-        llm_streaming = self.llm_factory.create_llm(streaming=True)
-        
-        # 创建会话特定的记忆
         session_key = f"{user_email}_{conv_id}"
-        memory = RedisSimpleMemory(session_key, self.redis_memory_manager)
-        
-        return {
-            'collector': InformationCollectorAgent(llm_normal, self.mcp_tools),  # 这里才会触发工具加载
-            'planner': PlannerAgent(llm_streaming, llm_normal),
-            'pdf_agent': PdfAgent(llm_normal),
-            'normal_agent': NormalAgent(llm_streaming),
-            'memory': memory,
-        }
+        return {**self.agents, 'memory': RedisSimpleMemory(session_key, self.redis_memory_manager)}
 
     def get_or_create_agent_session(self, user_email: str, conv_id: str) -> Dict[str, Any]:
         """获取或创建用户的智能体会话"""
         session_key = f"{user_email}_{conv_id}"
-        if session_key not in self.agent_sessions:
-            self.agent_sessions[session_key] = self._create_agent_session(user_email, conv_id)
-        return self.agent_sessions[session_key]
+        self.agents  # 共享智能体的首次创建（可能加载MCP工具）不占用会话缓存的锁
+        return self.agent_sessions.get_or_create(
+            session_key, user_email, lambda: self._create_agent_session(user_email, conv_id))
+
+    async def _collect_stream(self, session: Dict[str, Any], user_message: str, form_data: Optional[Dict[str, Any]],
+                              plan: CollectionPlan):
+        """
+        信息收集阶段：结构化表单走确定性并发预取（按调用查跨用户缓存），自由文本走LLM信息收集智能体
+        （完整收集且消息完整描述了搜索内容时，按规范化的旅行参数、偏好和问到的信息类别查跨用户缓存）；补充查询时只查受影响的信息类别
+        """
+        request = plan.request if plan.action == EXTEND else user_message
+        if plan.action == EXTEND:
+            print(f"旅行规划流程: [1] 旅行参数部分变化，只补充查询 {', '.join(plan.topics)}")
+        if form_data:
+            print("旅行规划流程: [1] 按表单并发预取...")
+            async for item in session['prefetcher'].astream_collect(form_data, request, plan.topics):
+                yield item
+            return
 
-    def get_response_stream(self, user_message: str, user_email: str, agent_type: str = "general", conv_id: Optional[str] = None):
-        """处理用户请求并返回响应流（支持Redis记忆）"""
+        # 只有消息本身完整描述了搜索内容（出发地、目的地、日期/天数齐全，没有参数之外的要求）时才使用跨用户缓存
+        cache_fields = None
+        if self.collector_cache is not None and plan.action == COLLECT:
+            cache_fields = collector_cache_fields(user_message)
+        if cache_fields:
+            cached = None if plan.refresh else await asyncio.to_thread(self.collector_cache.get, COLLECTOR_TOPIC, cache_fields)
+            if cached:
+                print("旅行规划流程: [1] 使用相同旅行参数的缓存信息")
+                yield "progress", {"type": "cached"}
+                yield "result", cached
+                return
+
+        print("旅行规划流程: [1] 信息收集中...")
+        async for kind, value in session['collector'].astream_collect(request):
+            if kind == "result" and cache_fields and session['collector'].agent is not None:
+                await asyncio.to_thread(self.collector_cache.put, COLLECTOR_TOPIC, cache_fields, value,
+                                        cache_fields['destination'])
+            yield kind, value
+
+    def get_response_stream(self, user_message: str, user_email: str, agent_type: str = "general",
+                            conv_id: Optional[str] = None, form_data: Optional[Dict[str, Any]] = None):
+        """
+        处理用户请求并返回响应流（支持Redis记忆）；产出文本块，旅行规划的信息收集阶段另外产出 {"progress": ...} 事件
+
+        form_data 为 /plan_travel 提交的结构化表单，提供时跳过LLM信息收集，直接按表单字段并发预取
+        """
         if not conv_id:
             raise ValueError("Conversation ID (conv_id) 不能为空")
             
@@ -358,37 +834,59 @@ class AgentService:
             
             # 获取对话历史记忆
             conversation_history = memory.messages
+            summary = memory.summary
 
             if agent_type == "general":
                 agent = session['normal_agent']
-                generator = agent.get_response_stream(user_message, conversation_history)
+                generator = agent.get_response_stream(user_message, conversation_history, summary, agent_type)
             
             elif agent_type == "travel":
-                if is_travel_planning_request(user_message):
+                if form_data or is_travel_planning_request(user_message):
                     # Multi-agent workflow with memory
-                    collector_agent = session['collector']
                     planner_agent = session['planner']
                     
-                    print("旅行规划流程: [1] 信息收集中...")
-                    collected_info = AsyncSyncWrapper.run_async_in_thread(lambda: collector_agent.collect_information_async(user_message))
+                    session_key = f"{user_email}_{conv_id}"
+                    plan = self.collector_reuse.plan(self.state_store.get(session_key), user_message, form_data)
+                    collected_info = plan.previous_info
+                    if plan.action == REUSE:
+                        print("旅行规划流程: [1] 旅行参数未变化，沿用本对话已收集的信息")
+                        yield {"progress": {"type": "reused"}}
+                    else:
+                        # 收集过程中的工具调用等进度以 {"progress": ...} 事件推送，不计入回复正文
+                        with metrics.COLLECTOR_SECONDS.time(agent_type=agent_type):
+                            for kind, value in get_background_loop().iterate(
+                                    self._collect_stream(session, user_message, form_data, plan), timeout=60):
+                                if kind == "progress":
+                                    yield {"progress": value}
+                                else:
+                                    collected_info = plan.combine(value)
+                        self.state_store.update(session_key, **plan.state(user_message, collected_info))
                     print("旅行规划流程: [2] 开始流式规划...")
-                    generator = planner_agent.get_response_stream(user_message, collected_info, conversation_history)
+                    generator = planner_agent.get_response_stream(user_message, collected_info, conversation_history, summary)
                 else:
                     # Simple travel question with memory
                     agent = session['normal_agent']
-                    generator = agent.get_response_stream(user_message, conversation_history)
+                    generator = agent.get_response_stream(user_message, conversation_history, summary, agent_type)
 
             elif agent_type == "pdf_generator":
                 agent = session['pdf_agent']
-                generator = agent.get_response_stream(user_message, conversation_history)
+                generator = agent.get_response_stream(user_message, conversation_history, summary, owner=user_email)
             
             else:
                 raise ValueError(f"未知的智能体类型: {agent_type}")
 
             # 从生成器消费内容并更新记忆
+            timer = metrics.GenerationTimer(agent_type)
             for chunk in generator:
+                if isinstance(chunk, dict):
+                    # 控制事件（如PDF下载链接）原样推送，transcript 部分记入对话记录
+                    full_response += chunk.get("transcript", "")
+                    yield chunk
+                    continue
+                timer.chunk()
                 full_response += chunk
                 yield chunk
+            timer.finish()
             
             # 保存对话到Redis记忆中
             memory.add_message("user", user_message)
@@ -398,6 +896,7 @@ class AgentService:
         except Exception as e:
             error_msg = f"抱歉，处理您的请求时出现了问题: {str(e)}"
             print(f"处理请求时发生严重错误: {e}\n{traceback.format_exc()}")
+            metrics.ERRORS.inc(component='agent', operation=agent_type)
             yield error_msg
             
             # 即使出错也保存到记忆中
@@ -407,33 +906,112 @@ class AgentService:
             except:
                 pass
     
+    async def aget_response_stream(self, user_message: str, user_email: str, agent_type: str = "general",
+                                   conv_id: Optional[str] = None, form_data: Optional[Dict[str, Any]] = None):
+        """处理用户请求并返回异步响应流（ASGI模式使用，与 get_response_stream 行为一致）"""
+        if not conv_id:
+            raise ValueError("Conversation ID (conv_id) 不能为空")
+            
+        full_response = ""
+        memory = None
+        try:
+            # 会话创建可能触发MCP工具加载，Redis读取也是同步调用，都放到线程中执行
+            session = await asyncio.to_thread(self.get_or_create_agent_session, user_email, conv_id)
+            memory = session['memory']
+            conversation_history, summary = await asyncio.to_thread(lambda: (memory.messages, memory.summary))
+
+            if agent_type == "general":
+                agent = session['normal_agent']
+                generator = agent.aget_response_stream(user_message, conversation_history, summary, agent_type)
+            
+            elif agent_type == "travel":
+                if form_data or is_travel_planning_request(user_message):
+                    planner_agent = session['planner']
+                    
+                    session_key = f"{user_email}_{conv_id}"
+                    state = await asyncio.to_thread(self.state_store.get, session_key)
+                    plan = self.collector_reuse.plan(state, user_message, form_data)
+                    collected_info = plan.previous_info
+                    if plan.action == REUSE:
+                        print("旅行规划流程: [1] 旅行参数未变化，沿用本对话已收集的信息")
+                        yield {"progress": {"type": "reused"}}
+                    else:
+                        with metrics.COLLECTOR_SECONDS.time(agent_type=agent_type):
+                            async for kind, value in self._collect_stream(session, user_message, form_data, plan):
+                                if kind == "progress":
+                                    yield {"progress": value}
+                                else:
+                                    collected_info = plan.combine(value)
+                        await asyncio.to_thread(self.state_store.update, session_key,
+                                                **plan.state(user_message, collected_info))
+                    print("旅行规划流程: [2] 开始流式规划...")
+                    generator = planner_agent.aget_response_stream(user_message, collected_info, conversation_history, summary)
+                else:
+                    agent = session['normal_agent']
+                    generator = agent.aget_response_stream(user_message, conversation_history, summary, agent_type)
+
+            elif agent_type == "pdf_generator":
+                agent = session['pdf_agent']
+                generator = agent.aget_response_stream(user_message, conversation_history, summary, owner=user_email)
+            
+            else:
+                raise ValueError(f"未知的智能体类型: {agent_type}")
+
+            timer = metrics.GenerationTimer(agent_type)
+            async for chunk in generator:
+                if isinstance(chunk, dict):
+                    full_response += chunk.get("transcript", "")
+                    yield chunk
+                    continue
+                timer.chunk()
+                full_response += chunk
+                yield chunk
+            timer.finish()
+            
+            await asyncio.to_thread(memory.add_message, "user", user_message)
+            await asyncio.to_thread(memory.add_message, "assistant", full_response)
+            print("💾 已保存对话到Redis记忆")
+
+        except Exception as e:
+            error_msg = f"抱歉，处理您的请求时出现了问题: {str(e)}"
+            print(f"处理请求时发生严重错误: {e}\n{traceback.format_exc()}")
+            metrics.ERRORS.inc(component='agent', operation=agent_type)
+            yield error_msg
+            
+            try:
+                if memory is not None:
+                    await asyncio.to_thread(memory.add_message, "user", user_message)
+                    await asyncio.to_thread(memory.add_message, "assistant", error_msg)
+            except:
+                pass
+    
     def clear_user_sessions(self, user_email: str) -> int:
-        """清除用户的所有会话记忆"""
-        cleared_count = 0
-        keys_to_delete = []
-        
-        # 找到所有需要清除的会话
-        for session_key in list(self.agent_sessions.keys()):
-            if session_key.startswith(user_email):
-                keys_to_delete.append(session_key)
-        
-        # 清除内存中的会话
-        for key in keys_to_delete:
-            if key in self.agent_sessions:
-                # 清除Redis记忆
-                memory = self.agent_sessions[key]['memory']
-                memory.clear()
-                # 删除会话
-                del self.agent_sessions[key]
-                cleared_count += 1
-        
+        """清除用户的所有会话记忆和状态（包括其他工作进程创建的会话），并通知所有进程丢弃本地缓存"""
+        cleared_count = self.state_store.delete_sessions(f"{user_email}_")
+        self.state_store.invalidate('agent', user_email)
         print(f"已清除用户 {user_email} 的 {cleared_count} 个会话记忆")
         return cleared_count
+
+    def _drop_local_sessions(self, user_email: str):
+        """丢弃本进程缓存的该用户智能体对象（失效通知回调）"""
+        self.agent_sessions.pop_user(user_email)
     
     def get_memory_stats(self) -> Dict[str, Any]:
         """获取记忆统计信息"""
         stats = self.redis_memory_manager.get_memory_stats()
         stats["active_agent_sessions"] = len(self.agent_sessions)
+        stats["agent_session_cache"] = self.agent_sessions.get_stats()
+        stats["memory_summary"] = self.summarizer.get_stats() if self.summarizer else None
+        stats["collector_reuse"] = self.collector_reuse.get_stats()
+        stats["collector_cache"] = self.collector_cache.get_stats() if self.collector_cache else None
+        response_cache = get_response_cache()
+        stats["response_cache"] = response_cache.get_stats() if response_cache else None
+        similarity_index = get_similarity_index()
+        stats["similarity_index"] = similarity_index.get_stats() if similarity_index else None
+        from agent.pdf_jobs import get_pdf_job_queue
+        stats["pdf_jobs"] = get_pdf_job_queue().get_stats()
+        stats["mcp_pool"] = self.mcp_manager.get_pool_stats()
+        stats["llm_clients"] = self.llm_factory.registry.get_stats()
         return stats
 
 # =============================================================================
@@ -442,12 +1020,15 @@ class AgentService:
 # =============================================================================
 
 _agent_service = None
+_agent_service_lock = threading.Lock()
 
 def get_agent_service(redis_config=None) -> AgentService:
-    """获取全局AgentService实例（懒加载）"""
+    """获取全局AgentService实例（懒加载，线程安全）"""
     global _agent_service
     if _agent_service is None:
-        _agent_service = AgentService(redis_config=redis_config)
+        with _agent_service_lock:
+            if _agent_service is None:
+                _agent_service = AgentService(redis_config=redis_config)
     return _agent_service
 
 # --- 旧函数接口，现在代理到 AgentService ---
@@ -458,6 +1039,10 @@ def get_agent_response_stream(user_message, user_email, agent_type="general", co
     """
     return get_agent_service().get_response_stream(user_message, user_email, agent_type, conv_id)
 
+def aget_agent_response_stream(user_message, user_email, agent_type="general", conv_id=None):
+    """[异步接口] AgentService.aget_response_stream 的包装，供ASGI模式使用"""
+    return get_agent_service().aget_response_stream(user_message, user_email, agent_type, conv_id)
+
 def load_mcp_tools_async():
     """[兼容性接口] 异步加载MCP工具"""
     return get_agent_service().mcp_manager.load_tools_async()
@@ -1,21 +1,29 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain.memory import ConversationBufferMemory
-from langchain_community.tools import DuckDuckGoSearchRun
-from langchain.tools import Tool
 import requests
 import json
 import time
 from typing import List, Dict, Optional, Any
 import asyncio
-import aiohttp
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 import os
+import threading
 from dotenv import load_dotenv
-from pydantic import SecretStr
+
+try:
+    from .redis_memory import get_redis_memory_manager, SimpleMemory as RedisSimpleMemory
+    from .agent_state import get_agent_state_store
+    from .llm_pool import get_llm_registry
+    from .session_cache import SessionCache
+    from .context_builder import ContextBuilder
+except ImportError:
+    from agent.redis_memory import get_redis_memory_manager, SimpleMemory as RedisSimpleMemory
+    from agent.agent_state import get_agent_state_store
+    from agent.llm_pool import get_llm_registry
+    from agent.session_cache import SessionCache
+    from agent.context_builder import ContextBuilder
 
 load_dotenv()
 
@@ -188,39 +196,42 @@ class SearchAPIService:
 
 # ===== 增强版导游智能体 =====
 class EnhancedTourGuideAgent:
-    def __init__(self, gaode_key: str = ""):
-        load_dotenv()
-        
-        # 获取API配置 - 使用OpenAI API
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        self.base_url = os.getenv("OPENAI_API_URL")
-        
-        if not self.api_key:
-            raise ValueError("未配置OpenAI API密钥")
-        
-        # 初始化大模型 - 使用OpenAI的gpt-4.1-nano模型
-        self.llm = ChatOpenAI(
-            temperature=0.7,
-            api_key=SecretStr(self.api_key),
-            model="gpt-4.1-nano",  # 使用gpt-4.1-nano模型
-            base_url=self.base_url,
-            streaming=True
-        )
+    def __init__(self, gaode_key: str = "", email: str = ""):
+        # 大模型实例由进程内的LLM客户端注册表共享（gpt-4.1-nano，共用HTTP连接池），不再每个用户各建一个
+        self.llm = get_llm_registry().get(model="gpt-4.1-nano", temperature=0.7, streaming=True)
         
         # 初始化服务
         self.map_service = MapAPIService(gaode_key)
         self.search_service = SearchAPIService()
         
-        # 初始化记忆
-        self.memory = ConversationBufferMemory(
-            memory_key="history",
-            return_messages=True
-        )
+        # 讲解记忆和风格等状态存放在Redis中，任何工作进程都能据此重建导游智能体
+        self.email = email
+        self.session_key = f"tour_guide:{email}"
+        self.memory = RedisSimpleMemory(self.session_key, get_redis_memory_manager())
+        self.context_builder = ContextBuilder('attraction_guide')
+        self.state_store = get_agent_state_store()
+        state = self.state_store.get(self.session_key)
         
-        self.current_style = "学术型"
-        self.current_attractions = []
+        self.current_style = state.get("style", "学术型")
+        self.current_attractions = [Attraction(**item) for item in json.loads(state.get("attractions", "[]"))]
         self.chain = self._create_chain()
     
+    def _load_history(self, user_input: str = "") -> list:
+        """从Redis记忆构建对话历史消息（在token预算内从最新往前放入）"""
+        summary = self.memory.summary
+        system_prompt = self._get_enhanced_system_prompt()
+        context = self.context_builder.build(system_prompt, self.memory.messages, user_input, summary)
+        history = [SystemMessage(content=f"以下是与用户更早对话的摘要：\n{summary}")] if summary else []
+        for message in context.history:
+            message_class = HumanMessage if message.get("role") == "user" else AIMessage
+            history.append(message_class(content=message.get("content", "")))
+        return history
+
+    def _save_turn(self, user_input: str, response: str):
+        """保存一轮讲解到Redis记忆"""
+        self.memory.add_message("user", user_input)
+        self.memory.add_message("assistant", response)
+
     def _create_chain(self):
         prompt = ChatPromptTemplate.from_messages([
             SystemMessage(content=self._get_enhanced_system_prompt()),
@@ -298,12 +309,18 @@ class EnhancedTourGuideAgent:
         - 注意事项3
         """
     
+    def _save_state(self, **fields):
+        """写入Redis状态，并通知其他工作进程丢弃缓存的旧实例（下次请求从Redis重建）"""
+        self.state_store.update(self.session_key, **fields)
+        self.state_store.invalidate('tour_guide', self.email)
+
     def set_style(self, style: str):
         """设置讲解风格"""
         valid_styles = ["学术型", "故事型", "亲子型", "网红风格", "幽默诙谐"]
         if style in valid_styles:
             self.current_style = style
             self.chain = self._create_chain()
+            self._save_state(style=style)
             return f"已切换为【{style}】讲解风格"
         return "无效的风格选择"
     
@@ -312,6 +329,7 @@ class EnhancedTourGuideAgent:
         print(f"🔍 正在搜索 {location} 附近 {radius/1000}km 范围内的景点...")
         attractions = self.map_service.get_nearby_attractions_gaode(location, radius)
         self.current_attractions = attractions
+        self._save_state(attractions=[asdict(a) for a in attractions])
         return attractions
     
     def introduce_attraction_with_search(self, attraction: Attraction, city: str = "") -> str:
@@ -344,14 +362,11 @@ class EnhancedTourGuideAgent:
         # 调用模型
         response = self.chain.invoke({
             "input": query,
-            "history": self.memory.load_memory_variables({})["history"]
+            "history": self._load_history(query)
         })
         
         # 保存到记忆
-        self.memory.save_context(
-            {"input": f"介绍{attraction.name}"},
-            {"output": response}
-        )
+        self._save_turn(f"介绍{attraction.name}", response)
         
         return response
     
@@ -376,11 +391,9 @@ class EnhancedTourGuideAgent:
         
         return filtered
 
-    def stream_attraction_guide(self, user_input: str):
-        """流式返回景点讲解内容"""
-        try:
-            # 增强用户输入，添加更多上下文
-            enhanced_input = f"""
+    def _build_guide_input(self, user_input: str) -> str:
+        """增强用户输入，添加更多上下文"""
+        return f"""
             作为专业的景点讲解员，请用{self.current_style}风格详细介绍用户询问的景点。
             
             用户请求：{user_input}
@@ -394,18 +407,20 @@ class EnhancedTourGuideAgent:
             
             请严格按照系统提示中的输出格式要求来组织内容。
             """
+
+    def stream_attraction_guide(self, user_input: str):
+        """流式返回景点讲解内容"""
+        try:
+            enhanced_input = self._build_guide_input(user_input)
             
             # 调用AI模型
             response = self.chain.invoke({
                 "input": enhanced_input,
-                "history": self.memory.load_memory_variables({})["history"]
+                "history": self._load_history(enhanced_input)
             })
             
             # 保存到记忆
-            self.memory.save_context(
-                {"input": user_input},
-                {"output": response}
-            )
+            self._save_turn(user_input, response)
             
             # 优化流式输出，按句子分割而不是单词
             sentences = response.replace('\n\n', '\n').split('\n')
@@ -422,21 +437,61 @@ class EnhancedTourGuideAgent:
             print(f"景点讲解错误: {e}")
             yield error_message
 
-# 全局变量存储用户的导游智能体实例
-user_tour_guide_agents = {}
+    async def astream_attraction_guide(self, user_input: str):
+        """异步流式返回景点讲解内容（ASGI模式使用，等待期间不占用线程）"""
+        try:
+            enhanced_input = self._build_guide_input(user_input)
+            
+            history = await asyncio.to_thread(self._load_history, enhanced_input)
+            response = await self.chain.ainvoke({
+                "input": enhanced_input,
+                "history": history
+            })
+            
+            await asyncio.to_thread(self._save_turn, user_input, response)
+            
+            sentences = response.replace('\n\n', '\n').split('\n')
+            for sentence in sentences:
+                if sentence.strip():
+                    yield sentence + '\n'
+                    await asyncio.sleep(0.03)
+                else:
+                    yield '\n'
+                    await asyncio.sleep(0.01)
+                
+        except Exception as e:
+            error_message = f"抱歉，在处理您的请求时出现了错误：{str(e)}"
+            print(f"景点讲解错误: {e}")
+            yield error_message
+
+# 本进程缓存的导游智能体实例（可由Redis中的状态随时重建；LRU + 空闲TTL，配置与智能体会话缓存相同）
+user_tour_guide_agents = SessionCache(
+    'tour_guide',
+    max_entries=int(os.getenv("AGENT_SESSION_MAX", "1000")),
+    idle_ttl=float(os.getenv("AGENT_SESSION_IDLE_TTL", "1800")),
+)
+
+def _create_tour_guide_agent(email: str) -> EnhancedTourGuideAgent:
+    # 其他进程清除用户导游记忆时丢弃本地缓存（重复登记无效）
+    get_agent_state_store().subscribe('tour_guide', user_tour_guide_agents.pop_user)
+    return EnhancedTourGuideAgent(email=email)
 
 def get_tour_guide_agent(email: str) -> EnhancedTourGuideAgent:
     """获取或创建用户的导游智能体实例"""
-    if email not in user_tour_guide_agents:
-        user_tour_guide_agents[email] = EnhancedTourGuideAgent()
-    return user_tour_guide_agents[email]
+    return user_tour_guide_agents.get_or_create(email, email, lambda: _create_tour_guide_agent(email))
 
 def clear_tour_guide_agents(email: str):
-    """清除用户的导游智能体实例"""
-    if email in user_tour_guide_agents:
-        del user_tour_guide_agents[email]
+    """清除用户的导游记忆和状态，并通知所有工作进程丢弃缓存的导游智能体"""
+    store = get_agent_state_store()
+    store.delete(f"tour_guide:{email}")
+    store.invalidate('tour_guide', email)
 
 def get_attraction_guide_response_stream(user_message: str, email: str):
     """获取景点讲解的流式响应"""
     agent = get_tour_guide_agent(email)
-    return agent.stream_attraction_guide(user_message)
\ No newline at end of file
+    return agent.stream_attraction_guide(user_message)
+
+def aget_attraction_guide_response_stream(user_message: str, email: str):
+    """获取景点讲解的异步流式响应"""
+    agent = get_tour_guide_agent(email)
+    return agent.astream_attraction_guide(user_message)
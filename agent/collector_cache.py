@@ -0,0 +1,212 @@
+"""
+跨用户的旅行信息收集缓存模块
+不同用户规划同一目的地、同一日期时，信息收集会发起完全相同的航班、酒店、景点搜索。
+本模块把搜索结果按规范化的旅行参数缓存在Redis中，所有用户、所有工作进程共享：
+
+- 表单预取：每个工具调用单独缓存，键为信息类别 + 规范化的调用参数（由出发地、目的地、日期、人数、住宿偏好等推导）
+- 自由文本的信息收集智能体：整份收集结果缓存，键为规范化的（出发地, 目的地, 日期/天数, 人数, 预算档位, 偏好, 问到的信息类别）；
+  只有消息本身完整描述了搜索内容时才使用（缺出发地或日期/天数、或有参数之外的要求时不缓存）
+- 过期时间按数据的变化频率区分：航班最短，酒店其次，景点、餐厅最长；
+  整份收集结果按其中包含的变化最快的信息类别取过期时间
+
+失效：python redis_viewer.py invalidate-collector [目的地] [类别]
+
+配置（环境变量）:
+    COLLECTOR_CACHE_ENABLED             是否启用（默认1）
+    COLLECTOR_CACHE_TTL_FLIGHTS         航班结果的过期时间（秒，默认1800）
+    COLLECTOR_CACHE_TTL_HOTELS          酒店结果的过期时间（秒，默认21600）
+    COLLECTOR_CACHE_TTL_ATTRACTIONS     景点结果的过期时间（秒，默认604800）
+    COLLECTOR_CACHE_TTL_RESTAURANTS     餐厅结果的过期时间（秒，默认259200）
+    COLLECTOR_CACHE_MAX_ENTRIES         Redis不可用时进程内缓存的最大条数（默认1000）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+try:
+    from .redis_memory import get_redis_memory_manager
+    from .trip_context import TOPIC_KEYWORDS, TOPIC_NAMES
+except ImportError:
+    from agent.redis_memory import get_redis_memory_manager
+    from agent.trip_context import TOPIC_KEYWORDS, TOPIC_NAMES
+
+CACHE_PREFIX = 'collector_cache:'
+INDEX_PREFIX = 'collector_cache_index:'
+# 信息收集智能体的整份结果
+COLLECTOR_TOPIC = 'collector'
+CACHE_TOPICS = (*TOPIC_NAMES, COLLECTOR_TOPIC)
+
+COLLECTOR_CACHE_REQUESTS = metrics.registry.counter(
+    'collector_cache_requests_total', '跨用户信息收集缓存查询次数', ('topic', 'result'))
+COLLECTOR_CACHE_INVALIDATIONS = metrics.registry.counter(
+    'collector_cache_invalidations_total', '手动失效的信息收集缓存条数')
+
+
+class CollectorCache:
+    """按规范化旅行参数缓存信息收集结果（Redis共享，不可用时退化为进程内LRU）"""
+
+    def __init__(self, redis_memory=None, ttls: Optional[Dict[str, int]] = None, max_entries: int = 1000):
+        memory = redis_memory or get_redis_memory_manager()
+        self.redis = memory.redis_client if memory.use_redis else None
+        self.ttls = {'flights': 1800, 'hotels': 21600, 'attractions': 604800, 'restaurants': 259200, **(ttls or {})}
+        self.max_entries = max_entries
+        self._fallback: "OrderedDict[str, Tuple[float, str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "invalidated": 0}
+
+    # ---------------- 键与过期时间 ----------------
+    @staticmethod
+    def make_key(topic: str, fields: Dict[str, Any]) -> str:
+        """信息类别 + 规范化字段的摘要；空值不参与，字段顺序无关"""
+        normalized = {name: value for name, value in fields.items() if value not in (None, '', 0, [], {})}
+        digest = hashlib.sha256(json.dumps(normalized, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{CACHE_PREFIX}{topic}:{digest[:32]}"
+
+    def ttl_for(self, topic: str, text: str = "") -> int:
+        """按信息类别取过期时间；整份收集结果取其中包含的变化最快的类别"""
+        if topic in self.ttls:
+            return self.ttls[topic]
+        lowered = text.lower()
+        found = [self.ttls[name] for name, keywords in TOPIC_KEYWORDS.items() if any(word in lowered for word in keywords)]
+        return min(found) if found else self.ttls['attractions']
+
+    # ---------------- 读写 ----------------
+    def get(self, topic: str, fields: Dict[str, Any]) -> Optional[str]:
+        key = self.make_key(topic, fields)
+        text = None
+        if self.redis is None:
+            with self._lock:
+                entry = self._fallback.get(key)
+                if entry and entry[0] > time.time():
+                    self._fallback.move_to_end(key)
+                    text = entry[2]
+                elif entry:
+                    del self._fallback[key]
+        else:
+            try:
+                with metrics.REDIS_SECONDS.time(operation='collector_cache_get'):
+                    text = self.redis.get(key)
+            except Exception as e:
+                print(f"读取信息收集缓存失败: {e}")
+                metrics.ERRORS.inc(component='collector_cache', operation='get')
+        self._count("hits" if text else "misses")
+        COLLECTOR_CACHE_REQUESTS.inc(topic=topic, result='hit' if text else 'miss')
+        return text
+
+    def put(self, topic: str, fields: Dict[str, Any], text: str, destination: str = "", ttl: Optional[int] = None):
+        """写入结果；destination 用于按目的地失效"""
+        if not text:
+            return
+        key = self.make_key(topic, fields)
+        ttl = ttl or self.ttl_for(topic, text)
+        destination = (destination or '').strip().casefold()
+        if self.redis is None:
+            with self._lock:
+                self._fallback[key] = (time.time() + ttl, destination, text)
+                self._fallback.move_to_end(key)
+                while len(self._fallback) > self.max_entries:
+                    self._fallback.popitem(last=False)
+        else:
+            try:
+                with metrics.REDIS_SECONDS.time(operation='collector_cache_put'):
+                    pipe = self.redis.pipeline()
+                    pipe.set(key, text, ex=ttl)
+                    if destination:
+                        index = f"{INDEX_PREFIX}{destination}"
+                        pipe.sadd(index, key)
+                        pipe.expire(index, max(self.ttls.values()))
+                    pipe.execute()
+            except Exception as e:
+                print(f"写入信息收集缓存失败: {e}")
+                metrics.ERRORS.inc(component='collector_cache', operation='put')
+                return
+        self._count("writes")
+
+    # ---------------- 失效 ----------------
+    def invalidate(self, destination: Optional[str] = None, topic: Optional[str] = None) -> int:
+        """
+        删除缓存条目
+
+        Args:
+            destination: 只删除该目的地的条目（不填为全部目的地）
+            topic: 只删除该类别的条目（flights/hotels/attractions/restaurants/collector，不填为全部类别）
+
+        Returns:
+            int: 删除的条目数
+        """
+        destination = (destination or '').strip().casefold()
+        prefix = f"{CACHE_PREFIX}{topic}:" if topic else CACHE_PREFIX
+        if self.redis is None:
+            with self._lock:
+                keys = [key for key, (_, dest, _) in self._fallback.items()
+                        if key.startswith(prefix) and (not destination or dest == destination)]
+                for key in keys:
+                    del self._fallback[key]
+            removed = len(keys)
+        elif destination:
+            index = f"{INDEX_PREFIX}{destination}"
+            keys = [key for key in self.redis.smembers(index) if key.startswith(prefix)]
+            removed = self.redis.delete(*keys) if keys else 0
+            if keys:
+                self.redis.srem(index, *keys)
+        else:
+            removed = 0
+            batch = []
+            for key in self.redis.scan_iter(f"{prefix}*", count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    removed += self.redis.delete(*batch)
+                    batch = []
+            if batch:
+                removed += self.redis.delete(*batch)
+            if not topic:
+                index_keys = list(self.redis.scan_iter(f"{INDEX_PREFIX}*", count=500))
+                if index_keys:
+                    self.redis.delete(*index_keys)
+        with self._lock:
+            self.stats["invalidated"] += removed
+        COLLECTOR_CACHE_INVALIDATIONS.inc(removed)
+        return removed
+
+    # ---------------- 统计 ----------------
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["local_entries"] = len(self._fallback)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["ttls"] = dict(self.ttls)
+        stats["backend"] = 'redis' if self.redis is not None else 'memory'
+        return stats
+
+
+# 全局实例
+_collector_cache: Optional[CollectorCache] = None
+_collector_cache_lock = threading.Lock()
+
+def get_collector_cache() -> Optional[CollectorCache]:
+    """获取全局信息收集缓存（COLLECTOR_CACHE_ENABLED=0 时返回None）"""
+    global _collector_cache
+    if os.getenv("COLLECTOR_CACHE_ENABLED", "1").lower() not in ('1', 'true', 'yes'):
+        return None
+    if _collector_cache is None:
+        with _collector_cache_lock:
+            if _collector_cache is None:
+                _collector_cache = CollectorCache(
+                    ttls={topic: int(os.getenv(f"COLLECTOR_CACHE_TTL_{topic.upper()}", default))
+                          for topic, default in (('flights', 1800), ('hotels', 21600),
+                                                 ('attractions', 604800), ('restaurants', 259200))},
+                    max_entries=int(os.getenv("COLLECTOR_CACHE_MAX_ENTRIES", "1000")),
+                )
+    return _collector_cache
@@ -0,0 +1,145 @@
+"""
+按token预算构建对话上下文
+各智能体不再固定截取最近N条历史，而是在各自的token预算内放入：
+系统提示词 + 滚动摘要 + 当前请求（必选） + 历史对话（从最新往前，放不下就停止）
+
+- 用 tiktoken 计数（编码器和每段文本的计数都有缓存）；未安装 tiktoken 时按字符数估算
+- 超长的助手回复（如之前生成的整份行程）只保留开头和结尾，中间省略
+- 每次构建的提示词token数记录到 llm_prompt_tokens 指标
+
+预算可通过环境变量 CONTEXT_BUDGET_<智能体>（如 CONTEXT_BUDGET_PLANNER=12000）调整。
+"""
+
+import functools
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 各智能体的默认预算: (总token预算, 单条助手回复上限)
+DEFAULT_BUDGETS = {
+    'normal': (6000, 1200),
+    'planner': (16000, 2000),
+    'pdf': (24000, 6000),
+    'attraction_guide': (6000, 1200),
+}
+
+PROMPT_TOKENS = metrics.registry.histogram(
+    'llm_prompt_tokens', '发送给LLM的提示词token数', ('agent',),
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+ELIDED_MESSAGES = metrics.registry.counter(
+    'context_elided_messages_total', '构建上下文时被截断的超长助手回复数', ('agent',))
+DROPPED_MESSAGES = metrics.registry.counter(
+    'context_dropped_messages_total', '因超出token预算未放入上下文的历史消息数', ('agent',))
+
+_CJK = re.compile(r'[　-ヿ㐀-鿿가-힯＀-￯]')
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """tiktoken 编码器（进程内只加载一次）；不可用时返回None"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    for name in ('o200k_base', 'cl100k_base'):
+        try:
+            return tiktoken.get_encoding(name)
+        except Exception:
+            continue
+    return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str, model: str = "gpt-4.1-nano") -> int:
+    """文本的token数（相同文本只计算一次）"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 估算：中日韩字符约1个token，其他约4个字符1个token
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4.1-nano") -> str:
+    """保留开头和结尾，把文本压缩到大约 max_tokens 个token"""
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+    # 按token比例换算成字符数，开头保留2/3、结尾保留1/3
+    keep_chars = max(0, int(len(text) * max_tokens / total) - 20)
+    head, tail = keep_chars * 2 // 3, keep_chars // 3
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n…（中间省略{omitted}字）…\n{text[len(text) - tail:] if tail else ''}"
+
+
+@dataclass
+class ContextResult:
+    """构建结果：按时间顺序的历史消息和token统计"""
+    history: List[Dict[str, Any]]
+    prompt_tokens: int
+    dropped: int
+    elided: int
+
+
+class ContextBuilder:
+    """在token预算内选择历史对话"""
+
+    def __init__(self, agent: str, budget: Optional[int] = None, max_message_tokens: Optional[int] = None,
+                 model: str = "gpt-4.1-nano"):
+        default_budget, default_message_tokens = DEFAULT_BUDGETS.get(agent, DEFAULT_BUDGETS['normal'])
+        self.agent = agent
+        self.budget = budget or int(os.getenv(f"CONTEXT_BUDGET_{agent.upper()}", default_budget))
+        self.max_message_tokens = max_message_tokens or default_message_tokens
+        self.model = model
+
+    def build(self, system_prompt: str, history: Optional[List[Dict[str, Any]]], request: str,
+              summary: str = "") -> ContextResult:
+        """
+        选择放入上下文的历史消息（从最新往前，遇到放不下的消息即停止，保证历史连续）
+
+        Args:
+            system_prompt: 系统提示词
+            history: 按时间顺序的历史消息 [{'role', 'content'}]
+            request: 本次请求的完整内容（包括收集到的信息等）
+            summary: 更早对话的滚动摘要（必选部分，放在历史之前）
+        """
+        used = (count_tokens(system_prompt, self.model) + count_tokens(request, self.model)
+                + 2 * MESSAGE_OVERHEAD_TOKENS)
+        if summary:
+            used += count_tokens(summary, self.model) + MESSAGE_OVERHEAD_TOKENS
+        selected = []
+        elided = 0
+        history = [m for m in history or [] if m.get('role') in ('user', 'assistant')]
+        for message in reversed(history):
+            content = message.get('content', '') or ''
+            tokens = count_tokens(content, self.model)
+            if message['role'] == 'assistant' and tokens > self.max_message_tokens:
+                content = truncate_to_tokens(content, self.max_message_tokens, self.model)
+                tokens = count_tokens(content, self.model)
+                elided += 1
+            if used + tokens + MESSAGE_OVERHEAD_TOKENS > self.budget:
+                break
+            used += tokens + MESSAGE_OVERHEAD_TOKENS
+            selected.append({**message, 'content': content})
+
+        selected.reverse()
+        dropped = len(history) - len(selected)
+        PROMPT_TOKENS.observe(used, agent=self.agent)
+        if elided:
+            ELIDED_MESSAGES.inc(elided, agent=self.agent)
+        if dropped:
+            DROPPED_MESSAGES.inc(dropped, agent=self.agent)
+        print(f"[{self.agent}] 提示词约 {used} tokens（预算 {self.budget}），历史 {len(selected)}/{len(history)} 条，截断 {elided} 条")
+        return ContextResult(selected, used, dropped, elided)
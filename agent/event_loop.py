@@ -0,0 +1,109 @@
+"""
+后台事件循环模块
+每个进程一个常驻的事件循环线程，同步代码（Flask工作线程）通过它执行协程：
+- submit(coro) 返回 concurrent.futures.Future，可阻塞等待或转成 asyncio Future
+- run(coro, timeout) 提交并阻塞等待结果
+- iterate(agen, timeout) 在同步代码中逐项消费异步生成器
+
+与每次调用都新建线程池、线程和 asyncio.run 事件循环相比，省去了创建/销毁开销，
+而且绑定在事件循环上的异步资源（LLM异步HTTP客户端、MCP会话池）可以跨调用复用。
+"""
+
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+
+class BackgroundEventLoop:
+    """在守护线程中运行的常驻事件循环"""
+
+    def __init__(self, name: str = "agent-event-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """事件循环（首次访问时启动线程）"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """提交协程并阻塞等待结果；超时后取消协程并抛出 TimeoutError"""
+        if self.in_loop_thread():
+            raise RuntimeError("不能在后台事件循环线程内阻塞等待自身")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def iterate(self, agen: AsyncIterator, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        在后台事件循环中驱动异步生成器，同步地逐项产出
+
+        timeout 为整体超时；调用方提前关闭迭代时会取消后台的生成器。
+        """
+        items: "queue.Queue" = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(('item', item))
+                items.put(('done', None))
+            except Exception as e:
+                items.put(('error', e))
+
+        future = self.submit(pump())
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    kind, value = items.get(timeout=remaining)
+                except queue.Empty:
+                    raise TimeoutError(f"异步生成器在{timeout}秒内未完成")
+                if kind == 'item':
+                    yield value
+                elif kind == 'done':
+                    return
+                else:
+                    raise value
+        finally:
+            future.cancel()
+
+    async def run_async(self, coro: Awaitable) -> Any:
+        """在其他事件循环中等待提交到后台循环的协程"""
+        return await asyncio.wrap_future(self.submit(coro))
+
+
+# 全局后台事件循环实例
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def get_background_loop() -> BackgroundEventLoop:
+    """获取进程内共享的后台事件循环（懒加载）"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                _background_loop = BackgroundEventLoop()
+    return _background_loop
@@ -0,0 +1,276 @@
+"""
+LLM客户端注册表模块
+进程内按 (模型, 温度, 是否流式) 共享 ChatOpenAI 实例，不再为每个会话新建客户端：
+- 所有实例共用一个同步连接池和一个异步连接池（安装了 h2 时启用 HTTP/2，多个请求复用同一条连接）
+- 每个实例套一层计数传输层，统计请求数、新建连接数（由此得出连接复用率）和在途请求数
+
+异步连接绑定在事件循环上。同一进程内的异步LLM调用只发生在一个事件循环中
+（同步模式为后台事件循环，ASGI模式为服务端事件循环），因此异步连接池也可以共享。
+
+配置（环境变量）:
+    LLM_HTTP2                   是否启用HTTP/2（默认1，未安装 h2 时自动退回HTTP/1.1）
+    LLM_MAX_CONNECTIONS         连接池最大连接数（默认100）
+    LLM_MAX_KEEPALIVE           保持的空闲连接数（默认20）
+"""
+
+import atexit
+import importlib.util
+import os
+import threading
+import urllib.request
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+import metrics
+
+LLM_HTTP_REQUESTS = metrics.registry.counter(
+    'llm_http_requests_total', 'LLM客户端发出的HTTP请求数', ('client',))
+LLM_HTTP_CONNECTIONS = metrics.registry.counter(
+    'llm_http_connections_total', 'LLM客户端新建的TCP连接数（与请求数之比越小复用越好）', ('client',))
+LLM_IN_FLIGHT = metrics.registry.gauge(
+    'llm_client_in_flight', 'LLM客户端上正在进行的请求数（含流式响应的读取）', ('client',))
+
+
+class ClientStats:
+    """单个LLM客户端的请求/连接统计"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.requests = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            in_flight = self.in_flight
+        LLM_HTTP_REQUESTS.inc(client=self.label)
+        LLM_IN_FLIGHT.set(in_flight, client=self.label)
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+            in_flight = self.in_flight
+        LLM_IN_FLIGHT.set(in_flight, client=self.label)
+
+    def connected(self):
+        with self._lock:
+            self.new_connections += 1
+        LLM_HTTP_CONNECTIONS.inc(client=self.label)
+
+    def get_stats(self) -> Dict[str, Any]:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            'client': self.label,
+            'requests': self.requests,
+            'new_connections': self.new_connections,
+            'reuse_ratio': round(reused / self.requests, 4) if self.requests else 0.0,
+            'in_flight': self.in_flight,
+        }
+
+
+class _CountingStream(httpx.SyncByteStream):
+    def __init__(self, stream, stats: ClientStats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._stats.end()
+        self._stream.close()
+
+
+class _AsyncCountingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, stats: ClientStats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._stats.end()
+        await self._stream.aclose()
+
+
+class CountingTransport(httpx.BaseTransport):
+    """统计请求和新建连接的同步传输层，真正的连接池由共享的 inner 传输层持有"""
+
+    def __init__(self, inner: httpx.BaseTransport, stats: ClientStats):
+        self.inner = inner
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                self.stats.connected()
+
+        request.extensions['trace'] = trace
+        self.stats.begin()
+        try:
+            response = self.inner.handle_request(request)
+        except BaseException:
+            self.stats.end()
+            raise
+        response.stream = _CountingStream(response.stream, self.stats)
+        return response
+
+    def close(self):
+        # 共享的连接池由注册表统一关闭
+        pass
+
+
+class AsyncCountingTransport(httpx.AsyncBaseTransport):
+    """CountingTransport 的异步版本"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, stats: ClientStats):
+        self.inner = inner
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                self.stats.connected()
+
+        request.extensions['trace'] = trace
+        self.stats.begin()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except BaseException:
+            self.stats.end()
+            raise
+        response.stream = _AsyncCountingStream(response.stream, self.stats)
+        return response
+
+    async def aclose(self):
+        pass
+
+
+class LLMClientRegistry:
+    """进程内共享的LLM客户端注册表"""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.http2 = (os.getenv('LLM_HTTP2', '1') != '0') and importlib.util.find_spec('h2') is not None
+        self.limits = httpx.Limits(max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '100')),
+                                   max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE', '20')))
+        self.timeout = httpx.Timeout(60.0, connect=10.0)
+
+        self._clients: Dict[Tuple[str, float, bool], ChatOpenAI] = {}
+        self._stats: Dict[str, ClientStats] = {}
+        self._transport: Optional[httpx.HTTPTransport] = None
+        self._async_transport: Optional[httpx.AsyncHTTPTransport] = None
+        self._warmup_client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _proxy(self) -> Optional[str]:
+        """按环境变量（HTTPS_PROXY / NO_PROXY 等）取代理地址；自定义传输层时 httpx 不再自动读取"""
+        url = self.base_url or 'https://api.openai.com/v1'
+        host = httpx.URL(url).host
+        if urllib.request.proxy_bypass(host):
+            return None
+        proxies = urllib.request.getproxies()
+        return proxies.get(httpx.URL(url).scheme) or proxies.get('all')
+
+    def _transports(self):
+        if self._transport is None:
+            proxy = self._proxy()
+            self._transport = httpx.HTTPTransport(http2=self.http2, limits=self.limits, proxy=proxy)
+            self._async_transport = httpx.AsyncHTTPTransport(http2=self.http2, limits=self.limits, proxy=proxy)
+            print(f"LLM连接池已创建（{'HTTP/2' if self.http2 else 'HTTP/1.1'}，最多 {self.limits.max_connections} 个连接）")
+        return self._transport, self._async_transport
+
+    def get(self, model: str = "gpt-4.1-nano", temperature: float = 0.1, streaming: bool = False) -> ChatOpenAI:
+        """获取共享的LLM实例（同一组参数在进程内只创建一次）"""
+        key = (model, float(temperature), bool(streaming))
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._create(*key)
+                    self._clients[key] = client
+        return client
+
+    def _create(self, model: str, temperature: float, streaming: bool) -> ChatOpenAI:
+        transport, async_transport = self._transports()
+        label = f"{model}|t={temperature:g}|{'stream' if streaming else 'normal'}"
+        stats = self._stats[label] = ClientStats(label)
+        return ChatOpenAI(
+            api_key=self.api_key,
+            model=model,
+            base_url=self.base_url,
+            temperature=temperature,
+            streaming=streaming,
+            http_client=httpx.Client(transport=CountingTransport(transport, stats), timeout=self.timeout),
+            http_async_client=httpx.AsyncClient(transport=AsyncCountingTransport(async_transport, stats),
+                                                timeout=self.timeout),
+        )
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """使用共享连接池的通用同步客户端（预热等非LLM调用使用）"""
+        if self._warmup_client is None:
+            with self._lock:
+                if self._warmup_client is None:
+                    transport, _ = self._transports()
+                    stats = self._stats['warmup'] = ClientStats('warmup')
+                    self._warmup_client = httpx.Client(transport=CountingTransport(transport, stats),
+                                                       timeout=self.timeout)
+        return self._warmup_client
+
+    def warmup(self) -> int:
+        """预先与LLM服务端建立连接（完成DNS解析和TLS握手），返回HTTP状态码"""
+        base_url = (self.base_url or "https://api.openai.com/v1").rstrip('/')
+        response = self.http_client.get(f"{base_url}/models", headers={"Authorization": f"Bearer {self.api_key}"})
+        return response.status_code
+
+    def close(self):
+        """关闭共享的同步连接池（异步连接随事件循环退出释放）"""
+        if self._transport is not None:
+            try:
+                self._transport.close()
+            except Exception as e:
+                print(f"关闭LLM连接池失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'http2': self.http2,
+            'clients': len(self._clients),
+            'max_connections': self.limits.max_connections,
+            'per_client': [stats.get_stats() for stats in list(self._stats.values())],
+        }
+
+
+# 全局LLM客户端注册表
+_llm_registry: Optional[LLMClientRegistry] = None
+_llm_registry_lock = threading.Lock()
+
+def get_llm_registry() -> LLMClientRegistry:
+    """获取进程内共享的LLM客户端注册表（懒加载）"""
+    global _llm_registry
+    if _llm_registry is None:
+        with _llm_registry_lock:
+            if _llm_registry is None:
+                load_dotenv()
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise ValueError("未配置OpenAI API密钥")
+                _llm_registry = LLMClientRegistry(api_key, os.getenv("OPENAI_API_URL"))
+    return _llm_registry
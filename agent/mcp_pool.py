@@ -0,0 +1,327 @@
+"""
+MCP会话池模块
+维护若干条长连接的MCP客户端会话，供信息收集智能体的工具调用复用：
+- stdio 模式：常驻 N 个 agent/mcp_server.py 子进程，每个进程一条会话
+- sse / streamable-http 模式：与一个共享的MCP服务器建立 N 条会话
+- 定期 ping 检查健康状况，会话断开或服务器进程崩溃时自动重启
+- 并发的工具调用分摊到当前在途调用最少的会话上
+- 统计每条会话的调用次数、错误数和占用率
+
+所有会话都运行在进程内共享的后台事件循环中（MCP客户端的连接必须在同一个任务内打开和关闭），
+其他线程或事件循环中的调用转发到该循环执行。
+
+配置（环境变量）:
+    MCP_TRANSPORT         stdio（默认）/ sse / streamable-http
+    MCP_SERVER_URL        共享服务器地址（默认 http://127.0.0.1:8000/sse 或 /mcp）
+    MCP_POOL_SIZE         会话数（默认2）
+    MCP_HEALTH_INTERVAL   健康检查间隔秒数（默认30）
+"""
+
+import asyncio
+import atexit
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+try:
+    from .event_loop import get_background_loop
+except ImportError:
+    from agent.event_loop import get_background_loop
+
+DEFAULT_SERVER_URLS = {
+    'sse': 'http://127.0.0.1:8000/sse',
+    'streamable-http': 'http://127.0.0.1:8000/mcp',
+}
+
+MCP_TOOL_CALLS = metrics.registry.counter(
+    'mcp_tool_calls_total', 'MCP工具调用次数', ('tool', 'result'))
+MCP_TOOL_SECONDS = metrics.registry.histogram(
+    'mcp_tool_call_seconds', 'MCP工具调用耗时', ('tool',))
+MCP_SESSION_RESTARTS = metrics.registry.counter(
+    'mcp_session_restarts_total', 'MCP会话重启次数', ('session',))
+MCP_SESSION_IN_FLIGHT = metrics.registry.gauge(
+    'mcp_session_in_flight', 'MCP会话上正在执行的工具调用数', ('session',))
+MCP_SESSION_BUSY_SECONDS = metrics.registry.counter(
+    'mcp_session_busy_seconds_total', 'MCP会话至少有一个在途调用的累计时间（rate即占用率）', ('session',))
+
+
+class PooledSession:
+    """池中的一条MCP会话：由一个常驻任务负责连接、保持和重启"""
+
+    def __init__(self, pool: 'MCPSessionPool', index: int):
+        self.pool = pool
+        self.index = index
+        self.label = str(index)
+        self.session = None
+        self.healthy = False
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+        self.connected_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._busy_since: Optional[float] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        """连接 -> 保持到被要求重启或连接断开 -> 退避后重连"""
+        from mcp import ClientSession
+
+        backoff = 1.0
+        while not self.pool.closing:
+            self._stop = asyncio.Event()
+            try:
+                async with self.pool.connect() as streams:
+                    async with ClientSession(streams[0], streams[1]) as session:
+                        await asyncio.wait_for(session.initialize(), self.pool.connect_timeout)
+                        self.session = session
+                        self.healthy = True
+                        self.connected_at = time.monotonic()
+                        backoff = 1.0
+                        print(f"MCP会话 {self.label} 已连接")
+                        await self._stop.wait()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"MCP会话 {self.label} 中断: {e}")
+            finally:
+                self.session = None
+                self.healthy = False
+
+            if self.pool.closing:
+                break
+            self.restarts += 1
+            MCP_SESSION_RESTARTS.inc(session=self.label)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def restart(self, reason: str):
+        """标记为不健康并让常驻任务重建连接（在池的事件循环中调用）"""
+        if self.healthy and not self.pool.closing:
+            print(f"重启MCP会话 {self.label}: {reason}")
+        self.healthy = False
+        self.last_error = reason
+        if self._stop is not None:
+            self._stop.set()
+
+    def begin_call(self):
+        if self.in_flight == 0:
+            self._busy_since = time.monotonic()
+        self.in_flight += 1
+        MCP_SESSION_IN_FLIGHT.set(self.in_flight, session=self.label)
+
+    def end_call(self):
+        self.in_flight -= 1
+        MCP_SESSION_IN_FLIGHT.set(self.in_flight, session=self.label)
+        if self.in_flight == 0 and self._busy_since is not None:
+            busy = time.monotonic() - self._busy_since
+            self.busy_seconds += busy
+            MCP_SESSION_BUSY_SECONDS.inc(busy, session=self.label)
+            self._busy_since = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        busy = self.busy_seconds + (now - self._busy_since if self._busy_since is not None else 0.0)
+        uptime = now - self.pool.started_at if self.pool.started_at else 0.0
+        return {
+            'session': self.label,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'errors': self.errors,
+            'restarts': self.restarts,
+            'utilization': round(busy / uptime, 4) if uptime > 0 else 0.0,
+            'last_error': self.last_error,
+        }
+
+
+class MCPSessionPool:
+    """长连接MCP会话池"""
+
+    def __init__(self, server_params=None, transport: str = 'stdio', url: Optional[str] = None,
+                 size: int = 2, health_interval: float = 30.0, call_timeout: float = 60.0,
+                 connect_timeout: float = 30.0):
+        self.server_params = server_params
+        self.transport = transport
+        self.url = url or DEFAULT_SERVER_URLS.get(transport)
+        self.size = max(1, size)
+        self.health_interval = health_interval
+        self.call_timeout = call_timeout
+        self.connect_timeout = connect_timeout
+
+        self.sessions = [PooledSession(self, i) for i in range(self.size)]
+        self.closing = False
+        self.started_at: Optional[float] = None
+        self._tool_definitions = None
+        self._background = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._start_lock = threading.Lock()
+        self._tie_breaker = itertools.count()
+
+    # ---------------- 生命周期 ----------------
+    def start(self, timeout: Optional[float] = None):
+        """在后台事件循环中启动全部会话，等待至少一条会话可用（重复调用无效）"""
+        with self._start_lock:
+            if self._background is None:
+                self._background = get_background_loop()
+                self.started_at = time.monotonic()
+                self._background.run(self._start_sessions())
+                atexit.register(self.close)
+        self._background.run(self._wait_ready(timeout or self.connect_timeout))
+
+    def close(self, timeout: float = 5.0):
+        """停止全部会话（关闭stdio子进程）"""
+        if self._background is None or self.closing:
+            return
+        self.closing = True
+
+        async def stop_all():
+            if self._health_task is not None:
+                self._health_task.cancel()
+            for pooled in self.sessions:
+                pooled.restart("池已关闭")
+            tasks = [pooled._task for pooled in self.sessions if pooled._task is not None]
+            await asyncio.wait(tasks, timeout=timeout)
+
+        try:
+            self._background.run(stop_all(), timeout + 1)
+        except Exception as e:
+            print(f"关闭MCP会话池失败: {e}")
+
+    def connect(self):
+        """按传输方式返回一个MCP客户端连接上下文，产出 (read, write, ...)"""
+        if self.transport == 'stdio':
+            from mcp.client.stdio import stdio_client
+            return stdio_client(self.server_params)
+        if self.transport == 'sse':
+            from mcp.client.sse import sse_client
+            return sse_client(self.url)
+        if self.transport == 'streamable-http':
+            from mcp.client.streamable_http import streamablehttp_client
+            return streamablehttp_client(self.url)
+        raise ValueError(f"不支持的MCP传输方式: {self.transport}")
+
+    async def _start_sessions(self):
+        for pooled in self.sessions:
+            pooled._task = asyncio.create_task(pooled.run())
+        # 保存任务引用，避免被垃圾回收；循环异常退出时记录下来，而不是悄无声息地停止健康检查
+        self._health_task = asyncio.create_task(self._health_loop())
+        self._health_task.add_done_callback(self._health_loop_done)
+
+    async def _wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while not any(pooled.healthy for pooled in self.sessions):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{timeout:.0f}秒内没有可用的MCP会话")
+            await asyncio.sleep(0.05)
+
+    async def _health_loop(self):
+        while not self.closing:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self._check(pooled) for pooled in self.sessions if pooled.healthy))
+
+    @staticmethod
+    def _health_loop_done(task: asyncio.Task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            print(f"MCP健康检查循环异常退出: {error!r}")
+            metrics.ERRORS.inc(component='mcp_pool', operation='health_loop')
+
+    async def _check(self, pooled: PooledSession):
+        try:
+            await asyncio.wait_for(pooled.session.send_ping(), 10)
+        except Exception as e:
+            pooled.restart(f"健康检查失败: {e!r}")
+
+    # ---------------- 工具 ----------------
+    def load_tools(self) -> List[Any]:
+        """启动会话池并返回LangChain工具列表；工具调用通过池中的会话执行"""
+        self.start()
+        if self._tool_definitions is None:
+            self._tool_definitions = self._background.run(self._list_tools(), self.call_timeout)
+        return [self._to_langchain_tool(tool) for tool in self._tool_definitions]
+
+    async def _list_tools(self):
+        pooled = await self._acquire()
+        result = await asyncio.wait_for(pooled.session.list_tools(), self.call_timeout)
+        return result.tools
+
+    def _to_langchain_tool(self, tool):
+        from langchain_core.tools import StructuredTool, ToolException
+
+        async def call(**arguments):
+            result = await self.acall_tool(tool.name, arguments)
+            text = "\n".join(item.text for item in result.content if getattr(item, 'type', None) == 'text')
+            if result.isError:
+                raise ToolException(text)
+            return text
+
+        return StructuredTool(name=tool.name, description=tool.description or "",
+                              args_schema=tool.inputSchema, coroutine=call)
+
+    async def acall_tool(self, name: str, arguments: Dict[str, Any]):
+        """在任意事件循环中调用MCP工具（转发到池的事件循环执行）"""
+        if asyncio.get_running_loop() is self._background.loop:
+            return await self._call_tool(name, arguments)
+        return await self._background.run_async(self._call_tool(name, arguments))
+
+    async def _acquire(self) -> PooledSession:
+        """选择在途调用最少的健康会话；暂时没有可用会话时等待重连"""
+        deadline = time.monotonic() + self.call_timeout
+        while True:
+            ready = [pooled for pooled in self.sessions if pooled.healthy]
+            if ready:
+                return min(ready, key=lambda pooled: (pooled.in_flight, pooled.calls, next(self._tie_breaker)))
+            if time.monotonic() > deadline:
+                raise RuntimeError("没有可用的MCP会话")
+            await asyncio.sleep(0.05)
+
+    async def _call_tool(self, name: str, arguments: Dict[str, Any]):
+        from mcp.shared.exceptions import McpError
+
+        for attempt in range(2):
+            pooled = await self._acquire()
+            session = pooled.session
+            pooled.begin_call()
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(session.call_tool(name, arguments), self.call_timeout)
+                pooled.calls += 1
+                MCP_TOOL_CALLS.inc(tool=name, result='error' if result.isError else 'ok')
+                return result
+            except McpError:
+                # 服务器返回的协议错误，会话本身正常
+                pooled.errors += 1
+                MCP_TOOL_CALLS.inc(tool=name, result='error')
+                raise
+            except asyncio.TimeoutError:
+                pooled.errors += 1
+                MCP_TOOL_CALLS.inc(tool=name, result='timeout')
+                raise
+            except Exception as e:
+                # 连接断开或子进程崩溃：重启这条会话，换一条会话重试一次
+                pooled.errors += 1
+                MCP_TOOL_CALLS.inc(tool=name, result='disconnected')
+                pooled.restart(f"工具调用失败: {e!r}")
+                if attempt == 1:
+                    raise
+            finally:
+                pooled.end_call()
+                MCP_TOOL_SECONDS.observe(time.perf_counter() - started, tool=name)
+
+    # ---------------- 统计 ----------------
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'transport': self.transport,
+            'size': self.size,
+            'started': self.started_at is not None,
+            'healthy': sum(1 for pooled in self.sessions if pooled.healthy),
+            'tools': len(self._tool_definitions or ()),
+            'sessions': [pooled.get_stats() for pooled in self.sessions],
+        }
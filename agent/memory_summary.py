@@ -0,0 +1,157 @@
+"""
+对话记忆滚动摘要模块
+RedisMemory 只保留最近 max_memory_length 条消息。启用滚动摘要后，滑出窗口的旧消息先进入待摘要列表，
+由后台线程增量折叠进该会话的摘要：每次只把"已有摘要 + 新滑出的若干条消息"交给LLM，不从头重新总结。
+
+摘要带版本号，写入时做比较-交换（Lua脚本）：多个进程同时折叠同一个会话时，
+只有一个写入成功，其余的重新读取最新摘要后重试，不会互相覆盖。
+
+配置（环境变量）:
+    MEMORY_SUMMARY_ENABLED     是否启用（默认1）
+    MEMORY_SUMMARY_BATCH       每次折叠的最多消息数（默认20）
+    MEMORY_SUMMARY_MAX_CHARS   摘要长度上限（默认800字）
+"""
+
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+try:
+    from .redis_memory import RedisMemory
+except ImportError:
+    from agent.redis_memory import RedisMemory
+
+MEMORY_SUMMARY_FOLDS = metrics.registry.counter(
+    'memory_summary_folds_total', '滚动摘要折叠次数', ('result',))
+MEMORY_SUMMARY_SECONDS = metrics.registry.histogram(
+    'memory_summary_seconds', '一次摘要折叠（含LLM调用）的耗时')
+
+# summarize(已有摘要, 新滑出的消息) -> 新摘要
+SummarizeFn = Callable[[str, List[Dict[str, Any]]], str]
+
+
+class RollingSummarizer:
+    """后台增量折叠滑出窗口的对话"""
+
+    def __init__(self, memory: RedisMemory, summarize: SummarizeFn, batch_size: int = 20,
+                 max_retries: int = 3, max_queue_size: int = 1000):
+        self.memory = memory
+        self.summarize = summarize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+
+        # 已排队但尚未处理的会话，同一会话只排队一次
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"scheduled": 0, "folded": 0, "messages": 0, "conflicts": 0, "failed": 0, "dropped": 0}
+
+    def attach(self):
+        """接管 RedisMemory 的窗口溢出：旧消息进入待摘要列表并排队折叠"""
+        self.memory.on_overflow = self.schedule
+
+    def schedule(self, session_id: str):
+        """安排折叠该会话的待摘要消息（不阻塞调用方）"""
+        with self._lock:
+            if session_id in self._queued:
+                return
+            self._queued.add(session_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-summarizer", daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait(session_id)
+            self._incr("scheduled")
+        except queue.Full:
+            # 待摘要列表仍在Redis中，下一次溢出时会再次排队
+            with self._lock:
+                self._queued.discard(session_id)
+            self._incr("dropped")
+
+    def _run(self):
+        while True:
+            session_id = self.queue.get()
+            with self._lock:
+                self._queued.discard(session_id)
+            try:
+                self.fold(session_id)
+            except Exception as e:
+                print(f"折叠对话摘要失败 ({session_id}): {e}")
+                metrics.ERRORS.inc(component='memory_summary', operation='fold')
+                MEMORY_SUMMARY_FOLDS.inc(result='error')
+                self._incr("failed")
+
+    def fold(self, session_id: str) -> int:
+        """
+        把待摘要列表中的消息分批折叠进摘要，直到列表为空
+
+        Returns:
+            int: 本次折叠的消息数
+        """
+        folded = 0
+        conflicts = 0
+        while True:
+            state = self.memory.get_summary(session_id)
+            pending = self.memory.get_overflow(session_id, self.batch_size)
+            if not pending:
+                return folded
+
+            with MEMORY_SUMMARY_SECONDS.time():
+                summary = self.summarize(state['summary'], pending)
+            if self.memory.commit_summary(session_id, state['version'], summary, len(pending)):
+                folded += len(pending)
+                MEMORY_SUMMARY_FOLDS.inc(result='ok')
+                self._incr("folded")
+                self._incr("messages", len(pending))
+                continue
+
+            # 其他进程抢先更新了摘要：基于最新版本重试
+            conflicts += 1
+            MEMORY_SUMMARY_FOLDS.inc(result='conflict')
+            self._incr("conflicts")
+            if conflicts >= self.max_retries:
+                return folded
+
+    def _incr(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+
+def format_messages(messages: List[Dict[str, Any]], max_message_chars: int = 2000) -> str:
+    """把待折叠的消息整理成摘要提示词中的对话文本（过长的单条消息只保留开头）"""
+    lines = []
+    for message in messages:
+        role = "用户" if message.get('role') == 'user' else "助手"
+        content = message.get('content', '') or ''
+        if len(content) > max_message_chars:
+            content = content[:max_message_chars] + "…"
+        lines.append(f"{role}: {content}")
+    return "\n\n".join(lines)
+
+
+# 全局滚动摘要实例
+_summarizer: Optional[RollingSummarizer] = None
+_summarizer_lock = threading.Lock()
+
+def get_rolling_summarizer(memory: RedisMemory, summarize: SummarizeFn) -> Optional[RollingSummarizer]:
+    """创建并挂接全局滚动摘要（MEMORY_SUMMARY_ENABLED=0 时返回None）"""
+    global _summarizer
+    if os.getenv("MEMORY_SUMMARY_ENABLED", "1") == "0":
+        return None
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                _summarizer = RollingSummarizer(memory, summarize,
+                                                batch_size=int(os.getenv("MEMORY_SUMMARY_BATCH", "20")))
+                _summarizer.attach()
+    return _summarizer
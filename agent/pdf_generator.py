@@ -3,8 +3,8 @@ PDF生成工具模块
 专门用于生成旅行规划PDF报告
 """
 
+import importlib.util
 import os
-import markdown
 from datetime import datetime
 from typing import Optional
 
@@ -181,6 +181,7 @@ AI总结报告:
 
     def _build_html_content(self, conversation_data: str, summary: str) -> str:
         """构建HTML内容"""
+        import markdown
         return f"""
         <!DOCTYPE html>
         <html>
@@ -346,7 +347,7 @@ def check_pdf_dependencies() -> dict:
     result = {
         'pdfkit': pdfkit is not None,
         'reportlab': reportlab_available,
-        'markdown': True,  # markdown是必需的，已在顶部导入
+        'markdown': importlib.util.find_spec('markdown') is not None,
         'wkhtmltopdf_available': False
     }
     
@@ -0,0 +1,456 @@
+"""
+PDF渲染任务队列模块
+PDF渲染（wkhtmltopdf 子进程或 ReportLab）是CPU密集的工作，放在请求线程里执行时，一波导出请求就会占满Web工作线程。
+这里把渲染改为后台任务：
+
+- submit() 提交任务立即返回任务ID；任务状态存放在Redis哈希 pdf_job:<ID> 中，任何工作进程都能查询
+- 调度线程从Redis队列取任务，交给有界的进程池（PDF_JOB_WORKERS 个渲染进程）执行
+- 可靠队列：取出的任务原子地移入 pdf_jobs:processing 并写入租约，执行中的进程定期续约；
+  工作进程重启或崩溃后租约过期，其他进程把任务放回队列重新渲染（最多 PDF_JOB_MAX_ATTEMPTS 次）
+- 客户端通过 /pdf_jobs/<ID> 轮询或 /pdf_jobs/<ID>/events 订阅状态
+
+Redis 不可用时退化为进程内队列（进程重启后任务丢失）。
+也可以单独启动渲染进程（Web进程设置 PDF_JOB_WORKERS=0 只提交不渲染）:
+    python -m agent.pdf_jobs
+
+配置（环境变量）:
+    PDF_JOB_WORKERS         渲染进程数（默认2，0为本进程不渲染）
+    PDF_JOB_MAX_QUEUE       排队任务上限，超出时拒绝提交（默认100）
+    PDF_JOB_LEASE           任务租约（秒，默认60）
+    PDF_JOB_MAX_ATTEMPTS    渲染进程中断时的最多尝试次数（默认2）
+    PDF_JOB_TTL             任务状态保留时间（秒，默认86400）
+"""
+
+import asyncio
+import atexit
+import collections
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, Optional
+
+import metrics
+
+try:
+    from .redis_memory import get_redis_memory_manager
+    from .pdf_generator import generate_pdf_content
+except ImportError:
+    from agent.redis_memory import get_redis_memory_manager
+    from agent.pdf_generator import generate_pdf_content
+
+JOB_PREFIX = 'pdf_job:'
+QUEUE_KEY = 'pdf_jobs:queue'
+PROCESSING_KEY = 'pdf_jobs:processing'
+
+# 取出任务时在同一个原子操作里写入租约：否则刚移入处理中列表、还没来得及写租约的任务
+# 会被其他进程的 recover 当作过期任务重新排队，导致重复渲染
+# KEYS: 队列, 处理中列表; ARGV: 任务键前缀, 租约到期时间
+CLAIM_SCRIPT = """
+local job_id = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+if job_id and redis.call('EXISTS', ARGV[1] .. job_id) == 1 then
+    redis.call('HSET', ARGV[1] .. job_id, 'lease_until', ARGV[2])
+end
+return job_id
+"""
+# 队列为空时再次尝试取任务的间隔（秒）
+CLAIM_POLL_SECONDS = 0.2
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+TERMINAL_STATES = (DONE, FAILED)
+# 只在任务执行期间需要的字段，完成后删除
+PAYLOAD_FIELDS = ('conversation_data', 'summary', 'user_info')
+
+PDF_JOBS = metrics.registry.counter(
+    'pdf_jobs_total', 'PDF渲染任务数（按结果：submitted/done/failed/requeued/rejected）', ('status',))
+PDF_JOB_QUEUE_SECONDS = metrics.registry.histogram(
+    'pdf_job_queue_seconds', 'PDF任务从提交到开始渲染的排队时间')
+PDF_JOB_RENDER_SECONDS = metrics.registry.histogram(
+    'pdf_job_render_seconds', 'PDF任务的渲染耗时')
+PDF_JOBS_QUEUED = metrics.registry.gauge(
+    'pdf_jobs_queued', '排队中的PDF任务数')
+PDF_JOBS_RUNNING = metrics.registry.gauge(
+    'pdf_jobs_running', '本进程正在渲染的PDF任务数')
+
+
+class PdfJobQueueFullError(Exception):
+    """排队任务数已达上限"""
+
+
+class PdfJobQueue:
+    """Redis持久化的PDF渲染任务队列 + 有界渲染进程池"""
+
+    def __init__(self, redis_memory=None, workers: int = 2, max_queue: int = 100, lease_seconds: float = 60,
+                 max_attempts: int = 2, job_ttl: int = 86400):
+        memory = redis_memory or get_redis_memory_manager()
+        self.redis = memory.redis_client if memory.use_redis else None
+        self._claim_script = self.redis.register_script(CLAIM_SCRIPT) if self.redis is not None else None
+        self.workers = workers
+        self.max_queue = max_queue
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.job_ttl = job_ttl
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.Semaphore(max(1, workers))
+        self._running: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        # Redis 不可用时的进程内存储
+        self._fallback_jobs: Dict[str, Dict[str, str]] = {}
+        self._fallback_queue: "collections.deque[str]" = collections.deque()
+        self._fallback_cond = threading.Condition(self._lock)
+
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "requeued": 0, "rejected": 0}
+
+    # ---------------- 任务状态存储 ----------------
+    def _save(self, job_id: str, **fields):
+        values = {name: str(value) for name, value in fields.items()}
+        if self.redis is None:
+            with self._lock:
+                self._fallback_jobs.setdefault(job_id, {}).update(values)
+            return
+        key = f"{JOB_PREFIX}{job_id}"
+        with metrics.REDIS_SECONDS.time(operation='pdf_job_save'):
+            pipe = self.redis.pipeline()
+            pipe.hset(key, mapping=values)
+            pipe.expire(key, self.job_ttl)
+            pipe.execute()
+
+    def _load(self, job_id: str) -> Dict[str, str]:
+        if self.redis is None:
+            with self._lock:
+                return dict(self._fallback_jobs.get(job_id, {}))
+        with metrics.REDIS_SECONDS.time(operation='pdf_job_load'):
+            return self.redis.hgetall(f"{JOB_PREFIX}{job_id}") or {}
+
+    def _drop_payload(self, job_id: str):
+        if self.redis is None:
+            with self._lock:
+                for field in PAYLOAD_FIELDS:
+                    self._fallback_jobs.get(job_id, {}).pop(field, None)
+            return
+        self.redis.hdel(f"{JOB_PREFIX}{job_id}", *PAYLOAD_FIELDS)
+
+    def queue_length(self) -> int:
+        if self.redis is None:
+            return len(self._fallback_queue)
+        return self.redis.llen(QUEUE_KEY)
+
+    # ---------------- 提交与查询 ----------------
+    def submit(self, owner: str, conversation_data: str, summary: str = "", user_info: str = "") -> str:
+        """
+        提交PDF渲染任务
+
+        Returns:
+            str: 任务ID
+
+        Raises:
+            PdfJobQueueFullError: 排队任务数已达上限
+        """
+        if self.queue_length() >= self.max_queue:
+            self._count("rejected")
+            raise PdfJobQueueFullError(f"PDF生成任务过多，请稍后重试（排队中 {self.max_queue} 个）")
+        self.start()
+        job_id = uuid.uuid4().hex[:16]
+        self._save(job_id, id=job_id, owner=owner, status=QUEUED, created_at=time.time(), attempts=0,
+                   conversation_data=conversation_data, summary=summary, user_info=user_info)
+        if self.redis is None:
+            with self._fallback_cond:
+                self._fallback_queue.append(job_id)
+                self._fallback_cond.notify()
+        else:
+            with metrics.REDIS_SECONDS.time(operation='pdf_job_push'):
+                self.redis.rpush(QUEUE_KEY, job_id)
+        self._count("submitted")
+        PDF_JOBS_QUEUED.set(self.queue_length())
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务的公开状态（不含渲染内容）；不存在时返回None"""
+        data = self._load(job_id)
+        if not data:
+            return None
+        job = {
+            'id': job_id,
+            'owner': data.get('owner', ''),
+            'status': data.get('status', QUEUED),
+            'attempts': int(data.get('attempts', 0)),
+            'result': data.get('result'),
+            'error': data.get('error'),
+        }
+        for field in ('created_at', 'started_at', 'finished_at'):
+            job[field] = float(data[field]) if data.get(field) else None
+        if job['status'] == QUEUED:
+            job['position'] = self._position(job_id)
+        return job
+
+    def _position(self, job_id: str) -> Optional[int]:
+        """排队位置（从1开始）"""
+        if self.redis is None:
+            with self._lock:
+                queue = list(self._fallback_queue)
+            return queue.index(job_id) + 1 if job_id in queue else None
+        index = self.redis.lpos(QUEUE_KEY, job_id)
+        return index + 1 if index is not None else None
+
+    def iter_status(self, job_id: str, timeout: float = 120, interval: float = 0.3) -> Iterator[Dict[str, Any]]:
+        """每次状态（或排队位置）变化时产出任务状态，任务结束或超时后停止"""
+        deadline = time.monotonic() + timeout
+        last = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            marker = (job['status'], job.get('position'))
+            if marker != last:
+                last = marker
+                yield job
+            if job['status'] in TERMINAL_STATES or time.monotonic() >= deadline:
+                return
+            time.sleep(interval)
+
+    async def aiter_status(self, job_id: str, timeout: float = 120, interval: float = 0.3):
+        """iter_status 的异步版本（Redis读取放到线程中执行）"""
+        deadline = time.monotonic() + timeout
+        last = None
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None:
+                return
+            marker = (job['status'], job.get('position'))
+            if marker != last:
+                last = marker
+                yield job
+            if job['status'] in TERMINAL_STATES or time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(interval)
+
+    # ---------------- 调度与渲染 ----------------
+    def start(self):
+        """启动调度线程和渲染进程池（PDF_JOB_WORKERS=0 时本进程只提交不渲染）"""
+        if self.workers <= 0 or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._dispatch_loop, name="pdf-job-dispatcher", daemon=True)
+            self._thread.start()
+            print(f"PDF任务队列已启动（{self.workers} 个渲染进程，{'Redis' if self.redis is not None else '内存'}队列）")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # spawn 启动的渲染进程不继承Web进程的线程和连接
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _dispatch_loop(self):
+        last_maintenance = 0.0
+        while not self._closed:
+            try:
+                if time.monotonic() - last_maintenance >= self.lease_seconds / 3:
+                    last_maintenance = time.monotonic()
+                    self._renew_leases()
+                    self.recover()
+                if not self._slots.acquire(timeout=1.0):
+                    continue
+                # 渲染名额在 _finish 接手之前出错时必须归还，否则每次Redis错误都会永久少一个名额
+                try:
+                    job_id = self._pop(timeout=1.0)
+                    handed_over = job_id is not None and self._run(job_id)
+                except Exception:
+                    self._slots.release()
+                    raise
+                if not handed_over:
+                    self._slots.release()
+            except Exception as e:
+                print(f"PDF任务调度出错: {e}")
+                metrics.ERRORS.inc(component='pdf_jobs', operation='dispatch')
+                time.sleep(1)
+
+    def _pop(self, timeout: float) -> Optional[str]:
+        """取出一个任务并移入处理中列表（同时写入租约）"""
+        if self.redis is None:
+            with self._fallback_cond:
+                if not self._fallback_queue:
+                    self._fallback_cond.wait(timeout)
+                return self._fallback_queue.popleft() if self._fallback_queue else None
+        # 脚本不能阻塞等待，队列为空时轮询
+        deadline = time.monotonic() + timeout
+        while True:
+            with metrics.REDIS_SECONDS.time(operation='pdf_job_claim'):
+                job_id = self._claim_script(keys=[QUEUE_KEY, PROCESSING_KEY],
+                                            args=[JOB_PREFIX, time.time() + self.lease_seconds])
+            if job_id is not None or time.monotonic() >= deadline:
+                return job_id
+            time.sleep(CLAIM_POLL_SECONDS)
+
+    def _run(self, job_id: str) -> bool:
+        """开始渲染任务；返回渲染名额是否已交给 _finish 归还"""
+        data = self._load(job_id)
+        if not data or 'conversation_data' not in data:
+            # 任务已过期或已被其他进程完成
+            self._ack(job_id)
+            return False
+        now = time.time()
+        attempts = int(data.get('attempts', 0)) + 1
+        self._save(job_id, status=RUNNING, started_at=now, attempts=attempts, lease_until=now + self.lease_seconds)
+        PDF_JOB_QUEUE_SECONDS.observe(max(0.0, now - float(data.get('created_at', now))))
+        PDF_JOBS_QUEUED.set(self.queue_length())
+        with self._lock:
+            self._running[job_id] = time.perf_counter()
+            PDF_JOBS_RUNNING.set(len(self._running))
+        try:
+            future = self._get_pool().submit(generate_pdf_content, data['conversation_data'],
+                                             data.get('summary', ''), data.get('user_info', ''))
+        except Exception as e:
+            self._finish(job_id, None, e)
+            return True
+        future.add_done_callback(lambda f: self._finish(job_id, f, f.exception()))
+        return True
+
+    def _finish(self, job_id: str, future, error: Optional[BaseException]):
+        """渲染结束（在进程池的回调线程中执行）"""
+        with self._lock:
+            started = self._running.pop(job_id, None)
+            PDF_JOBS_RUNNING.set(len(self._running))
+        if started is not None:
+            PDF_JOB_RENDER_SECONDS.observe(time.perf_counter() - started)
+        try:
+            if isinstance(error, BrokenProcessPool):
+                # 渲染进程崩溃：重建进程池，任务交给 recover 按尝试次数重新排队
+                print(f"PDF渲染进程异常退出 (job={job_id})，重建进程池")
+                self._pool = None
+                self._requeue_or_fail(job_id, "渲染进程异常退出")
+            elif error is not None:
+                print(f"PDF渲染失败 (job={job_id}): {error}")
+                self._save(job_id, status=FAILED, error=str(error), finished_at=time.time())
+                self._ack(job_id)
+                self._count("failed")
+            else:
+                self._save(job_id, status=DONE, result=future.result(), finished_at=time.time())
+                self._ack(job_id)
+                self._count("done")
+            self._drop_payload_if_finished(job_id)
+        except Exception as e:
+            print(f"更新PDF任务状态失败 (job={job_id}): {e}")
+            metrics.ERRORS.inc(component='pdf_jobs', operation='finish')
+        finally:
+            self._slots.release()
+
+    def _drop_payload_if_finished(self, job_id: str):
+        if self._load(job_id).get('status') in TERMINAL_STATES:
+            self._drop_payload(job_id)
+
+    def _ack(self, job_id: str):
+        if self.redis is not None:
+            self.redis.lrem(PROCESSING_KEY, 1, job_id)
+
+    def _requeue_or_fail(self, job_id: str, reason: str):
+        """把中断的任务放回队首；超过最多尝试次数时标记失败"""
+        data = self._load(job_id)
+        if not data:
+            self._ack(job_id)
+            return
+        if int(data.get('attempts', 0)) >= self.max_attempts:
+            self._save(job_id, status=FAILED, error=reason, finished_at=time.time())
+            self._ack(job_id)
+            self._count("failed")
+            return
+        self._save(job_id, status=QUEUED, lease_until=0)
+        if self.redis is None:
+            with self._fallback_cond:
+                self._fallback_queue.appendleft(job_id)
+                self._fallback_cond.notify()
+        else:
+            pipe = self.redis.pipeline()
+            pipe.lrem(PROCESSING_KEY, 1, job_id)
+            pipe.lpush(QUEUE_KEY, job_id)
+            pipe.execute()
+        self._count("requeued")
+
+    def _renew_leases(self):
+        with self._lock:
+            running = list(self._running)
+        lease_until = time.time() + self.lease_seconds
+        for job_id in running:
+            self._save(job_id, lease_until=lease_until)
+
+    def recover(self) -> int:
+        """把租约已过期的处理中任务（所在工作进程已重启或崩溃）重新排队，返回处理的任务数"""
+        if self.redis is None:
+            return 0
+        recovered = 0
+        now = time.time()
+        for job_id in self.redis.lrange(PROCESSING_KEY, 0, -1):
+            data = self._load(job_id)
+            if data and float(data.get('lease_until') or 0) > now:
+                continue
+            # 只有从处理中列表成功移除的进程负责重新排队，避免多个进程重复处理
+            if not self.redis.lrem(PROCESSING_KEY, 1, job_id):
+                continue
+            recovered += 1
+            if not data or data.get('status') in TERMINAL_STATES:
+                continue
+            print(f"PDF任务 {job_id} 的租约已过期，重新排队")
+            self._requeue_or_fail(job_id, "渲染进程中断")
+        return recovered
+
+    def close(self):
+        """停止调度；未完成的任务在租约过期后由其他进程接手"""
+        self._closed = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ---------------- 统计 ----------------
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+        PDF_JOBS.inc(status=key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["running"] = len(self._running)
+        stats["queued"] = self.queue_length()
+        stats["workers"] = self.workers
+        stats["backend"] = 'redis' if self.redis is not None else 'memory'
+        return stats
+
+
+# 全局PDF任务队列实例
+_pdf_job_queue: Optional[PdfJobQueue] = None
+_pdf_job_queue_lock = threading.Lock()
+
+def get_pdf_job_queue() -> PdfJobQueue:
+    """获取全局PDF任务队列（懒加载，进程退出时停止调度）"""
+    global _pdf_job_queue
+    if _pdf_job_queue is None:
+        with _pdf_job_queue_lock:
+            if _pdf_job_queue is None:
+                _pdf_job_queue = PdfJobQueue(
+                    workers=int(os.getenv("PDF_JOB_WORKERS", "2")),
+                    max_queue=int(os.getenv("PDF_JOB_MAX_QUEUE", "100")),
+                    lease_seconds=float(os.getenv("PDF_JOB_LEASE", "60")),
+                    max_attempts=int(os.getenv("PDF_JOB_MAX_ATTEMPTS", "2")),
+                    job_ttl=int(os.getenv("PDF_JOB_TTL", "86400")),
+                )
+                atexit.register(_pdf_job_queue.close)
+    return _pdf_job_queue
+
+
+if __name__ == '__main__':
+    # 独立的渲染进程：只消费Redis中的任务
+    job_queue = get_pdf_job_queue()
+    job_queue.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(f"PDF任务队列: {job_queue.get_stats()}")
+    except KeyboardInterrupt:
+        job_queue.close()
@@ -0,0 +1,260 @@
+"""
+结构化旅行表单的确定性预取模块
+/plan_travel 提交的是结构化表单（出发地、目的地、日期、人数、住宿偏好等），
+不需要让 ReAct 信息收集智能体逐步"想"出要搜什么。这里直接由表单字段推导出工具调用：
+- search_google_flights：出发地/目的地能解析出机场代码时搜索往返（或单程）航班
+- search_google_hotels：按住宿偏好和入住/离店日期搜索酒店
+- search_google_maps：热门景点、按旅行偏好的景点、按饮食要求的餐厅
+
+所有调用并发执行（经由MCP会话池分摊），结果压缩合并后直接交给行程规划智能体；
+参数相同的调用优先使用跨用户缓存中的结果（agent/collector_cache.py）。
+一个结果都没拿到时（如工具不可用），退回到 LLM 驱动的信息收集智能体。
+"""
+
+import asyncio
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Collection, Dict, List, Optional
+
+import metrics
+
+PREFETCH_CALL_TIMEOUT = 30
+MAX_MAPS_QUERIES = 4
+MAX_ITEMS_PER_LIST = 5
+MAX_ITEM_CHARS = 600
+
+PREFETCH_CALLS = metrics.registry.counter(
+    'travel_prefetch_calls_total', '旅行表单预取的工具调用次数', ('tool', 'result'))
+
+# 常见城市 -> 机场代码（多个机场用逗号分隔，Google Flights 支持同时搜索）
+CITY_AIRPORTS = {
+    '北京': 'PEK,PKX', '上海': 'PVG,SHA', '广州': 'CAN', '深圳': 'SZX', '成都': 'TFU,CTU',
+    '重庆': 'CKG', '杭州': 'HGH', '西安': 'XIY', '南京': 'NKG', '武汉': 'WUH', '长沙': 'CSX',
+    '昆明': 'KMG', '厦门': 'XMN', '青岛': 'TAO', '大连': 'DLC', '沈阳': 'SHE', '哈尔滨': 'HRB',
+    '天津': 'TSN', '郑州': 'CGO', '济南': 'TNA', '福州': 'FOC', '南宁': 'NNG', '贵阳': 'KWE',
+    '海口': 'HAK', '三亚': 'SYX', '桂林': 'KWL', '丽江': 'LJG', '拉萨': 'LXA', '乌鲁木齐': 'URC',
+    '兰州': 'LHW', '呼和浩特': 'HET', '长春': 'CGQ', '合肥': 'HFE', '南昌': 'KHN', '太原': 'TYN',
+    '石家庄': 'SJW', '宁波': 'NGB', '温州': 'WNZ', '无锡': 'WUX', '珠海': 'ZUH', '西宁': 'XNN',
+    '银川': 'INC', '张家界': 'DYG', '西双版纳': 'JHG', '香港': 'HKG', '澳门': 'MFM', '台北': 'TPE,TSA',
+    '东京': 'NRT,HND', '大阪': 'KIX,ITM', '京都': 'KIX,ITM', '札幌': 'CTS', '福冈': 'FUK', '冲绳': 'OKA',
+    '首尔': 'ICN,GMP', '釜山': 'PUS', '济州': 'CJU', '曼谷': 'BKK,DMK', '清迈': 'CNX', '普吉': 'HKT',
+    '新加坡': 'SIN', '吉隆坡': 'KUL', '巴厘岛': 'DPS', '河内': 'HAN', '胡志明市': 'SGN', '岘港': 'DAD',
+    '马尼拉': 'MNL', '迪拜': 'DXB', '伦敦': 'LHR,LGW', '巴黎': 'CDG,ORY', '罗马': 'FCO', '米兰': 'MXP',
+    '巴塞罗那': 'BCN', '马德里': 'MAD', '法兰克福': 'FRA', '慕尼黑': 'MUC', '阿姆斯特丹': 'AMS',
+    '苏黎世': 'ZRH', '伊斯坦布尔': 'IST', '莫斯科': 'SVO,DME', '纽约': 'JFK,EWR,LGA', '洛杉矶': 'LAX',
+    '旧金山': 'SFO', '西雅图': 'SEA', '芝加哥': 'ORD', '温哥华': 'YVR', '多伦多': 'YYZ',
+    '悉尼': 'SYD', '墨尔本': 'MEL', '奥克兰': 'AKL', '马尔代夫': 'MLE',
+}
+
+# 住宿偏好 -> (酒店搜索关键词, hotel_class)
+ACCOMMODATION_SEARCH = {
+    '豪华酒店': ('豪华酒店', '5'),
+    '精品酒店': ('精品酒店', '4,5'),
+    '商务酒店': ('商务酒店', '3,4'),
+    '经济型酒店': ('经济型酒店', '2,3'),
+    '民宿/公寓': ('民宿 公寓', None),
+    '青年旅社': ('青年旅社', None),
+}
+
+# 旅行偏好 -> 地图搜索关键词
+PREFERENCE_QUERIES = {
+    '文化历史': '博物馆 历史古迹',
+    '自然风光': '自然风景区 公园',
+    '购物娱乐': '购物中心 商业街',
+    '冒险运动': '户外运动 探险',
+    '休闲放松': '温泉 休闲度假',
+    '摄影艺术': '摄影打卡地 艺术馆',
+    '夜生活': '夜市 酒吧街',
+}
+
+# 饮食要求 -> 餐厅搜索关键词
+DIETARY_QUERIES = {
+    '素食': '素食餐厅',
+    '清真': '清真餐厅',
+    '无海鲜': '特色餐厅',
+    '无辣': '特色餐厅',
+    '低盐': '健康轻食餐厅',
+}
+
+# 各工具结果中值得保留的列表字段
+RESULT_LIST_KEYS = {
+    'search_google_flights': ('best_flights', 'other_flights'),
+    'search_google_hotels': ('properties',),
+    'search_google_maps': ('local_results', 'place_results'),
+}
+
+
+@dataclass
+class PrefetchCall:
+    """一次预取的工具调用"""
+    label: str
+    tool: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    # 信息类别：flights / hotels / attractions / restaurants
+    topic: str = ''
+
+
+def resolve_airports(city: str) -> Optional[str]:
+    """城市名或机场代码 -> 机场代码；无法解析时返回None"""
+    city = (city or '').strip()
+    if re.fullmatch(r'[A-Za-z]{3}(,[A-Za-z]{3})*', city):
+        return city.upper()
+    for name, codes in CITY_AIRPORTS.items():
+        if name in city:
+            return codes
+    return None
+
+
+def _as_list(value) -> List[str]:
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return [str(item) for item in value or []]
+
+
+def build_prefetch_calls(form_data: Dict[str, Any]) -> List[PrefetchCall]:
+    """由表单字段推导出需要并发执行的工具调用（同一表单总是得到相同的调用列表）"""
+    source = str(form_data.get('source') or '').strip()
+    destination = str(form_data.get('destination') or '').strip()
+    start_date = str(form_data.get('start_date') or '').strip()
+    end_date = str(form_data.get('end_date') or '').strip()
+    travelers = str(form_data.get('travelers') or 1)
+    if not destination:
+        return []
+
+    calls = []
+
+    departure, arrival = resolve_airports(source), resolve_airports(destination)
+    if departure and arrival and departure != arrival and start_date:
+        arguments = {'departure_id': departure, 'arrival_id': arrival, 'outbound_date': start_date,
+                     'adults': travelers, 'currency': 'CNY', 'hl': 'zh-cn'}
+        if end_date:
+            arguments.update(flight_type='round_trip', return_date=end_date)
+        else:
+            arguments['flight_type'] = 'one_way'
+        calls.append(PrefetchCall(f"航班 {source} → {destination}", 'search_google_flights', arguments, 'flights'))
+
+    if start_date and end_date:
+        keyword, hotel_class = ACCOMMODATION_SEARCH.get(form_data.get('accommodation_type'), ('酒店', None))
+        arguments = {'q': f"{destination} {keyword}", 'check_in_date': start_date, 'check_out_date': end_date,
+                     'adults': travelers, 'currency': 'CNY', 'hl': 'zh-cn'}
+        if hotel_class:
+            arguments['hotel_class'] = hotel_class
+        calls.append(PrefetchCall(f"{destination}住宿", 'search_google_hotels', arguments, 'hotels'))
+
+    queries = [('热门景点', f"{destination} 热门景点", 'attractions')]
+    for preference in _as_list(form_data.get('preferences')):
+        if preference in PREFERENCE_QUERIES:
+            queries.append((preference, f"{destination} {PREFERENCE_QUERIES[preference]}", 'attractions'))
+    restaurant = next((DIETARY_QUERIES[d] for d in _as_list(form_data.get('dietary_restrictions'))
+                       if d in DIETARY_QUERIES), '特色美食餐厅')
+    # 餐厅总是保留，景点类查询按偏好顺序截断
+    queries = queries[:MAX_MAPS_QUERIES - 1] + [('餐厅', f"{destination} {restaurant}", 'restaurants')]
+    for label, query, topic in queries:
+        calls.append(PrefetchCall(f"{destination}{label}", 'search_google_maps', {'query': query}, topic))
+
+    return calls
+
+
+def compact_result(tool: str, output: str) -> str:
+    """只保留结果中前几项的关键信息，避免把整份搜索结果塞进规划提示词"""
+    try:
+        data = json.loads(output)
+    except (TypeError, ValueError):
+        return output[:MAX_ITEM_CHARS * MAX_ITEMS_PER_LIST]
+    if isinstance(data, dict) and data.get('error'):
+        raise RuntimeError(data['error'])
+
+    lines = []
+    for key in RESULT_LIST_KEYS.get(tool, ()):
+        items = data.get(key) if isinstance(data, dict) else None
+        if isinstance(items, dict):
+            items = [items]
+        for item in (items or [])[:MAX_ITEMS_PER_LIST]:
+            text = json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+            lines.append(f"- {text[:MAX_ITEM_CHARS]}")
+    if not lines:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        return text[:MAX_ITEM_CHARS * MAX_ITEMS_PER_LIST]
+    return "\n".join(lines)
+
+
+class TravelPrefetchAgent:
+    """结构化表单的预取阶段：并发执行推导出的工具调用，失败时退回信息收集智能体"""
+
+    def __init__(self, tools: List[Any], collector, cache=None):
+        self.tools = {tool.name: tool for tool in tools}
+        self.collector = collector
+        # 跨用户的搜索结果缓存（CollectorCache），相同参数的调用直接使用缓存结果
+        self.cache = cache
+        print(f"旅行预取阶段已创建，可用工具数量: {len(self.tools)}")
+
+    async def astream_collect(self, form_data: Dict[str, Any], fallback_request: str,
+                              topics: Optional[Collection[str]] = None):
+        """
+        与 InformationCollectorAgent.astream_collect 相同的产出协议：
+        ("progress", dict) 进度事件，最后一项为 ("result", str) 合并后的信息
+
+        topics 不为空时只执行这些信息类别的调用（同一对话中只补充查询参数变化影响到的部分）
+        """
+        calls = [call for call in build_prefetch_calls(form_data)
+                 if call.tool in self.tools and (not topics or call.topic in topics)]
+        if not calls:
+            async for item in self.collector.astream_collect(fallback_request):
+                yield item
+            return
+
+        started = time.perf_counter()
+        yield "progress", {"type": "collecting", "mode": "prefetch", "calls": len(calls)}
+        for call in calls:
+            yield "progress", {"type": "tool_start", "tool": call.tool, "input": call.label}
+
+        destination = str(form_data.get('destination') or '')
+        tasks = [asyncio.ensure_future(self._run(call, destination)) for call in calls]
+        results = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                call, elapsed, text, error, cached = await next_done
+                results[id(call)] = text
+                event = {"type": "tool_end", "tool": call.tool, "ms": elapsed, "preview": call.label}
+                if error:
+                    event["error"] = error
+                if cached:
+                    event["cached"] = True
+                yield "progress", event
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # 按调用列表的顺序合并，保证同一表单的规划输入稳定
+        sections = [f"### {call.label}\n{results[id(call)]}" for call in calls if results.get(id(call))]
+        if not sections:
+            print("旅行预取没有拿到任何结果，退回信息收集智能体")
+            async for item in self.collector.astream_collect(fallback_request):
+                yield item
+            return
+
+        yield "progress", {"type": "collected", "ms": int((time.perf_counter() - started) * 1000)}
+        yield "result", "## 实时搜索结果（按表单预取）\n\n" + "\n\n".join(sections)
+
+    async def _run(self, call: PrefetchCall, destination: str = ""):
+        """执行一次调用（先查跨用户缓存），返回 (调用, 耗时毫秒, 压缩后的结果, 错误信息, 是否来自缓存)"""
+        started = time.perf_counter()
+        cache_fields = {'tool': call.tool, **call.arguments}
+        try:
+            if self.cache is not None:
+                text = await asyncio.to_thread(self.cache.get, call.topic, cache_fields)
+                if text:
+                    PREFETCH_CALLS.inc(tool=call.tool, result='cached')
+                    return call, int((time.perf_counter() - started) * 1000), text, None, True
+            output = await asyncio.wait_for(self.tools[call.tool].ainvoke(call.arguments), PREFETCH_CALL_TIMEOUT)
+            text = compact_result(call.tool, output if isinstance(output, str) else str(output))
+            PREFETCH_CALLS.inc(tool=call.tool, result='ok')
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put, call.topic, cache_fields, text, destination)
+            return call, int((time.perf_counter() - started) * 1000), text, None, False
+        except Exception as e:
+            print(f"预取 {call.label} 失败: {e}")
+            PREFETCH_CALLS.inc(tool=call.tool, result='error')
+            return call, int((time.perf_counter() - started) * 1000), None, str(e) or type(e).__name__, False
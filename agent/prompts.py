@@ -277,6 +277,17 @@ PDF_PROMPT = """你是一个专业的旅行攻略PDF生成专家。你的任务
 请确保生成的旅行攻略PDF报告内容完整、结构清晰、实用性强。
 """
 
+# 滚动摘要提示词：把滑出记忆窗口的对话折叠进已有摘要
+MEMORY_SUMMARY_PROMPT = """你负责维护一段对话的滚动摘要。下面给出已有摘要和紧接其后的若干轮对话，请输出更新后的完整摘要。
+
+### 要求：
+- 保留用户的关键信息和偏好：出发地、目的地、日期、人数、预算、饮食/住宿偏好等
+- 保留已确定的结论：选定的航班、酒店、行程安排要点、用户明确拒绝的方案
+- 删除寒暄和重复内容，不要编造对话中没有的信息
+- 使用简洁的中文要点，总长度不超过{max_chars}字
+- 只输出摘要本身
+"""
+
 # 旅行规划表单提示词模板
 TRAVEL_FORM_PROMPT_TEMPLATE = """你是一个专业的AI旅行规划专家，请根据用户提供的详细旅行需求制定完整的旅行方案。
 
@@ -341,6 +352,35 @@ def format_travel_request_prompt(form_data):
         travel_system_prompt=TRAVEL_SYSTEM_PROMPT
     )
 
+def format_travel_request_title(form_data):
+    """根据表单数据生成对话标题，用于历史记录列表"""
+    source = form_data.get('source', '').strip()
+    destination = form_data.get('destination', '').strip()
+    if source and destination:
+        return f"{source} → {destination} 旅行规划"
+    return f"{destination or source}旅行规划" if (destination or source) else "旅行规划"
+
+def normalize_travel_request(form_data):
+    """
+    规范化旅行规划表单，用于识别重复提交
+
+    只保留 format_travel_request_prompt 用到的字段；字符串去空白并统一大小写，
+    列表字段与勾选顺序无关，空值视为未填写。
+    """
+    fields = ('source', 'destination', 'start_date', 'end_date', 'travelers', 'budget_per_person',
+              'accommodation_type', 'preferences', 'transportation_mode', 'dietary_restrictions')
+    normalized = {}
+    for field in fields:
+        value = form_data.get(field)
+        if isinstance(value, str):
+            value = value.strip().casefold()
+        elif isinstance(value, list):
+            value = sorted(str(item).strip().casefold() for item in value if str(item).strip())
+        if value in (None, '', []):
+            continue
+        normalized[field] = value
+    return normalized
+
 # 简化版旅行规划提示词（用于表单数据处理）
 TRAVEL_FORM_SYSTEM_PROMPT = """你是一个专业的AI旅行规划专家，具备全方位的旅行规划能力。
 
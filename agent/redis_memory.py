@@ -4,10 +4,13 @@ Redis记忆管理模块
 """
 
 import json
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from datetime import datetime, timedelta
 
+import metrics
+
 try:
     import redis
     REDIS_AVAILABLE = True
@@ -15,6 +18,34 @@ except ImportError:
     REDIS_AVAILABLE = False
     print("警告: redis包未安装，将使用内存模式")
 
+# 追加消息并把超出窗口的旧消息移入待摘要列表，返回移出的条数
+ADD_MESSAGE_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[1], ARGV[1])
+local max_length = tonumber(ARGV[2])
+local overflow = length - max_length
+if overflow > 0 then
+    local dropped = redis.call('LRANGE', KEYS[1], 0, overflow - 1)
+    redis.call('LTRIM', KEYS[1], -max_length, -1)
+    redis.call('RPUSH', KEYS[2], unpack(dropped))
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return math.max(overflow, 0)
+"""
+
+# 版本号一致时写入新摘要，并从待摘要列表头部移除已折叠的消息；版本不一致返回0
+COMMIT_SUMMARY_SCRIPT = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+if version ~= tonumber(ARGV[1]) then
+    return 0
+end
+local covered = tonumber(redis.call('HGET', KEYS[1], 'covered') or '0') + tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], 'summary', ARGV[2], 'version', version + 1, 'covered', covered, 'updated_at', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('LTRIM', KEYS[2], ARGV[3], -1)
+return version + 1
+"""
+
 
 class RedisMemory:
     """基于Redis的智能体记忆存储"""
@@ -35,8 +66,16 @@ class RedisMemory:
             memory_ttl: 记忆过期时间（秒）
         """
         self.key_prefix = key_prefix
+        self.summary_prefix = 'agent_summary:'
+        self.overflow_prefix = 'agent_memory_overflow:'
         self.max_memory_length = max_memory_length
         self.memory_ttl = memory_ttl
+        # 设置后（滚动摘要启用时），超出窗口的旧消息不再直接丢弃，而是移入待摘要列表并回调 on_overflow(session_id)
+        self.on_overflow: Optional[Callable[[str], None]] = None
+        self._scripts = {}
+        self._fallback_lock = threading.Lock()
+        self._fallback_overflow: Dict[str, List[Dict[str, Any]]] = {}
+        self._fallback_summary: Dict[str, Dict[str, Any]] = {}
         
         # 初始化Redis连接
         if REDIS_AVAILABLE:
@@ -66,6 +105,16 @@ class RedisMemory:
     def _get_memory_key(self, session_id: str) -> str:
         """生成记忆存储键"""
         return f"{self.key_prefix}{session_id}"
+
+    def session_keys(self, session_id: str) -> List[str]:
+        """会话在Redis中的全部键：记忆、滚动摘要、待摘要列表"""
+        return [self._get_memory_key(session_id), f"{self.summary_prefix}{session_id}",
+                f"{self.overflow_prefix}{session_id}"]
+
+    def _script(self, name: str, source: str):
+        if name not in self._scripts:
+            self._scripts[name] = self.redis_client.register_script(source)
+        return self._scripts[name]
     
     def add_message(self, session_id: str, role: str, content: str) -> bool:
         """
@@ -95,18 +144,31 @@ class RedisMemory:
         try:
             key = self._get_memory_key(session_id)
             
-            # 将消息添加到列表尾部
-            self.redis_client.rpush(key, json.dumps(message, ensure_ascii=False))
-            
-            # 限制列表长度
-            self.redis_client.ltrim(key, -self.max_memory_length, -1)
+            raw = json.dumps(message, ensure_ascii=False)
+            if self.on_overflow is not None:
+                # 追加、截断和移入待摘要列表在一个脚本内原子完成
+                with metrics.REDIS_SECONDS.time(operation='add_message'):
+                    overflow = self._script('add_message', ADD_MESSAGE_SCRIPT)(
+                        keys=[key, f"{self.overflow_prefix}{session_id}"],
+                        args=[raw, self.max_memory_length, self.memory_ttl])
+                if overflow:
+                    self.on_overflow(session_id)
+                return True
             
-            # 设置过期时间
-            self.redis_client.expire(key, self.memory_ttl)
+            with metrics.REDIS_SECONDS.time(operation='add_message'):
+                # 将消息添加到列表尾部
+                self.redis_client.rpush(key, raw)
+                
+                # 限制列表长度
+                self.redis_client.ltrim(key, -self.max_memory_length, -1)
+                
+                # 设置过期时间
+                self.redis_client.expire(key, self.memory_ttl)
             
             return True
         except Exception as e:
             print(f"Redis添加消息失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='add_message')
             return False
     
     def _add_message_fallback(self, session_id: str, message: Dict[str, Any]) -> bool:
@@ -117,8 +179,14 @@ class RedisMemory:
         self._fallback_memory[session_id].append(message)
         
         # 限制长度
-        if len(self._fallback_memory[session_id]) > self.max_memory_length:
+        overflow = len(self._fallback_memory[session_id]) - self.max_memory_length
+        if overflow > 0:
+            if self.on_overflow is not None:
+                with self._fallback_lock:
+                    self._fallback_overflow.setdefault(session_id, []).extend(self._fallback_memory[session_id][:overflow])
             self._fallback_memory[session_id] = self._fallback_memory[session_id][-self.max_memory_length:]
+            if self.on_overflow is not None:
+                self.on_overflow(session_id)
         
         return True
     
@@ -143,12 +211,13 @@ class RedisMemory:
         try:
             key = self._get_memory_key(session_id)
             
-            if limit:
-                # 获取最后N条消息
-                raw_messages = self.redis_client.lrange(key, -limit, -1)
-            else:
-                # 获取所有消息
-                raw_messages = self.redis_client.lrange(key, 0, -1)
+            with metrics.REDIS_SECONDS.time(operation='get_messages'):
+                if limit:
+                    # 获取最后N条消息
+                    raw_messages = self.redis_client.lrange(key, -limit, -1)
+                else:
+                    # 获取所有消息
+                    raw_messages = self.redis_client.lrange(key, 0, -1)
             
             messages = []
             for raw_msg in raw_messages:
@@ -161,6 +230,7 @@ class RedisMemory:
             return messages
         except Exception as e:
             print(f"Redis获取消息失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='get_messages')
             return []
     
     def _get_messages_fallback(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
@@ -170,6 +240,68 @@ class RedisMemory:
             return messages[-limit:]
         return messages
     
+    # ---------------- 滚动摘要 ----------------
+    def get_summary(self, session_id: str) -> Dict[str, Any]:
+        """
+        获取会话的滚动摘要
+
+        Returns:
+            Dict: {'summary': 摘要文本, 'version': 版本号（每次写入加1）, 'covered': 已折叠进摘要的消息数}
+        """
+        if not self.use_redis:
+            with self._fallback_lock:
+                return dict(self._fallback_summary.get(session_id) or {'summary': '', 'version': 0, 'covered': 0})
+        try:
+            with metrics.REDIS_SECONDS.time(operation='get_summary'):
+                data = self.redis_client.hgetall(f"{self.summary_prefix}{session_id}") or {}
+            return {'summary': data.get('summary', ''), 'version': int(data.get('version', 0)),
+                    'covered': int(data.get('covered', 0))}
+        except Exception as e:
+            print(f"Redis获取对话摘要失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='get_summary')
+            return {'summary': '', 'version': 0, 'covered': 0}
+
+    def get_overflow(self, session_id: str, limit: int) -> List[Dict[str, Any]]:
+        """获取待折叠进摘要的最早 limit 条消息"""
+        if not self.use_redis:
+            with self._fallback_lock:
+                return list(self._fallback_overflow.get(session_id, [])[:limit])
+        try:
+            with metrics.REDIS_SECONDS.time(operation='get_overflow'):
+                raw_messages = self.redis_client.lrange(f"{self.overflow_prefix}{session_id}", 0, limit - 1)
+            return [json.loads(raw) for raw in raw_messages]
+        except Exception as e:
+            print(f"Redis获取待摘要消息失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='get_overflow')
+            return []
+
+    def commit_summary(self, session_id: str, expected_version: int, summary: str, folded: int) -> bool:
+        """
+        写入新摘要（乐观并发控制）
+
+        只有当前版本仍为 expected_version 时才写入，并从待摘要列表中移除已折叠的 folded 条消息；
+        其他写入者抢先更新时返回False，调用方应重新读取后重试。
+        """
+        if not self.use_redis:
+            with self._fallback_lock:
+                current = self._fallback_summary.get(session_id) or {'summary': '', 'version': 0, 'covered': 0}
+                if current['version'] != expected_version:
+                    return False
+                self._fallback_summary[session_id] = {'summary': summary, 'version': expected_version + 1,
+                                                      'covered': current['covered'] + folded}
+                del self._fallback_overflow.get(session_id, [])[:folded]
+            return True
+        try:
+            with metrics.REDIS_SECONDS.time(operation='commit_summary'):
+                version = self._script('commit_summary', COMMIT_SUMMARY_SCRIPT)(
+                    keys=[f"{self.summary_prefix}{session_id}", f"{self.overflow_prefix}{session_id}"],
+                    args=[expected_version, summary, folded, self.memory_ttl, datetime.now().isoformat()])
+            return bool(version)
+        except Exception as e:
+            print(f"Redis写入对话摘要失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='commit_summary')
+            return False
+
     def clear_session(self, session_id: str) -> bool:
         """
         清除会话记忆
@@ -182,15 +314,19 @@ class RedisMemory:
         """
         if self.use_redis:
             try:
-                key = self._get_memory_key(session_id)
-                self.redis_client.delete(key)
+                with metrics.REDIS_SECONDS.time(operation='clear_session'):
+                    self.redis_client.delete(*self.session_keys(session_id))
                 return True
             except Exception as e:
                 print(f"Redis清除会话失败: {e}")
+                metrics.ERRORS.inc(component='redis', operation='clear_session')
                 return False
         else:
             if session_id in self._fallback_memory:
                 del self._fallback_memory[session_id]
+            with self._fallback_lock:
+                self._fallback_overflow.pop(session_id, None)
+                self._fallback_summary.pop(session_id, None)
             return True
     
     def get_session_count(self) -> int:
@@ -198,10 +334,12 @@ class RedisMemory:
         if self.use_redis:
             try:
                 pattern = f"{self.key_prefix}*"
-                keys = self.redis_client.keys(pattern)
+                with metrics.REDIS_SECONDS.time(operation='session_count'):
+                    keys = self.redis_client.keys(pattern)
                 return len(keys)
             except Exception as e:
                 print(f"Redis获取会话数量失败: {e}")
+                metrics.ERRORS.inc(component='redis', operation='session_count')
                 return 0
         else:
             return len(self._fallback_memory)
@@ -243,6 +381,11 @@ class SimpleMemory:
     def add_message(self, role: str, content: str):
         """添加消息（兼容原接口）"""
         return self.redis_memory.add_message(self.session_id, role, content)
+
+    @property
+    def summary(self) -> str:
+        """滑出记忆窗口的早期对话的滚动摘要（没有时为空字符串）"""
+        return self.redis_memory.get_summary(self.session_id)['summary']
     
     def clear(self):
         """清除记忆"""
@@ -251,10 +394,13 @@ class SimpleMemory:
 
 # 全局Redis记忆管理器实例
 _redis_memory_manager = None
+_redis_memory_manager_lock = threading.Lock()
 
 def get_redis_memory_manager(**kwargs) -> RedisMemory:
-    """获取全局Redis记忆管理器实例（懒加载）"""
+    """获取全局Redis记忆管理器实例（懒加载，线程安全）"""
     global _redis_memory_manager
     if _redis_memory_manager is None:
-        _redis_memory_manager = RedisMemory(**kwargs)
-    return _redis_memory_manager 
\ No newline at end of file
+        with _redis_memory_manager_lock:
+            if _redis_memory_manager is None:
+                _redis_memory_manager = RedisMemory(**kwargs)
+    return _redis_memory_manager
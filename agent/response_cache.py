@@ -0,0 +1,280 @@
+"""
+回复缓存模块
+许多通用/旅行问题在不同用户之间逐字重复（如"北京三日游推荐"、签证问题），每次都要完整生成一遍。
+启用后在 NormalAgent 前加一层精确匹配缓存（存放在Redis中，多个工作进程共享）：
+
+- 键：规范化后的用户消息 + 智能体类型 + 提示词版本 + 相关历史窗口（最近几条消息和滚动摘要）的哈希
+- 有历史对话时，含指代的问题（"那里呢"、"继续"、"it" 等）依赖上下文，不查也不写缓存
+- 条目按TTL过期；条目数超过上限时按最近访问时间（LRU）淘汰
+- 命中时按流式速度分块回放，前端体验与实时生成一致
+- 统计命中率和节省的token数（提示词 + 生成）
+
+Redis 不可用时退化为进程内的 LRU 字典。
+
+配置（环境变量）:
+    RESPONSE_CACHE_ENABLED          是否启用（默认0）
+    RESPONSE_CACHE_TTL              条目有效期（秒，默认86400）
+    RESPONSE_CACHE_MAX_ENTRIES      最多条目数（默认5000）
+    RESPONSE_CACHE_HISTORY_WINDOW   计入键的最近历史消息数（默认2）
+    RESPONSE_CACHE_REPLAY_CPS       回放速度（字/秒，默认300，0为不限速）
+    RESPONSE_CACHE_VERSION          手动失效全部缓存时修改（默认1）
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+try:
+    from .redis_memory import get_redis_memory_manager
+except ImportError:
+    from agent.redis_memory import get_redis_memory_manager
+
+RESPONSE_CACHE_REQUESTS = metrics.registry.counter(
+    'response_cache_requests_total', '回复缓存查询次数（bypass 为依赖上下文未查缓存）', ('agent_type', 'result'))
+RESPONSE_CACHE_SAVED_TOKENS = metrics.registry.counter(
+    'response_cache_saved_tokens_total', '回复缓存命中节省的token数', ('agent_type', 'kind'))
+RESPONSE_CACHE_EVICTIONS = metrics.registry.counter(
+    'response_cache_evictions_total', '回复缓存因超出条目上限淘汰的条目数')
+
+ENTRY_PREFIX = 'response_cache:entry:'
+LRU_KEY = 'response_cache:lru'
+
+# 写入条目并登记访问时间；条目数超过上限时淘汰最久未访问的条目，返回淘汰数
+PUT_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[5])
+if excess <= 0 then
+    return 0
+end
+local oldest = redis.call('ZPOPMIN', KEYS[2], excess)
+for i = 1, #oldest, 2 do
+    redis.call('DEL', ARGV[6] .. oldest[i])
+end
+return excess
+"""
+
+# 有历史对话时，出现这些指代/承接词说明问题依赖上下文
+_CONTEXT_MARKERS = re.compile(
+    r'这个|那个|这些|那些|这里|那里|这儿|那儿|这家|那家|它|他们|她们|上面|上述|刚才|刚刚|之前|前面|'
+    r'继续|接着|再来|还有|另外|其他的|换一个|换个|第[一二三四五六七八九十\d]+[个天条点家]|'
+    r'\b(it|its|that|this|those|these|them|there|above|again|more|another|else)\b',
+    re.IGNORECASE)
+_PUNCTUATION = re.compile(r'[\s。．.，,！!？?～~、；;：:"“”\'‘’（）()【】\[\]…]+')
+
+
+def normalize_message(message: str) -> str:
+    """规范化用户消息：全角转半角、小写、去掉空白和标点"""
+    text = unicodedata.normalize('NFKC', message or '').lower()
+    return _PUNCTUATION.sub('', text)
+
+
+def is_context_dependent(message: str) -> bool:
+    """消息是否依赖之前的对话（含指代词或过短）"""
+    return len(normalize_message(message)) < 4 or bool(_CONTEXT_MARKERS.search(message or ''))
+
+
+def _replay_plan(text: str, cps: float, chunk_size: int = 16):
+    """回放的块间隔（超长文本加快回放，整体不超过5秒）"""
+    if cps <= 0:
+        return 0.0
+    return chunk_size / max(cps, len(text) / 5.0)
+
+
+def replay_text(text: str, cps: float, chunk_size: int = 16):
+    """按 cps（字/秒）的流式速度分块产出已有的回复"""
+    delay = _replay_plan(text, cps, chunk_size)
+    for i in range(0, len(text), chunk_size):
+        if i and delay:
+            time.sleep(delay)
+        yield text[i:i + chunk_size]
+
+
+async def areplay_text(text: str, cps: float, chunk_size: int = 16):
+    """replay_text 的异步版本"""
+    delay = _replay_plan(text, cps, chunk_size)
+    for i in range(0, len(text), chunk_size):
+        if i and delay:
+            await asyncio.sleep(delay)
+        yield text[i:i + chunk_size]
+
+
+class ResponseCache:
+    """精确匹配的回复缓存"""
+
+    def __init__(self, redis_memory=None, ttl: int = 86400, max_entries: int = 5000, history_window: int = 2,
+                 replay_cps: float = 300.0, version: str = "1", max_response_chars: int = 20000):
+        memory = redis_memory or get_redis_memory_manager()
+        self.redis = memory.redis_client if memory.use_redis else None
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.history_window = history_window
+        self.replay_cps = replay_cps
+        self.version = version
+        self.max_response_chars = max_response_chars
+
+        self._put_script = self.redis.register_script(PUT_SCRIPT) if self.redis is not None else None
+        self._fallback: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypass": 0, "stores": 0, "evictions": 0,
+                      "saved_prompt_tokens": 0, "saved_completion_tokens": 0}
+
+    # ---------------- 键 ----------------
+    def make_key(self, message: str, agent_type: str, prompt_version: str,
+                 history: Optional[List[Dict[str, Any]]] = None, summary: str = "") -> Optional[str]:
+        """
+        计算缓存键；问题依赖上下文时返回None（不使用缓存）
+
+        Args:
+            message: 用户消息
+            agent_type: 智能体类型（general / travel）
+            prompt_version: 提示词版本（系统提示词和模型的哈希）
+            history: 按时间顺序的历史消息
+            summary: 滚动摘要
+        """
+        history = [m for m in history or [] if m.get('role') in ('user', 'assistant')]
+        if (history or summary) and is_context_dependent(message):
+            return None
+        window = history[-self.history_window:] if self.history_window > 0 else []
+        payload = json.dumps({
+            'message': normalize_message(message),
+            'agent_type': agent_type,
+            'prompt': prompt_version,
+            'version': self.version,
+            'history': [[m['role'], m.get('content', '')] for m in window],
+            'summary': summary if window else '',
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # ---------------- 读写 ----------------
+    def get(self, key: Optional[str], agent_type: str) -> Optional[Dict[str, Any]]:
+        """查询缓存（key 为None时计为 bypass），命中时返回条目 {'response', 'prompt_tokens', 'completion_tokens'}"""
+        if key is None:
+            self._record(agent_type, 'bypass')
+            return None
+        entry = self._get_redis(key) if self.redis is not None else self._get_fallback(key)
+        if entry is None:
+            self._record(agent_type, 'miss')
+            return None
+        self._record(agent_type, 'hit')
+        with self._lock:
+            self.stats['saved_prompt_tokens'] += entry.get('prompt_tokens', 0)
+            self.stats['saved_completion_tokens'] += entry.get('completion_tokens', 0)
+        RESPONSE_CACHE_SAVED_TOKENS.inc(entry.get('prompt_tokens', 0), agent_type=agent_type, kind='prompt')
+        RESPONSE_CACHE_SAVED_TOKENS.inc(entry.get('completion_tokens', 0), agent_type=agent_type, kind='completion')
+        return entry
+
+    def _get_redis(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with metrics.REDIS_SECONDS.time(operation='response_cache_get'):
+                raw = self.redis.get(f"{ENTRY_PREFIX}{key}")
+                if raw is None:
+                    # 条目已过期，顺带清理LRU索引
+                    self.redis.zrem(LRU_KEY, key)
+                    return None
+                self.redis.zadd(LRU_KEY, {key: time.time()})
+            return json.loads(raw)
+        except Exception as e:
+            print(f"Redis读取回复缓存失败: {e}")
+            metrics.ERRORS.inc(component='redis', operation='response_cache_get')
+            return None
+
+    def _get_fallback(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._fallback.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at < time.monotonic():
+                del self._fallback[key]
+                return None
+            self._fallback.move_to_end(key)
+            return entry
+
+    def put(self, key: Optional[str], response: str, prompt_tokens: int, completion_tokens: int) -> bool:
+        """写入完整生成的回复（空回复和超长回复不缓存）"""
+        if key is None or not response.strip() or len(response) > self.max_response_chars:
+            return False
+        entry = {'response': response, 'prompt_tokens': prompt_tokens,
+                 'completion_tokens': completion_tokens, 'created_at': time.time()}
+        if self.redis is not None:
+            try:
+                with metrics.REDIS_SECONDS.time(operation='response_cache_put'):
+                    evicted = self._put_script(
+                        keys=[f"{ENTRY_PREFIX}{key}", LRU_KEY],
+                        args=[key, json.dumps(entry, ensure_ascii=False), self.ttl, time.time(),
+                              self.max_entries, ENTRY_PREFIX])
+            except Exception as e:
+                print(f"Redis写入回复缓存失败: {e}")
+                metrics.ERRORS.inc(component='redis', operation='response_cache_put')
+                return False
+        else:
+            with self._lock:
+                self._fallback[key] = (time.monotonic() + self.ttl, entry)
+                self._fallback.move_to_end(key)
+                evicted = 0
+                while len(self._fallback) > self.max_entries:
+                    self._fallback.popitem(last=False)
+                    evicted += 1
+        with self._lock:
+            self.stats['stores'] += 1
+            self.stats['evictions'] += evicted
+        if evicted:
+            RESPONSE_CACHE_EVICTIONS.inc(evicted)
+        return True
+
+    # ---------------- 回放 ----------------
+    def replay(self, response: str):
+        """按流式速度分块产出缓存的回复"""
+        return replay_text(response, self.replay_cps)
+
+    def areplay(self, response: str):
+        """replay 的异步版本"""
+        return areplay_text(response, self.replay_cps)
+
+    # ---------------- 统计 ----------------
+    def _record(self, agent_type: str, result: str):
+        RESPONSE_CACHE_REQUESTS.inc(agent_type=agent_type, result=result)
+        with self._lock:
+            self.stats['hits' if result == 'hit' else 'misses' if result == 'miss' else 'bypass'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['backend'] = 'redis' if self.redis is not None else 'memory'
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+# 全局回复缓存实例
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """获取全局回复缓存（懒加载；RESPONSE_CACHE_ENABLED 不为1时返回None）"""
+    global _response_cache
+    if os.getenv("RESPONSE_CACHE_ENABLED", "0") != "1":
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    ttl=int(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+                    history_window=int(os.getenv("RESPONSE_CACHE_HISTORY_WINDOW", "2")),
+                    replay_cps=float(os.getenv("RESPONSE_CACHE_REPLAY_CPS", "300")),
+                    version=os.getenv("RESPONSE_CACHE_VERSION", "1"),
+                )
+    return _response_cache
@@ -0,0 +1,127 @@
+"""
+会话对象缓存模块
+本进程内可随时重建的会话对象（智能体会话、导游智能体）的有界缓存：
+- LRU：条目数超过上限时淘汰最久未访问的会话
+- 空闲TTL：超过 idle_ttl 秒未访问的会话在下次访问缓存时淘汰
+- 按用户的二级索引：登出/清空历史时 O(该用户会话数) 丢弃，不再扫描全部键
+
+会话数据本身在Redis中，缓存的只是很小的会话对象，条目数上限即可约束内存；被淘汰的会话下次访问时按需重建。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Set
+
+import metrics
+
+SESSION_CACHE_REQUESTS = metrics.registry.counter(
+    'agent_session_cache_requests_total', '会话缓存查询次数', ('cache', 'result'))
+SESSION_CACHE_EVICTIONS = metrics.registry.counter(
+    'agent_session_cache_evictions_total', '会话缓存淘汰次数', ('cache', 'reason'))
+SESSION_CACHE_ENTRIES = metrics.registry.gauge(
+    'agent_session_cache_entries', '会话缓存中的条目数', ('cache',))
+
+
+class _Entry:
+    __slots__ = ('value', 'user', 'last_access')
+
+    def __init__(self, value: Any, user: str):
+        self.value = value
+        self.user = user
+        self.last_access = time.monotonic()
+
+
+class SessionCache:
+    """线程安全的 LRU + 空闲TTL 会话缓存"""
+
+    def __init__(self, name: str, max_entries: int = 1000, idle_ttl: float = 1800.0):
+        self.name = name
+        self.max_entries = max(1, max_entries)
+        self.idle_ttl = idle_ttl
+
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._by_user: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {'lru': 0, 'ttl': 0, 'invalidated': 0}
+
+    def get_or_create(self, key: Hashable, user: str, factory: Callable[[], Any]) -> Any:
+        """返回缓存的会话对象；不存在时调用 factory 创建并登记"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_access = time.monotonic()
+                self._entries.move_to_end(key)
+                self.hits += 1
+                SESSION_CACHE_REQUESTS.inc(cache=self.name, result='hit')
+                return entry.value
+
+            self.misses += 1
+            SESSION_CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            value = factory()
+            entry = _Entry(value, user)
+            self._entries[key] = entry
+            self._by_user.setdefault(user, set()).add(key)
+            self._shrink()
+            SESSION_CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop_user(self, user: str) -> int:
+        """丢弃该用户的全部会话，返回丢弃的数量"""
+        with self._lock:
+            keys = self._by_user.pop(user, set())
+            for key in keys:
+                del self._entries[key]
+            self._count_eviction('invalidated', len(keys))
+            SESSION_CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+            return len(keys)
+
+    def _remove_oldest(self, reason: str):
+        key, entry = self._entries.popitem(last=False)
+        keys = self._by_user.get(entry.user)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry.user]
+        self._count_eviction(reason, 1)
+
+    def _expire(self):
+        # 条目按最近访问时间排列，过期的都在队首
+        deadline = time.monotonic() - self.idle_ttl
+        while self._entries and next(iter(self._entries.values())).last_access < deadline:
+            self._remove_oldest('ttl')
+
+    def _shrink(self):
+        while len(self._entries) > self.max_entries:
+            self._remove_oldest('lru')
+
+    def _count_eviction(self, reason: str, count: int):
+        if count:
+            self.evictions[reason] += count
+            SESSION_CACHE_EVICTIONS.inc(count, cache=self.name, reason=reason)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            requests = self.hits + self.misses
+            SESSION_CACHE_ENTRIES.set(len(self._entries), cache=self.name)
+            return {
+                'entries': len(self._entries),
+                'users': len(self._by_user),
+                'max_entries': self.max_entries,
+                'idle_ttl': self.idle_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'evictions': dict(self.evictions),
+            }
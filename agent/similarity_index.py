@@ -0,0 +1,496 @@
+"""
+相似问题索引模块
+精确匹配的回复缓存命中不了换种说法的问题（如"杭州两日游怎么玩"和"杭州玩两天攻略"）。
+本模块在进程内对 messages 表中过往的（问题, 回答）建立相似度索引，完全离线运行：
+
+- 规范化：全角转半角、去标点，中文数字转阿拉伯数字（"两日" → "2天"），去掉"攻略/怎么玩/推荐"等不影响语义的词
+- 向量：规范化问题的字符 1-gram + 2-gram，TF-IDF 加权，余弦相似度
+- 近似最近邻：MinHash 签名 + LSH 分桶召回候选，只对候选计算余弦相似度
+- 问题中的数字（天数、人数等）和已知地名必须一致，"杭州2天"不会匹配到"杭州3天"，"杭州2天"也不会匹配到"苏州2天"
+- 只索引对话的第一个问题：后续轮次的回答依赖之前的对话，换一个对话直接回放没有意义
+- 索引记录生成回答时的提示词版本（系统提示词和模型的哈希，与回复缓存键相同），版本变化后清空索引，只索引之后的新对话
+
+高相似度（>= SIMILARITY_SERVE_THRESHOLD）且当前对话没有历史和摘要时直接回放历史回答；
+中等相似度（>= SIMILARITY_SEED_THRESHOLD）时把历史回答作为参考放进提示词，仍由LLM针对当前问题生成。
+
+索引按 messages 表的自增ID增量追加新的对话轮，按 deleted_conversations 墓碑移除已删除的对话；
+签名持久化到磁盘，重启时直接加载后只从数据库同步之后的新消息；索引有变化时整体重写文件（不是追加）。
+
+配置（环境变量）:
+    SIMILARITY_INDEX_ENABLED        是否启用（默认0）
+    SIMILARITY_INDEX_PATH           索引文件路径（默认 similarity_index.json）
+    SIMILARITY_SERVE_THRESHOLD      直接使用历史回答的相似度阈值（默认0.9）
+    SIMILARITY_SEED_THRESHOLD       把历史回答作为参考的相似度阈值（默认0.75）
+    SIMILARITY_MAX_DOCS             最多索引的问题数，超出时移除最早的（默认50000）
+    SIMILARITY_REFRESH_INTERVAL     从数据库追加新对话的间隔（秒，默认10）
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import metrics
+
+try:
+    from .response_cache import normalize_message, is_context_dependent
+    from .text_utils import cn_to_int
+    from .trip_context import find_places
+except ImportError:
+    from agent.response_cache import normalize_message, is_context_dependent
+    from agent.text_utils import cn_to_int
+    from agent.trip_context import find_places
+
+SIMILARITY_LOOKUPS = metrics.registry.counter(
+    'similarity_index_lookups_total', '相似问题索引查询次数（serve 直接回放，seed 作为参考）', ('agent_type', 'result'))
+SIMILARITY_LOOKUP_SECONDS = metrics.registry.histogram(
+    'similarity_index_lookup_seconds', '相似问题索引单次查询耗时', (), metrics.FAST_LATENCY_BUCKETS)
+SIMILARITY_DOCUMENTS = metrics.registry.gauge(
+    'similarity_index_documents', '相似问题索引中的问题数')
+
+INDEX_FORMAT_VERSION = 2
+INDEXED_AGENT_TYPES = ('general', 'travel')
+# 出错时保存的回复、PDF生成结果不进入索引
+SKIPPED_ANSWER_PREFIXES = ('抱歉，处理您的请求时出现了问题', '📄')
+
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MAX_CANDIDATES = 100
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+_CN_NUMBER = re.compile(r'([零一二两三四五六七八九十]+)(?=[天日晚夜周个人位岁月星])')
+_DAY = re.compile(r'(\d+)日')
+# 不影响问题语义的词（长词在前，先匹配）
+_FILLERS = re.compile('|'.join(sorted([
+    '请问', '请', '帮我', '帮忙', '一下', '怎么玩', '怎么样', '怎么', '如何', '攻略', '推荐', '介绍',
+    '有哪些', '有什么', '哪些', '什么', '吗', '呢', '吧', '的', '旅游', '旅行', '游玩', '行程', '安排', '规划', '玩', '游',
+], key=len, reverse=True)))
+_NUMBERS = re.compile(r'\d+')
+
+
+def canonicalize(question: str) -> str:
+    """把问题规范化成比较用的形式，如"杭州两日游怎么玩" → "杭州2天" """
+    text = normalize_message(question)
+    text = _CN_NUMBER.sub(lambda m: str(cn_to_int(m.group(1))), text)
+    text = _DAY.sub(r'\1天', text)
+    stripped = _FILLERS.sub('', text)
+    return stripped or text
+
+
+def question_places(question: str) -> Tuple[str, ...]:
+    """问题中提到的已知地名（去重排序，用于要求地名一致）"""
+    return tuple(sorted(set(find_places(normalize_message(question)))))
+
+
+def extract_terms(canonical: str) -> Dict[str, int]:
+    """字符 1-gram 和 2-gram 的词频"""
+    terms = Counter(canonical)
+    terms.update(canonical[i:i + 2] for i in range(len(canonical) - 1))
+    return dict(terms)
+
+
+def _stable_hash(term: str) -> int:
+    # 内置 hash() 每个进程随机加盐，持久化的签名必须用稳定的哈希
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def minhash(terms) -> List[int]:
+    """MinHash 签名"""
+    hashes = [_stable_hash(term) for term in terms]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def _band_keys(signature: List[int]) -> List[int]:
+    return [hash(tuple(signature[i * ROWS:(i + 1) * ROWS])) for i in range(BANDS)]
+
+
+@dataclass
+class SimilarMatch:
+    """一次相似问题查询的结果"""
+    score: float
+    question: str
+    answer: str
+    doc_id: int
+
+
+class _Doc:
+    __slots__ = ('doc_id', 'conversation_id', 'agent_type', 'question', 'answer', 'canonical', 'numbers',
+                 'places', 'terms', 'signature', 'bands')
+
+    def __init__(self, doc_id: int, conversation_id: str, agent_type: str, question: str, answer: str,
+                 signature: Optional[List[int]] = None):
+        self.doc_id = doc_id
+        self.conversation_id = conversation_id
+        self.agent_type = agent_type
+        self.question = question
+        self.answer = answer
+        self.canonical = canonicalize(question)
+        self.numbers = tuple(sorted(_NUMBERS.findall(self.canonical)))
+        self.places = question_places(question)
+        self.terms = extract_terms(self.canonical)
+        self.signature = signature or minhash(self.terms)
+        self.bands = _band_keys(self.signature)
+
+
+class SimilarityIndex:
+    """过往（问题, 回答）的进程内相似度索引"""
+
+    def __init__(self, path: Optional[str] = None, serve_threshold: float = 0.9, seed_threshold: float = 0.75,
+                 max_docs: int = 50000, refresh_interval: float = 10.0, max_answer_chars: int = 8000,
+                 database=None):
+        self.path = path
+        self.serve_threshold = serve_threshold
+        self.seed_threshold = seed_threshold
+        self.max_docs = max(1, max_docs)
+        self.refresh_interval = refresh_interval
+        self.max_answer_chars = max_answer_chars
+        self._database = database
+
+        # docs 按插入顺序排列，超出上限时移除最早的
+        self.docs: Dict[int, _Doc] = {}
+        self.df: Counter = Counter()
+        self.buckets: List[Dict[int, Set[int]]] = [{} for _ in range(BANDS)]
+        self.by_question: Dict[Tuple[str, str], int] = {}
+        self.by_conversation: Dict[str, Set[int]] = {}
+        self.last_message_id = 0
+        self.last_deletion_at = ''
+        # 索引中的回答是用哪个提示词版本生成的（空串为未知：从数据库首次建立的索引视为当前版本）
+        self.prompt_version = ''
+
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self.stats = {"lookups": 0, "served": 0, "seeded": 0, "misses": 0, "refreshes": 0,
+                      "added": 0, "removed": 0, "last_refresh_ms": 0.0}
+        if path:
+            self.load()
+
+    @property
+    def database(self):
+        if self._database is None:
+            from database_self import db
+            self._database = db
+        return self._database
+
+    # ---------------- 增删 ----------------
+    def add(self, doc_id: int, conversation_id: str, agent_type: str, question: str, answer: str,
+            signature: Optional[List[int]] = None) -> bool:
+        """索引一轮对话；同一规范化问题只保留最新的回答"""
+        if agent_type not in INDEXED_AGENT_TYPES or is_context_dependent(question):
+            return False
+        if not answer.strip() or len(answer) > self.max_answer_chars or answer.startswith(SKIPPED_ANSWER_PREFIXES):
+            return False
+        doc = _Doc(doc_id, conversation_id, agent_type, question, answer, signature)
+        if not doc.terms:
+            return False
+        with self._lock:
+            previous = self.by_question.get((agent_type, doc.canonical))
+            if previous is not None:
+                self._remove(previous)
+            self.docs[doc_id] = doc
+            self.df.update(doc.terms.keys())
+            for band, key in enumerate(doc.bands):
+                self.buckets[band].setdefault(key, set()).add(doc_id)
+            self.by_question[(agent_type, doc.canonical)] = doc_id
+            self.by_conversation.setdefault(conversation_id, set()).add(doc_id)
+            while len(self.docs) > self.max_docs:
+                self._remove(next(iter(self.docs)))
+            self.stats["added"] += 1
+        return True
+
+    def _remove(self, doc_id: int):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.df.subtract(doc.terms.keys())
+        for term in doc.terms:
+            if self.df[term] <= 0:
+                del self.df[term]
+        for band, key in enumerate(doc.bands):
+            bucket = self.buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(doc_id)
+                if not bucket:
+                    del self.buckets[band][key]
+        if self.by_question.get((doc.agent_type, doc.canonical)) == doc_id:
+            del self.by_question[(doc.agent_type, doc.canonical)]
+        conversation_docs = self.by_conversation.get(doc.conversation_id)
+        if conversation_docs is not None:
+            conversation_docs.discard(doc_id)
+            if not conversation_docs:
+                del self.by_conversation[doc.conversation_id]
+        self.stats["removed"] += 1
+
+    def _clear(self):
+        self.docs.clear()
+        self.df.clear()
+        self.buckets = [{} for _ in range(BANDS)]
+        self.by_question.clear()
+        self.by_conversation.clear()
+
+    def use_prompt_version(self, prompt_version: str):
+        """提示词或模型变化后之前的回答不再适用：清空索引，只索引之后的新对话（不回头读取旧消息）"""
+        with self._lock:
+            if prompt_version == self.prompt_version:
+                return
+            cleared = bool(self.prompt_version and self.docs)
+            if cleared:
+                print(f"提示词版本变化（{self.prompt_version} -> {prompt_version}），清空相似问题索引")
+                self.stats["removed"] += len(self.docs)
+                self._clear()
+            self.prompt_version = prompt_version
+        SIMILARITY_DOCUMENTS.set(len(self.docs))
+        if self.path:
+            self.save()
+
+    def remove_conversations(self, conversation_ids) -> int:
+        """移除已删除对话中的问题"""
+        removed = 0
+        with self._lock:
+            for conversation_id in conversation_ids:
+                for doc_id in list(self.by_conversation.get(conversation_id, ())):
+                    self._remove(doc_id)
+                    removed += 1
+        return removed
+
+    # ---------------- 查询 ----------------
+    def _idf(self, term: str, total: int) -> float:
+        return math.log((total + 1) / (self.df.get(term, 0) + 1)) + 1.0
+
+    def _weights(self, terms: Dict[str, int], total: int) -> Dict[str, float]:
+        return {term: (1.0 + math.log(count)) * self._idf(term, total) for term, count in terms.items()}
+
+    def search(self, question: str, agent_type: str) -> Optional[SimilarMatch]:
+        """返回同一智能体类型下数字和地名都一致的最相似历史问题（没有候选时返回None）"""
+        canonical = canonicalize(question)
+        terms = extract_terms(canonical)
+        if not terms:
+            return None
+        numbers = tuple(sorted(_NUMBERS.findall(canonical)))
+        places = question_places(question)
+        bands = _band_keys(minhash(terms))
+
+        with self._lock:
+            exact = self.by_question.get((agent_type, canonical))
+            if exact is not None:
+                doc = self.docs[exact]
+                return SimilarMatch(1.0, doc.question, doc.answer, doc.doc_id)
+
+            # LSH召回：按碰撞的分桶数排序，只对前 MAX_CANDIDATES 个候选计算相似度
+            collisions: Counter = Counter()
+            for band, key in enumerate(bands):
+                collisions.update(self.buckets[band].get(key, ()))
+            total = len(self.docs)
+            query = self._weights(terms, total)
+            query_norm = math.sqrt(sum(w * w for w in query.values()))
+            best = None
+            for doc_id, _ in collisions.most_common(MAX_CANDIDATES):
+                doc = self.docs[doc_id]
+                if doc.agent_type != agent_type or doc.numbers != numbers or doc.places != places:
+                    continue
+                weights = self._weights(doc.terms, total)
+                dot = sum(w * weights[t] for t, w in query.items() if t in weights)
+                norm = math.sqrt(sum(w * w for w in weights.values()))
+                score = dot / (query_norm * norm) if dot else 0.0
+                if best is None or score > best.score:
+                    best = SimilarMatch(round(score, 4), doc.question, doc.answer, doc.doc_id)
+            return best
+
+    def lookup(self, question: str, agent_type: str, prompt_version: str,
+               allow_serve: bool = True) -> Tuple[str, Optional[SimilarMatch]]:
+        """
+        查询并按阈值分类
+
+        Args:
+            question: 用户消息
+            agent_type: 智能体类型（general / travel）
+            prompt_version: 提示词版本（系统提示词和模型的哈希，与回复缓存键相同）
+            allow_serve: 是否允许直接回放（当前对话有历史或摘要时为False，最多作为参考）
+
+        Returns:
+            (result, match): result 为 serve（直接使用历史回答）/ seed（作为参考）/ miss
+        """
+        self.use_prompt_version(prompt_version)
+        self.maybe_refresh()
+        with SIMILARITY_LOOKUP_SECONDS.time():
+            match = self.search(question, agent_type)
+        if match is not None and match.score >= self.serve_threshold and allow_serve:
+            result = 'serve'
+        elif match is not None and match.score >= self.seed_threshold:
+            result = 'seed'
+        else:
+            result, match = 'miss', None
+        SIMILARITY_LOOKUPS.inc(agent_type=agent_type, result=result)
+        with self._lock:
+            self.stats["lookups"] += 1
+            self.stats[{'serve': 'served', 'seed': 'seeded', 'miss': 'misses'}[result]] += 1
+        return result, match
+
+    # ---------------- 与数据库同步 ----------------
+    def maybe_refresh(self):
+        """距上次同步超过 refresh_interval 秒时，在后台线程中追加新对话（不阻塞查询）"""
+        if time.monotonic() - self._last_refresh < self.refresh_interval or self._refresh_lock.locked():
+            return
+        self._last_refresh = time.monotonic()
+        threading.Thread(target=self._refresh_quietly, name="similarity-refresh", daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"同步相似问题索引失败: {e}")
+            metrics.ERRORS.inc(component='similarity_index', operation='refresh')
+
+    def refresh(self, batch_size: int = 5000) -> int:
+        """
+        从 messages 表追加上次同步之后的对话轮（只取每个对话的第一轮），并移除已删除对话中的问题；有变化时保存索引文件
+
+        Returns:
+            int: 新增的问题数
+        """
+        with self._refresh_lock:
+            started = time.perf_counter()
+            self._last_refresh = time.monotonic()
+            added = removed = 0
+            conn = self.database.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id, deleted_at FROM deleted_conversations WHERE deleted_at >= ? ORDER BY deleted_at',
+                               (self.last_deletion_at,))
+                rows = cursor.fetchall()
+                if rows:
+                    removed = self.remove_conversations(row['id'] for row in rows)
+                    self.last_deletion_at = rows[-1]['deleted_at']
+
+                # 同一轮对话的用户消息和回复是连续插入的，按ID顺序配对
+                pending_user = None
+                while True:
+                    cursor.execute('''
+                        SELECT m.id, m.conversation_id, m.text, m.is_user, m.agent_type,
+                               (SELECT MIN(f.id) FROM messages f WHERE f.conversation_id = m.conversation_id) AS first_id
+                        FROM messages m WHERE m.id > ? ORDER BY m.id LIMIT ?
+                    ''', (self.last_message_id, batch_size))
+                    rows = cursor.fetchall()
+                    for row in rows:
+                        if row['is_user']:
+                            # 只有对话的第一个问题进入索引
+                            pending_user = row if row['id'] == row['first_id'] else None
+                        elif pending_user is not None and pending_user['conversation_id'] == row['conversation_id']:
+                            if self.add(pending_user['id'], row['conversation_id'], row['agent_type'] or 'general',
+                                        pending_user['text'], row['text']):
+                                added += 1
+                            pending_user = None
+                        self.last_message_id = row['id']
+                    if len(rows) < batch_size:
+                        break
+                # 回复尚未写入的用户消息下次重新读取
+                if pending_user is not None:
+                    self.last_message_id = pending_user['id'] - 1
+            finally:
+                conn.close()
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stats["refreshes"] += 1
+                self.stats["last_refresh_ms"] = round(elapsed_ms, 2)
+            SIMILARITY_DOCUMENTS.set(len(self.docs))
+            if (added or removed) and self.path:
+                self.save()
+            return added
+
+    # ---------------- 持久化 ----------------
+    def save(self):
+        """
+        把整个索引重写到磁盘：先写同目录下本进程独占的临时文件再原子替换，
+        进程中途退出或多个工作进程同时保存都不会留下损坏的文件
+        """
+        with self._lock:
+            data = {
+                'version': INDEX_FORMAT_VERSION,
+                'num_perm': NUM_PERM,
+                'last_message_id': self.last_message_id,
+                'last_deletion_at': self.last_deletion_at,
+                'prompt_version': self.prompt_version,
+                'docs': [[d.doc_id, d.conversation_id, d.agent_type, d.question, d.answer, d.signature]
+                         for d in self.docs.values()],
+            }
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(self.path)}.",
+                                        suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self) -> bool:
+        """从磁盘加载索引（复用保存的MinHash签名）；文件不存在或格式不符时从头同步"""
+        if not os.path.exists(self.path):
+            return False
+        started = time.perf_counter()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_FORMAT_VERSION or data.get('num_perm') != NUM_PERM:
+                print("相似问题索引文件版本不符，将从数据库重建")
+                return False
+            for doc_id, conversation_id, agent_type, question, answer, signature in data['docs']:
+                self.add(doc_id, conversation_id, agent_type, question, answer, signature)
+            self.last_message_id = data['last_message_id']
+            self.last_deletion_at = data['last_deletion_at']
+            self.prompt_version = data.get('prompt_version', '')
+        except Exception as e:
+            print(f"加载相似问题索引失败，将从数据库重建: {e}")
+            metrics.ERRORS.inc(component='similarity_index', operation='load')
+            with self._lock:
+                self._clear()
+            self.last_message_id, self.last_deletion_at = 0, ''
+            return False
+        SIMILARITY_DOCUMENTS.set(len(self.docs))
+        print(f"相似问题索引已加载: {len(self.docs)} 个问题，耗时 {int((time.perf_counter() - started) * 1000)}ms")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["documents"] = len(self.docs)
+            stats["terms"] = len(self.df)
+        stats["last_message_id"] = self.last_message_id
+        stats["prompt_version"] = self.prompt_version
+        stats["serve_threshold"] = self.serve_threshold
+        stats["seed_threshold"] = self.seed_threshold
+        return stats
+
+
+# 全局相似问题索引实例
+_similarity_index: Optional[SimilarityIndex] = None
+_similarity_index_lock = threading.Lock()
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """获取全局相似问题索引（懒加载；SIMILARITY_INDEX_ENABLED 不为1时返回None）"""
+    global _similarity_index
+    if os.getenv("SIMILARITY_INDEX_ENABLED", "0") != "1":
+        return None
+    if _similarity_index is None:
+        with _similarity_index_lock:
+            if _similarity_index is None:
+                _similarity_index = SimilarityIndex(
+                    path=os.getenv("SIMILARITY_INDEX_PATH", "similarity_index.json"),
+                    serve_threshold=float(os.getenv("SIMILARITY_SERVE_THRESHOLD", "0.9")),
+                    seed_threshold=float(os.getenv("SIMILARITY_SEED_THRESHOLD", "0.75")),
+                    max_docs=int(os.getenv("SIMILARITY_MAX_DOCS", "50000")),
+                    refresh_interval=float(os.getenv("SIMILARITY_REFRESH_INTERVAL", "10")),
+                )
+    return _similarity_index
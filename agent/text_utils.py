@@ -0,0 +1,14 @@
+"""
+中文文本的小工具
+相似问题索引、旅行参数提取等模块共用，不依赖指标注册等其他模块，可以随处导入。
+"""
+
+CN_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+
+def cn_to_int(text: str) -> int:
+    """把"十二"、"两"这类中文数字转成整数"""
+    if '十' not in text:
+        return int(''.join(str(CN_DIGITS[c]) for c in text))
+    tens, _, ones = text.partition('十')
+    return (CN_DIGITS.get(tens, 1) if tens else 1) * 10 + (CN_DIGITS.get(ones, 0) if ones else 0)
@@ -0,0 +1,431 @@
+"""
+旅行参数与信息收集复用模块
+is_travel_planning_request 会匹配"计划"、"酒店"这类常见词，同一段旅行对话的追问（"把第二天换成室内活动"）
+几乎每一轮都会重新跑一遍信息收集（ReAct + 多次搜索API调用）。
+
+本模块从表单或自由文本中提取旅行参数（出发地、目的地、日期、天数、人数、预算、表单偏好），
+与信息收集结果一起保存在会话状态（agent_state:<会话>）中，下一轮按参数决定：
+
+- reuse:   参数没有变化、也没有问到未收集过的内容，直接沿用上次的信息，不调用工具
+- extend:  目的地不变，只有部分参数变化或问到了未收集的内容（如新问酒店），只补充查询受影响的部分
+- collect: 第一次规划、换了目的地、明确要求重新查询或信息已累积过长时，完整收集
+
+配置（环境变量）:
+    COLLECTOR_REUSE_ENABLED     是否复用同一对话的信息收集结果（默认1）
+    COLLECTOR_REUSE_MAX_CHARS   复用的信息最长字符数，超出后下一轮重新完整收集（默认16000）
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+try:
+    from .prefetch import CITY_AIRPORTS
+    from .text_utils import cn_to_int
+except ImportError:
+    from agent.prefetch import CITY_AIRPORTS
+    from agent.text_utils import cn_to_int
+
+REUSE, EXTEND, COLLECT = 'reuse', 'extend', 'collect'
+
+COLLECTOR_REUSE = metrics.registry.counter(
+    'collector_reuse_total', '旅行规划信息收集的复用决策（reuse 为跳过收集）', ('decision', 'source'))
+
+# 信息类别（与 prefetch.PrefetchCall.topic 一致）
+TOPIC_NAMES = {'flights': '航班', 'hotels': '酒店住宿', 'attractions': '景点', 'restaurants': '餐厅美食'}
+# 消息中问到、收集结果中已包含某类信息的关键词
+TOPIC_KEYWORDS = {
+    'flights': ('机票', '航班', '飞机', 'flight'),
+    'hotels': ('酒店', '住宿', '民宿', 'hotel'),
+    'attractions': ('景点', '景区', '博物馆', 'attraction'),
+    'restaurants': ('餐厅', '美食', '小吃', 'restaurant'),
+}
+# 参数变化后需要重新查询的信息类别（目的地变化总是完整收集）
+FIELD_TOPICS = {
+    'origin': ('flights',),
+    'start_date': ('flights', 'hotels'),
+    'end_date': ('flights', 'hotels'),
+    'days': ('flights', 'hotels'),
+    'travelers': ('flights', 'hotels'),
+    'budget': ('hotels',),
+    'accommodation_type': ('hotels',),
+    'preferences': ('attractions',),
+    'dietary_restrictions': ('restaurants',),
+    'transportation_mode': ('flights',),
+}
+REFRESH_KEYWORDS = ('重新查', '重新搜', '重新收集', '最新', '刷新')
+FORM_EXTRA_FIELDS = ('accommodation_type', 'preferences', 'dietary_restrictions', 'transportation_mode')
+# 自由文本中影响搜索内容的偏好词，按表单字段归类放进 extras
+TEXT_PREFERENCES = {
+    'accommodation_type': ('民宿', '青旅', '经济型', '快捷酒店', '商务酒店', '度假村', '五星', '四星', '豪华'),
+    'preferences': ('亲子', '带娃', '老人', '蜜月', '情侣', '徒步', '购物', '自然风光', '历史文化', '夜景', '海边',
+                    '温泉', '滑雪', '摄影', '网红'),
+    'dietary_restrictions': ('素食', '吃素', '清真', '不吃辣', '不能吃辣', '过敏'),
+    'transportation_mode': ('高铁', '火车', '自驾', '大巴'),
+}
+# 旅行规划请求里不影响搜索内容的套话（长词在前，先匹配）
+_REQUEST_FILLERS = re.compile('|'.join(sorted([
+    '帮我', '帮忙', '麻烦', '给我', '请', '规划', '计划', '安排', '制定', '做', '一下', '一个', '一份', '详细', '行程', '攻略',
+    '旅游', '旅行', '自由行', '出游', '度假', '出发', '从', '去', '到', '前往', '飞往', '回来', '返回', '玩', '游', '的', '和',
+    '与', '以及', '还有', '我们', '我', '想', '要', '打算', '准备', '一起', '共', '一共', '总共', '人均', '每人', '预算',
+    '左右', '大概', '以内', '元', '块', '吧', '呢', '啊', '吗', '谢谢', '推荐', '介绍', '查询', '查', '搜索', '看看', '需要',
+    '包括', '信息', '住', '吃', '坐', '带', '都', '什么', '哪些', '有', '好', '天', '日', '号', '人',
+], key=len, reverse=True)))
+_LEFTOVER = re.compile(r'[\W\d_]+')
+
+# 省级行政区和没有机场代码的热门目的地，与 CITY_AIRPORTS 一起构成已知地名
+PROVINCES = (
+    '河北', '山西', '辽宁', '吉林', '黑龙江', '江苏', '浙江', '安徽', '福建', '江西', '山东', '河南', '湖北', '湖南',
+    '广东', '海南', '四川', '贵州', '云南', '陕西', '甘肃', '青海', '台湾', '内蒙古', '广西', '西藏', '宁夏', '新疆',
+)
+POPULAR_PLACES = (
+    '苏州', '扬州', '绍兴', '嘉兴', '湖州', '舟山', '千岛湖', '乌镇', '婺源', '黄山', '泰山', '华山', '峨眉山', '武夷山',
+    '九寨沟', '稻城', '大理', '香格里拉', '阳朔', '凤凰', '敦煌', '洛阳', '开封', '平遥', '大同', '北海', '威海', '烟台',
+    '秦皇岛', '北戴河', '喀什', '伊犁', '长白山', '延边', '呼伦贝尔', '林芝', '日本', '韩国', '泰国', '越南', '欧洲',
+)
+KNOWN_PLACES = frozenset((*CITY_AIRPORTS, *PROVINCES, *POPULAR_PLACES))
+# 带行政区划后缀的也视为地名（"苏州市"、"阿坝州"）
+_PLACE_SUFFIX = re.compile(r'(?:省|市|县|州|自治区|特别行政区)$')
+_KNOWN_PLACE = re.compile('|'.join(sorted(KNOWN_PLACES, key=len, reverse=True)))
+
+_CN_NUM = '零一二两三四五六七八九十'
+_PLACE = r'[一-龥]{2,5}?'
+# 明确表示出行的说法：后面跟着这些词时，不在已知地名中的也当作目的地（"去西湖旅游"）
+_TRIP_MARKER = rf'旅游|旅行|度假|出差|自由行|之旅|[\d{_CN_NUM}]+(?:天|日游|日)'
+_ORIGIN = re.compile(rf'从\s*({_PLACE})\s*(?:出发|去|到|飞|前往|坐)')
+_DESTINATION = re.compile(
+    rf'(?<![回过上下出进来])(?:去|到|飞往|前往)\s*({_PLACE})'
+    rf'(?=({_TRIP_MARKER})|玩|游|看看|转转|逛|吧|呢|啊|的|了|[,，。!！?？\s]|$)')
+_LEADING_DESTINATION = re.compile(rf'^({_PLACE})(?=({_TRIP_MARKER})|攻略)')
+_EXPLICIT_DESTINATION = re.compile(
+    rf'目的地\s*(?:改成|换成|改为|换到|是|为)\s*({_PLACE})(?=[,，。!！?？\s吧呢啊了]|$)')
+# 含这些字的多半不是地名（"把第二天…"、"再想想"）
+_NOT_PLACE = re.compile(r'[把换改第再想这那个些什么哪吗们我你他她它天]')
+_DATE = re.compile(r'(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})')
+_MONTH_DAY = re.compile(r'(?<![\d-])(\d{1,2})月(\d{1,2})[日号]')
+_DAYS = re.compile(rf'(?<![第\d{_CN_NUM}])([\d{_CN_NUM}]+)\s*(?:天|日游|日)')
+_TRAVELERS = re.compile(rf'([\d{_CN_NUM}]+)\s*(?:个人|人|位|口人)')
+_BUDGET = re.compile(r'预算[^\d]{0,6}(\d+(?:\.\d+)?)\s*(万|千|k|K)?')
+_BUDGET_UNITS = {'万': 10000, '千': 1000, 'k': 1000, 'K': 1000}
+# 预算档位的上限（元），跨用户缓存按档位而不是具体金额区分
+BUDGET_BANDS = (1000, 3000, 6000, 10000, 20000, 50000)
+
+
+def _to_int(text: str) -> int:
+    try:
+        return int(text) if text.isdigit() else cn_to_int(text)
+    except (KeyError, ValueError):
+        return 0
+
+
+def _normalize_place(text: str) -> str:
+    return str(text or '').strip().casefold()
+
+
+def is_known_place(place: str) -> bool:
+    """是否为已知地名（城市、省份、热门目的地，或带行政区划后缀）"""
+    return place in KNOWN_PLACES or bool(_PLACE_SUFFIX.search(place))
+
+
+def find_places(text: str) -> List[str]:
+    """按出现顺序返回文本中的已知地名（长名优先，"北京都"只取"北京"）"""
+    return [_normalize_place(match.group(0)) for match in _KNOWN_PLACE.finditer(text or '')]
+
+
+def asked_topics(message: str) -> Tuple[str, ...]:
+    """消息中问到的信息类别（按 TOPIC_NAMES 的顺序）"""
+    lowered = (message or '').lower()
+    return tuple(topic for topic, keywords in TOPIC_KEYWORDS.items() if any(word in lowered for word in keywords))
+
+
+def text_preferences(message: str) -> Dict[str, List[str]]:
+    """自由文本中提到的住宿、旅行、饮食、交通偏好"""
+    found = {name: sorted({word for word in words if word in message}) for name, words in TEXT_PREFERENCES.items()}
+    return {name: words for name, words in found.items() if words}
+
+
+def unparsed_text(message: str) -> str:
+    """去掉能识别的参数、偏好、信息类别和套话之后剩下的内容；不为空说明消息里还有参数没有覆盖的要求"""
+    params = TripParams.from_text(message)
+    text = message
+    for pattern in (_DATE, _MONTH_DAY, _BUDGET, _TRAVELERS, _DAYS, _KNOWN_PLACE):
+        text = pattern.sub(' ', text)
+    words = [params.origin, params.destination, *REFRESH_KEYWORDS,
+             *(word for keywords in TOPIC_KEYWORDS.values() for word in keywords),
+             *(word for words in TEXT_PREFERENCES.values() for word in words)]
+    for word in sorted(filter(None, words), key=len, reverse=True):
+        text = text.replace(word, ' ')
+    return _LEFTOVER.sub('', _REQUEST_FILLERS.sub(' ', text.lower()))
+
+
+def collector_cache_fields(message: str) -> Optional[Dict[str, Any]]:
+    """
+    信息收集智能体整份结果的跨用户缓存键字段；只有消息本身完整描述了要搜索的内容时才返回，否则返回None（不使用缓存）：
+    出发地、目的地和日期/天数都要有，并且除参数、偏好、问到的信息类别和套话外没有别的要求
+    """
+    params = TripParams.from_text(message)
+    if not (params.origin and params.destination and (params.start_date or params.days)):
+        return None
+    if unparsed_text(message):
+        return None
+    return params.cache_fields(asked_topics(message))
+
+
+def budget_band(budget: int) -> int:
+    """预算所在档位（0 为未提供）"""
+    if not budget:
+        return 0
+    return next((index + 1 for index, limit in enumerate(BUDGET_BANDS) if budget <= limit), len(BUDGET_BANDS) + 1)
+
+
+@dataclass
+class TripParams:
+    """一次旅行规划的关键参数（未提到的字段为空）"""
+    origin: str = ''
+    destination: str = ''
+    start_date: str = ''
+    end_date: str = ''
+    days: int = 0
+    travelers: int = 0
+    budget: int = 0
+    # 表单中影响搜索内容的其他字段（住宿偏好、旅行偏好等）
+    extras: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_form(cls, form_data: Dict[str, Any]) -> 'TripParams':
+        """由 /plan_travel 表单得到参数（预算为人均预算）"""
+        extras = {}
+        for name in FORM_EXTRA_FIELDS:
+            value = form_data.get(name)
+            if isinstance(value, list):
+                value = sorted(str(item).strip() for item in value if str(item).strip())
+            elif isinstance(value, str):
+                value = value.strip()
+            if value not in (None, '', []):
+                extras[name] = value
+        return cls(
+            origin=_normalize_place(form_data.get('source')),
+            destination=_normalize_place(form_data.get('destination')),
+            start_date=str(form_data.get('start_date') or '').strip(),
+            end_date=str(form_data.get('end_date') or '').strip(),
+            travelers=_to_int(str(form_data.get('travelers') or 0)),
+            budget=_to_int(str(form_data.get('budget_per_person') or 0)),
+            extras=extras,
+        )
+
+    @classmethod
+    def from_text(cls, message: str) -> 'TripParams':
+        """从自由文本中尽量提取参数（规则匹配，提取不到的字段留空，由上一轮的参数补齐）"""
+        params = cls()
+        text = message.strip()
+        origin = _ORIGIN.search(text)
+        if origin:
+            params.origin = _normalize_place(origin.group(1))
+        params.destination = cls._find_destination(text, params.origin)
+
+        full_dates = _DATE.findall(text)
+        dates = [f"{y}-{int(m):02d}-{int(d):02d}" for y, m, d in full_dates]
+        # "2025年5月1日到5月3日"：省略年份的日期沿用前一个日期的年份
+        year = f"{full_dates[0][0]}-" if full_dates else ''
+        dates += [f"{year}{int(m):02d}-{int(d):02d}" for m, d in _MONTH_DAY.findall(_DATE.sub(' ', text))]
+        if dates:
+            params.start_date = dates[0]
+            params.end_date = dates[1] if len(dates) > 1 else ''
+        days = _DAYS.search(_MONTH_DAY.sub(' ', _DATE.sub(' ', text)))
+        if days:
+            params.days = _to_int(days.group(1))
+        travelers = _TRAVELERS.search(text)
+        if travelers:
+            params.travelers = _to_int(travelers.group(1))
+        budget = _BUDGET.search(text)
+        if budget:
+            params.budget = int(float(budget.group(1)) * _BUDGET_UNITS.get(budget.group(2), 1))
+        params.extras = text_preferences(text)
+        return params
+
+    @staticmethod
+    def _find_destination(text: str, origin: str) -> str:
+        """
+        "去/到X"之类的句式优先，其次是出发地以外第一个出现的已知地名；提取不到时返回空串（沿用上一轮的目的地）
+
+        句式匹配到的X只有是已知地名，或带有明确的出行说法（"目的地改成X"、"去X旅游"、"X三日游"）时才算目的地，
+        行程内的追问（"第三天改成去西湖玩"、"中午去吃火锅吧"、"怎么去机场"）不会被当成换了目的地
+        """
+        for pattern in (_EXPLICIT_DESTINATION, _DESTINATION, _LEADING_DESTINATION):
+            for match in pattern.finditer(text):
+                place = _normalize_place(match.group(1))
+                if place == origin or _NOT_PLACE.search(place):
+                    continue
+                explicit = pattern is _EXPLICIT_DESTINATION or match.group(2)
+                if explicit or is_known_place(place):
+                    # "苏州市"和"苏州"是同一个目的地
+                    return place[:-1] if place.endswith('市') and place[:-1] in KNOWN_PLACES else place
+        return next((place for place in find_places(text) if place != origin), '')
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> Optional['TripParams']:
+        if not text:
+            return None
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        known = {f.name for f in fields(cls)}
+        return cls(**{name: value for name, value in data.items() if name in known})
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False, sort_keys=True)
+
+    def merged(self, newer: 'TripParams') -> 'TripParams':
+        """
+        用本轮提到的参数覆盖上一轮的参数；换了目的地时不沿用旧的日期、人数等
+        本轮没有确定的目的地（newer.destination 为空）时保留上一轮的全部参数，只覆盖提到的字段
+        """
+        if newer.destination and newer.destination != self.destination:
+            return newer
+        values = {}
+        for f in fields(self):
+            if f.name == 'extras':
+                values['extras'] = {**self.extras, **newer.extras}
+            else:
+                values[f.name] = getattr(newer, f.name) or getattr(self, f.name)
+        return TripParams(**values)
+
+    def changed_fields(self, other: 'TripParams') -> List[str]:
+        changed = [f.name for f in fields(self) if f.name != 'extras' and getattr(self, f.name) != getattr(other, f.name)]
+        changed += [name for name in sorted(set(self.extras) | set(other.extras))
+                    if self.extras.get(name) != other.extras.get(name)]
+        return changed
+
+    def cache_fields(self, topics: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """跨用户缓存键用的规范化参数：出发地、目的地、日期范围、人数、预算档位、偏好和问到的信息类别"""
+        return {'origin': self.origin, 'destination': self.destination, 'start_date': self.start_date,
+                'end_date': self.end_date, 'days': self.days, 'travelers': self.travelers,
+                'budget_band': budget_band(self.budget), 'extras': self.extras, 'topics': sorted(topics)}
+
+    def fingerprint(self) -> str:
+        """参数的紧凑指纹，参数相同即相同"""
+        return hashlib.sha1(self.to_json().encode('utf-8')).hexdigest()[:12]
+
+    def describe(self) -> str:
+        """给信息收集智能体看的参数说明"""
+        parts = []
+        if self.origin:
+            parts.append(f"出发地 {self.origin}")
+        if self.destination:
+            parts.append(f"目的地 {self.destination}")
+        if self.start_date:
+            parts.append(f"日期 {self.start_date}" + (f" 至 {self.end_date}" if self.end_date else ""))
+        if self.days:
+            parts.append(f"{self.days}天")
+        if self.travelers:
+            parts.append(f"{self.travelers}人")
+        if self.budget:
+            parts.append(f"预算 {self.budget} 元")
+        parts += [f"{name} {value}" for name, value in self.extras.items()]
+        return "，".join(parts)
+
+
+@dataclass
+class CollectionPlan:
+    """本轮信息收集的决策"""
+    action: str
+    params: TripParams
+    request: str = ''
+    topics: Tuple[str, ...] = ()
+    previous_info: str = ''
+    # 用户明确要求重新查询（不使用任何缓存）
+    refresh: bool = False
+
+    def combine(self, collected_info: str) -> str:
+        """合并本轮收集的信息：完整收集时直接替换，补充查询时追加到上次的信息后面"""
+        if self.action != EXTEND:
+            return collected_info
+        names = "、".join(TOPIC_NAMES[topic] for topic in self.topics)
+        return f"{self.previous_info}\n\n## 补充信息（{names}，与上文冲突时以此为准）\n\n{collected_info}"
+
+    def state(self, user_message: str, collected_info: str) -> Dict[str, str]:
+        """写回会话状态的字段"""
+        return {'collected_request': user_message, 'collected_info': collected_info,
+                'collected_params': self.params.to_json(), 'collected_fingerprint': self.params.fingerprint()}
+
+
+class CollectorReuse:
+    """按会话状态中保存的旅行参数决定本轮是复用、补充还是完整收集"""
+
+    def __init__(self, enabled: bool = True, max_chars: int = 16000):
+        self.enabled = enabled
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self.stats = {REUSE: 0, EXTEND: 0, COLLECT: 0}
+
+    def plan(self, state: Dict[str, str], message: str, form_data: Optional[Dict[str, Any]] = None) -> CollectionPlan:
+        """
+        Args:
+            state: 会话状态（AgentStateStore.get 的结果）
+            message: 本轮用户消息
+            form_data: /plan_travel 提交的表单
+        """
+        mentioned = TripParams.from_form(form_data) if form_data else TripParams.from_text(message)
+        previous = TripParams.from_json(state.get('collected_params'))
+        previous_info = state.get('collected_info', '')
+        params = previous.merged(mentioned) if previous else mentioned
+
+        plan = self._decide(previous, previous_info, params, message, asks_topics=not form_data)
+        with self._lock:
+            self.stats[plan.action] += 1
+        COLLECTOR_REUSE.inc(decision=plan.action, source='form' if form_data else 'chat')
+        return plan
+
+    def _decide(self, previous: Optional[TripParams], previous_info: str, params: TripParams,
+                message: str, asks_topics: bool = True) -> CollectionPlan:
+        refresh = any(word in message for word in REFRESH_KEYWORDS)
+        if (not self.enabled or previous is None or not previous_info or params.destination != previous.destination
+                or len(previous_info) >= self.max_chars or refresh):
+            return CollectionPlan(COLLECT, params, refresh=refresh)
+
+        topics = {topic for name in params.changed_fields(previous) for topic in FIELD_TOPICS.get(name, ())}
+        if asks_topics:
+            # 问到了上次没有收集到的内容（表单生成的请求总会提到住宿、景点等，只按字段变化判断）
+            info = previous_info.lower()
+            topics.update(topic for topic in asked_topics(message)
+                          if not any(word in info for word in TOPIC_KEYWORDS[topic]))
+        if not topics:
+            return CollectionPlan(REUSE, params, previous_info=previous_info)
+
+        ordered = tuple(topic for topic in TOPIC_NAMES if topic in topics)
+        names = "、".join(TOPIC_NAMES[topic] for topic in ordered)
+        request = (f"旅行参数：{params.describe()}\n只需搜索：{names}（其他信息已经收集过，不要重复搜索）\n"
+                   f"用户需求：{message}")
+        return CollectionPlan(EXTEND, params, request, ordered, previous_info)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        total = sum(stats.values())
+        stats['skip_rate'] = round(stats[REUSE] / total, 4) if total else 0.0
+        stats['enabled'] = self.enabled
+        return stats
+
+
+# 全局实例
+_collector_reuse: Optional[CollectorReuse] = None
+_collector_reuse_lock = threading.Lock()
+
+def get_collector_reuse() -> CollectorReuse:
+    """获取全局信息收集复用决策实例"""
+    global _collector_reuse
+    if _collector_reuse is None:
+        with _collector_reuse_lock:
+            if _collector_reuse is None:
+                _collector_reuse = CollectorReuse(
+                    enabled=os.getenv("COLLECTOR_REUSE_ENABLED", "1").lower() in ('1', 'true', 'yes'),
+                    max_chars=int(os.getenv("COLLECTOR_REUSE_MAX_CHARS", "16000")),
+                )
+    return _collector_reuse
@@ -1,21 +1,34 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response
-from agent.ai_agent import get_agent_service, clear_user_agent_sessions, get_agent_memory_stats
-from agent.attraction_guide import get_attraction_guide_response_stream, clear_tour_guide_agents
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, g
 from database_self import db
+from sse import SSEFramer, SSE_HEADERS, SSE_MIMETYPE
+from conversation_writer import get_conversation_writer
+from scheduler import get_scheduler, SchedulerFullError
+from stream_buffer import get_stream_buffer, parse_event_id
+from prewarm import get_prewarmer
+import metrics
+import multiprocessing
 import os
-import json
 from dotenv import load_dotenv
 import uuid
+import time
+import json
+import hashlib
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
+# 开启 PREWARM_ON_START 时在后台预热智能体服务（每个工作进程导入应用时执行一次）；
+# 以 python app.py 启动时PDF渲染子进程会重新导入本模块，子进程中不预热
+if multiprocessing.parent_process() is None:
+    get_prewarmer().start()
+
 # ------------------------ 用户功能函数 ------------------------
 def clear_user_agents(email):
     """清除用户的智能体会话和Redis记忆"""
+    from agent.ai_agent import clear_user_agent_sessions
     return clear_user_agent_sessions(email)
 
 def add_user(email, password):
@@ -27,12 +40,19 @@ def verify_user(email, password):
 def save_conversation(email, messages, conv_id):
     db.save_conversation(email, messages, conv_id)
 
+def enqueue_conversation(email, messages, conv_id):
+    """将一轮对话交给后台写回队列；队列已满时返回False"""
+    return get_conversation_writer().submit(email, messages, conv_id)
+
 def get_history(email):
+    # 先等待写回队列落库，保证能读到刚结束的对话
+    get_conversation_writer().flush()
     return db.get_history(email)
 
 def clear_user_history(email):
     """清理用户的所有数据：SQLite历史记录 + Redis智能体记忆"""
-    # 1. 清理SQLite数据库中的历史记录
+    # 1. 清理SQLite数据库中的历史记录（先落库队列中的数据，避免清理后又被写回）
+    get_conversation_writer().flush()
     success = db.clear_user_history(email)
     
     # 2. 清理Redis中的智能体记忆
@@ -46,26 +66,146 @@ def new_conversation(email):
     return True
 
 # ------------------------ 工具函数 ------------------------
-def stream_response(generator, user_message, email, conv_id, agent_type):
+sse_framer = SSEFramer()
+
+# 排队期间推送队列位置的间隔（秒）；心跳帧写入失败时响应被关闭，据此发现已断开的客户端
+QUEUE_HEARTBEAT_SECONDS = 2
+# 排队中的生成连续这么多秒没有任何响应在跟随时取消排队，留出凭 Last-Event-ID 重连的时间
+QUEUE_ABANDON_SECONDS = 10
+
+def busy_response(error):
+    """调度队列已满时的 429 响应"""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def wait_for_admission(reservation, generation):
+    """
+    等待调度准入：排队期间推送队列位置，准入后推送排队耗时
+    客户端已离开（generation 在本进程和其他进程都没有跟随者）时撤销排队，调用方据 reservation.admitted 判断是否继续
+    """
+    while not reservation.wait(QUEUE_HEARTBEAT_SECONDS):
+        if generation.abandoned(QUEUE_ABANDON_SECONDS) and not get_stream_buffer().followed_remotely(generation):
+            reservation.cancel()
+            yield sse_framer.event({'error': '客户端已断开，已取消排队'})
+            return
+        yield sse_framer.event({'queued': True, 'position': reservation.position()})
+    yield sse_framer.event({'queue_wait_ms': reservation.wait_ms})
+
+def build_turn(user_message, full_response, agent_type, title=None):
+    """构造一轮对话（用户消息 + 助手回复）用于持久化；title 为新对话指定标题"""
+    user_entry = {"text": user_message, "is_user": True, "agent_type": agent_type}
+    if title:
+        user_entry["title"] = title
+    return [
+        user_entry,
+        {"text": full_response, "is_user": False, "agent_type": agent_type},
+    ]
+
+def coalesce_key(email, payload):
+    """单飞合并键：用户 + 规范化请求内容的哈希"""
+    raw = json.dumps([email, payload], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def stream_response(generator, user_message, email, conv_id, agent_type, title=None, key=None):
+    """以SSE返回生成结果；key 不为空时相同 key 的进行中请求会合并为一次生成"""
+    buffer = get_stream_buffer()
+    generation = None
+    if key is not None:
+        generation, created = buffer.claim(email, key)
+        if not created:
+            # 重复请求：跟随进行中的生成，不再调用上游
+            generator.close()
+            return sse_response(buffer.tail(generation))
+
+    # 先申请生成名额，队列已满时直接返回429，不建立SSE流
+    try:
+        reservation = get_scheduler().reserve(email, agent_type)
+    except SchedulerFullError as e:
+        generator.close()
+        if generation is not None:
+            # 已合并进来的重复请求同样收到错误
+            buffer.append(generation, sse_framer.event({'error': str(e)}))
+            buffer.finish(generation)
+        return busy_response(e)
+
+    # 生成器在请求上下文之外执行，路由名需要提前取出
+    timer = metrics.StreamTimer(request.path, agent_type)
+    # 先登记生成，排队时据其跟随者数判断客户端是否还在
+    generation = generation or buffer.create(email)
+
     def generate():
         try:
+            yield from wait_for_admission(reservation, generation)
+            if not reservation.admitted:
+                # 排队期间客户端已断开：不调用智能体，也不保存本轮对话
+                generator.close()
+                return
             full_response = ""
-            for chunk in generator:
-                if chunk:
+            for chunk in sse_framer.coalesce(generator):
+                if isinstance(chunk, dict):
+                    # 进度等控制事件：照常推送，只有 transcript 部分（如PDF下载链接）记入对话记录
+                    frame = sse_framer.event(chunk)
+                    full_response += chunk.get('transcript', '')
+                else:
                     full_response += chunk
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-            save_conversation(email, [
-                {"text": user_message, "is_user": True, "agent_type": agent_type},
-                {"text": full_response, "is_user": False, "agent_type": agent_type},
-            ], conv_id)
-            yield f"data: {json.dumps({'done': True})}\n\n"
+                    frame = sse_framer.chunk(chunk)
+                timer.chunk(frame)
+                yield frame
+            turn = build_turn(user_message, full_response, agent_type, title)
+            queued = enqueue_conversation(email, turn, conv_id)
+            yield sse_framer.event({'done': True})
+            if not queued:
+                # 队列已满：done帧已发出，在响应结束后同步写入
+                get_conversation_writer().write_through(email, turn, conv_id)
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            timer.error()
+            yield sse_framer.event({'error': str(e)})
+        finally:
+            reservation.release()
+            timer.finish()
+
+    # 生成在后台进行，响应只是跟随生成缓冲；客户端断开后可凭 Last-Event-ID 续传
+    buffer.start(email, generate(), generation)
+    return sse_response(buffer.tail(generation))
+
+def sse_response(frames):
+    response = Response(frames, content_type=SSE_MIMETYPE)
+    response.headers.update(SSE_HEADERS)
+    return response
 
-    response = Response(generate(), mimetype='text/event-stream')
-    response.headers['Cache-Control'] = 'no-cache'
-    response.headers['X-Accel-Buffering'] = 'no'
-    response.headers['Connection'] = 'keep-alive'
+def resume_stream(email):
+    """
+    请求携带 Last-Event-ID 时接上之前的生成，而不是重新生成
+
+    Returns:
+        Response或None: 没有 Last-Event-ID 时返回None，由路由正常处理
+    """
+    parsed = parse_event_id(request.headers.get('Last-Event-ID'))
+    if parsed is None:
+        return None
+    generation_id, after = parsed
+    buffer = get_stream_buffer()
+    generation = buffer.get(generation_id, email)
+    if generation is None:
+        return jsonify({"error": "Stream expired or not found"}), 404
+    return sse_response(buffer.tail(generation, after))
+
+# ------------------------ 请求耗时 ------------------------
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            route=route, method=request.method, status=response.status_code
+        )
     return response
 
 # ------------------------ 路由 ------------------------
@@ -120,6 +260,10 @@ def send_message():
     if "email" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    resumed = resume_stream(session["email"])
+    if resumed is not None:
+        return resumed
+
     data = request.get_json()
     user_message = data.get("message", "").strip()
     agent_type = data.get("agent_type", "general")
@@ -132,6 +276,7 @@ def send_message():
     session["current_conv_id"] = conv_id
 
     try:
+        from agent.ai_agent import get_agent_service
         agent_service = get_agent_service()
         generator = agent_service.get_response_stream(user_message, email, agent_type, conv_id)
         return stream_response(generator, user_message, email, conv_id, agent_type)
@@ -143,6 +288,10 @@ def attraction_guide():
     if "email" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    resumed = resume_stream(session["email"])
+    if resumed is not None:
+        return resumed
+
     data = request.get_json()
     user_message = data.get("message", "").strip()
 
@@ -154,6 +303,7 @@ def attraction_guide():
     session["current_conv_id"] = conv_id
 
     try:
+        from agent.attraction_guide import get_attraction_guide_response_stream
         generator = get_attraction_guide_response_stream(user_message, email)
         return stream_response(generator, user_message, email, conv_id, "attraction_guide")
     except Exception as e:
@@ -164,28 +314,77 @@ def plan_travel():
     if "email" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    from agent.prompts import format_travel_request_prompt
+    resumed = resume_stream(session["email"])
+    if resumed is not None:
+        return resumed
+
+    from agent.prompts import format_travel_request_prompt, format_travel_request_title, normalize_travel_request
 
     data = request.get_json()
     travel_message = format_travel_request_prompt(data)
+    title = format_travel_request_title(data)
+    key = coalesce_key(session["email"], normalize_travel_request(data))
 
     email = session["email"]
     conv_id = session.get("current_conv_id") or str(uuid.uuid4())
     session["current_conv_id"] = conv_id
 
     try:
+        from agent.ai_agent import get_agent_service
         agent_service = get_agent_service()
-        generator = agent_service.get_response_stream(travel_message, email, "travel", conv_id)
-        return stream_response(generator, travel_message, email, conv_id, "travel")
+        generator = agent_service.get_response_stream(travel_message, email, "travel", conv_id, form_data=data)
+        return stream_response(generator, travel_message, email, conv_id, "travel", title, key)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/load_history', methods=['POST'])
 def load_history():
+    """
+    分页获取对话摘要（标题、预览、最后消息时间、消息数），不含消息内容
+
+    请求体（均可选）:
+        cursor: 上一页返回的 next_cursor
+        limit:  每页数量（1-100，默认20）
+        since:  上次返回的 sync_token，传入时进入增量模式，只返回变化和删除的对话
+    """
     if 'email' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        limit = max(1, min(int(data.get('limit', 20)), 100))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid limit'}), 400
+
     try:
-        return jsonify({'history': get_history(session['email'])})
+        email = session['email']
+        # 先等待写回队列落库，保证能读到刚结束的对话
+        get_conversation_writer().flush()
+        if data.get('since'):
+            return jsonify(db.get_conversation_changes(email, data['since']))
+        return jsonify(db.get_conversation_summaries(email, limit=limit, cursor=data.get('cursor')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/load_conversation', methods=['POST'])
+def load_conversation():
+    """按需获取单个对话的全部消息"""
+    if 'email' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    conversation_id = data.get('conversation_id')
+    if not conversation_id:
+        return jsonify({'error': 'Missing conversation_id'}), 400
+
+    try:
+        get_conversation_writer().flush()
+        messages = db.get_conversation_messages_for_user(session['email'], conversation_id)
+        if messages is None:
+            return jsonify({'error': 'Conversation not found or access denied'}), 404
+        return jsonify({'conversation_id': conversation_id, 'messages': messages})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -200,6 +399,7 @@ def delete_conversation():
         return jsonify({"error": "Missing conversation_id"}), 400
 
     try:
+        get_conversation_writer().flush()
         success = db.delete_conversation_for_user(session["email"], conversation_id)
         if success:
             return jsonify({"success": True})
@@ -230,6 +430,7 @@ def start_new_conversation():
 def logout():
     email = session.get('email')
     if email:
+        from agent.attraction_guide import clear_tour_guide_agents
         clear_user_agents(email)
         clear_tour_guide_agents(email)
     session.clear()
@@ -242,7 +443,10 @@ def memory_stats():
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
+        from agent.ai_agent import get_agent_memory_stats
         stats = get_agent_memory_stats()
+        stats['persistence'] = get_conversation_writer().get_stats()
+        stats['scheduler'] = get_scheduler().get_stats()
         return jsonify({
             'status': 'success',
             'stats': stats
@@ -253,5 +457,48 @@ def memory_stats():
             'message': str(e)
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 文本格式的性能指标；设置了 METRICS_TOKEN 时需携带 Bearer 令牌"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    metrics.CONVERSATION_QUEUE_DEPTH.set(get_conversation_writer().queue.qsize())
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/pdf_jobs/<job_id>', methods=['GET'])
+def pdf_job_status(job_id):
+    """查询PDF渲染任务状态（status: queued/running/done/failed，done 时 result 为生成结果）"""
+    if 'email' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    from agent.pdf_jobs import get_pdf_job_queue
+    job = get_pdf_job_queue().get(job_id)
+    if job is None or job['owner'] != session['email']:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(job)
+
+@app.route('/pdf_jobs/<job_id>/events', methods=['GET'])
+def pdf_job_events(job_id):
+    """以SSE推送PDF渲染任务的状态变化，任务结束（或等待超时）后关闭"""
+    if 'email' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    from agent.pdf_jobs import get_pdf_job_queue
+    job_queue = get_pdf_job_queue()
+    job = job_queue.get(job_id)
+    if job is None or job['owner'] != session['email']:
+        return jsonify({'error': 'Not found'}), 404
+
+    timeout = float(os.getenv('PDF_JOB_WAIT_TIMEOUT', '120'))
+    return sse_response(sse_framer.event({'pdf_job': status}) for status in job_queue.iter_status(job_id, timeout))
+
+@app.route('/healthz/ready', methods=['GET'])
+def readiness():
+    """就绪检查：开启预热时，预热完成前返回503，负载均衡器据此只转发到已预热的工作进程"""
+    status = get_prewarmer().get_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,340 @@
+# asgi.py
+"""
+ASGI异步服务入口
+
+/send_message、/attraction_guide、/plan_travel 三个SSE流式接口在这里以协程方式运行，
+LLM生成期间只占用事件循环上的一个任务，而不是一个工作线程，单进程即可同时维持成千上万条流。
+其余路由（登录、历史记录等）原样交给 Flask 应用处理，两种模式共享同一个签名Cookie会话。
+
+启动方式:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import dump_cookie
+
+from app import app as flask_app, enqueue_conversation, build_turn, sse_framer, coalesce_key, QUEUE_HEARTBEAT_SECONDS, QUEUE_ABANDON_SECONDS
+from scheduler import get_scheduler, SchedulerFullError
+from stream_buffer import get_stream_buffer, parse_event_id
+from conversation_writer import get_conversation_writer
+import metrics
+from sse import SSE_HEADERS, SSE_MIMETYPE
+from agent.prompts import format_travel_request_prompt, format_travel_request_title, normalize_travel_request
+
+
+# ------------------------ 会话 ------------------------
+class SessionCodec:
+    """读写Flask签名Cookie会话，使异步路由与Flask路由共享登录状态"""
+
+    def __init__(self, app):
+        self.app = app
+        self.interface = app.session_interface
+        self.cookie_name = self.interface.get_cookie_name(app)
+
+    def load(self, headers: List[Tuple[bytes, bytes]]) -> Dict[str, Any]:
+        """从请求头中解析会话内容，签名无效时返回空会话"""
+        serializer = self.interface.get_signing_serializer(self.app)
+        if serializer is None:
+            return {}
+
+        for name, value in headers:
+            if name != b'cookie':
+                continue
+            for item in value.decode('latin-1').split(';'):
+                key, _, raw = item.strip().partition('=')
+                if key != self.cookie_name:
+                    continue
+                try:
+                    max_age = int(self.app.permanent_session_lifetime.total_seconds())
+                    return dict(serializer.loads(raw, max_age=max_age))
+                except Exception:
+                    return {}
+        return {}
+
+    def dump_header(self, data: Dict[str, Any]) -> Tuple[bytes, bytes]:
+        """将会话内容编码为 Set-Cookie 响应头"""
+        serializer = self.interface.get_signing_serializer(self.app)
+        cookie = dump_cookie(
+            self.cookie_name,
+            serializer.dumps(data),
+            domain=self.interface.get_cookie_domain(self.app),
+            path=self.interface.get_cookie_path(self.app),
+            secure=self.interface.get_cookie_secure(self.app),
+            httponly=self.interface.get_cookie_httponly(self.app),
+            samesite=self.interface.get_cookie_samesite(self.app),
+        )
+        return b'set-cookie', cookie.encode('latin-1')
+
+
+# ------------------------ 工具函数 ------------------------
+async def read_body(receive) -> bytes:
+    """读取完整的请求体"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+async def send_json(send, status: int, payload: Dict[str, Any], extra_headers: Optional[List] = None):
+    """发送一个JSON响应"""
+    body = json.dumps(payload).encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    headers.extend(extra_headers or [])
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def load_agent_service():
+    """导入并获取智能体服务（首次调用会导入langchain等重依赖，需放在线程中执行）"""
+    from agent.ai_agent import get_agent_service
+    return get_agent_service()
+
+def load_attraction_guide_stream(user_message: str, email: str):
+    """导入并获取景点讲解的异步流（同样放在线程中执行）"""
+    from agent.attraction_guide import aget_attraction_guide_response_stream
+    return aget_attraction_guide_response_stream(user_message, email)
+
+async def await_admission(reservation, generation):
+    """异步版 wait_for_admission：排队期间推送队列位置，准入后推送排队耗时；客户端已离开时撤销排队"""
+    while not await reservation.wait_async(QUEUE_HEARTBEAT_SECONDS):
+        if generation.abandoned(QUEUE_ABANDON_SECONDS) and \
+                not await asyncio.to_thread(get_stream_buffer().followed_remotely, generation):
+            reservation.cancel()
+            yield sse_framer.event({'error': '客户端已断开，已取消排队'})
+            return
+        yield sse_framer.event({'queued': True, 'position': reservation.position()})
+    yield sse_framer.event({'queue_wait_ms': reservation.wait_ms})
+
+async def agenerate_frames(generator, reservation, generation, user_message, email, conv_id, agent_type, title=None,
+                           route=''):
+    """异步版 stream_response.generate：消费智能体异步生成器并产出SSE帧"""
+    timer = metrics.StreamTimer(route, agent_type)
+    try:
+        async for frame in await_admission(reservation, generation):
+            yield frame
+        if not reservation.admitted:
+            # 排队期间客户端已断开：不调用智能体（生成器由 cleanup 关闭），也不保存本轮对话
+            return
+        full_response = ""
+        async for chunk in sse_framer.acoalesce(generator):
+            if isinstance(chunk, dict):
+                # 进度等控制事件：照常推送，只有 transcript 部分（如PDF下载链接）记入对话记录
+                frame = sse_framer.event(chunk)
+                full_response += chunk.get('transcript', '')
+            else:
+                full_response += chunk
+                frame = sse_framer.chunk(chunk)
+            timer.chunk(frame)
+            yield frame
+        turn = build_turn(user_message, full_response, agent_type, title)
+        queued = enqueue_conversation(email, turn, conv_id)
+        yield sse_framer.event({'done': True})
+        if not queued:
+            await asyncio.to_thread(get_conversation_writer().write_through, email, turn, conv_id)
+    except Exception as e:
+        timer.error()
+        yield sse_framer.event({'error': str(e)})
+    finally:
+        reservation.release()
+        timer.finish()
+
+async def astream_response(send, receive, generator, user_message, email, conv_id, agent_type, extra_headers=None, title=None,
+                           route='', key=None):
+    """以SSE方式推送异步生成器的输出；生成在独立任务中进行，客户端断开只停止推送"""
+    buffer = await asyncio.to_thread(get_stream_buffer)
+    generation = None
+    if key is not None:
+        generation, created = await asyncio.to_thread(buffer.claim, email, key)
+        if not created:
+            # 重复请求：跟随进行中的生成，不再调用上游
+            await generator.aclose()
+            return await asend_frames(send, receive, buffer.atail(generation), extra_headers)
+
+    # 先申请生成名额，队列已满时直接返回429，不建立SSE流
+    try:
+        reservation = get_scheduler().reserve(email, agent_type)
+    except SchedulerFullError as e:
+        await generator.aclose()
+        if generation is not None:
+            # 已合并进来的重复请求同样收到错误
+            buffer.append(generation, sse_framer.event({'error': str(e)}))
+            buffer.finish(generation)
+        headers = list(extra_headers or []) + [(b'retry-after', str(e.retry_after).encode())]
+        return await send_json(send, 429, {"error": str(e), "retry_after": e.retry_after}, headers)
+
+    async def cleanup():
+        await generator.aclose()
+        # 帧生成器未能启动时不会执行其 finally，这里兜底释放名额（重复释放无副作用）
+        reservation.release()
+
+    # 先登记生成，排队时据其跟随者数判断客户端是否还在
+    generation = generation or buffer.create(email)
+    frames = agenerate_frames(generator, reservation, generation, user_message, email, conv_id, agent_type, title, route)
+    buffer.astart(email, frames, on_done=cleanup, generation=generation)
+    await asend_frames(send, receive, buffer.atail(generation), extra_headers)
+
+async def asend_frames(send, receive, frames, extra_headers=None):
+    """推送SSE帧，客户端断开时停止推送"""
+    headers = [(b'content-type', SSE_MIMETYPE.encode())]
+    headers.extend((k.lower().encode(), v.encode()) for k, v in SSE_HEADERS.items())
+    headers.extend(extra_headers or [])
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+    async def pump():
+        async for frame in frames:
+            await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wait_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    pump_task = asyncio.create_task(pump())
+    disconnect_task = asyncio.create_task(wait_disconnect())
+    try:
+        await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (pump_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(pump_task, disconnect_task, return_exceptions=True)
+        await frames.aclose()
+
+
+# ------------------------ ASGI应用 ------------------------
+class StreamingASGIApp:
+    """异步SSE路由 + Flask回退的ASGI应用"""
+
+    def __init__(self, app):
+        self.flask_app = app
+        self.wsgi_app = WsgiToAsgi(app)
+        self.sessions = SessionCodec(app)
+        self.routes = {
+            '/send_message': self.send_message,
+            '/attraction_guide': self.attraction_guide,
+            '/plan_travel': self.plan_travel,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(scope, receive, send)
+
+        handler = self.routes.get(scope.get('path'))
+        if scope['type'] == 'http' and scope['method'] == 'POST' and handler:
+            return await handler(scope, receive, send)
+
+        return await self.wsgi_app(scope, receive, send)
+
+    async def lifespan(self, scope, receive, send):
+        """处理ASGI生命周期事件"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # 关闭前把写回队列中的对话全部落库
+                await asyncio.to_thread(get_conversation_writer().close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _prepare(self, scope, receive, send):
+        """校验登录、解析JSON、确定对话ID；失败或续传请求时直接完成响应并返回None"""
+        session = self.sessions.load(scope['headers'])
+        if 'email' not in session:
+            await send_json(send, 401, {"error": "Unauthorized"})
+            return None
+
+        try:
+            data = json.loads(await read_body(receive) or b'{}')
+        except ValueError:
+            await send_json(send, 400, {"error": "Invalid JSON"})
+            return None
+
+        # 携带 Last-Event-ID 的重连请求接上之前的生成，而不是重新生成
+        last_event_id = dict(scope['headers']).get(b'last-event-id')
+        parsed = parse_event_id(last_event_id.decode('latin-1') if last_event_id else None)
+        if parsed is not None:
+            generation_id, after = parsed
+            buffer = await asyncio.to_thread(get_stream_buffer)
+            generation = await asyncio.to_thread(buffer.get, generation_id, session['email'])
+            if generation is None:
+                await send_json(send, 404, {"error": "Stream expired or not found"})
+            else:
+                await asend_frames(send, receive, buffer.atail(generation, after))
+            return None
+
+        extra_headers = []
+        conv_id = session.get("current_conv_id")
+        if not conv_id:
+            conv_id = str(uuid.uuid4())
+            session["current_conv_id"] = conv_id
+            extra_headers.append(self.sessions.dump_header(session))
+
+        return session["email"], conv_id, data or {}, extra_headers
+
+    async def send_message(self, scope, receive, send):
+        prepared = await self._prepare(scope, receive, send)
+        if prepared is None:
+            return
+        email, conv_id, data, extra_headers = prepared
+
+        user_message = data.get("message", "").strip()
+        agent_type = data.get("agent_type", "general")
+        if not user_message:
+            return await send_json(send, 400, {"error": "Empty message"}, extra_headers)
+
+        try:
+            agent_service = await asyncio.to_thread(load_agent_service)
+            generator = agent_service.aget_response_stream(user_message, email, agent_type, conv_id)
+        except Exception as e:
+            return await send_json(send, 500, {"error": str(e)}, extra_headers)
+        await astream_response(send, receive, generator, user_message, email, conv_id, agent_type, extra_headers,
+                               route=scope['path'])
+
+    async def attraction_guide(self, scope, receive, send):
+        prepared = await self._prepare(scope, receive, send)
+        if prepared is None:
+            return
+        email, conv_id, data, extra_headers = prepared
+
+        user_message = data.get("message", "").strip()
+        if not user_message:
+            return await send_json(send, 400, {"error": "Empty message"}, extra_headers)
+
+        try:
+            generator = await asyncio.to_thread(load_attraction_guide_stream, user_message, email)
+        except Exception as e:
+            return await send_json(send, 500, {"error": str(e)}, extra_headers)
+        await astream_response(send, receive, generator, user_message, email, conv_id, "attraction_guide", extra_headers,
+                               route=scope['path'])
+
+    async def plan_travel(self, scope, receive, send):
+        prepared = await self._prepare(scope, receive, send)
+        if prepared is None:
+            return
+        email, conv_id, data, extra_headers = prepared
+
+        travel_message = format_travel_request_prompt(data)
+        title = format_travel_request_title(data)
+        key = coalesce_key(email, normalize_travel_request(data))
+
+        try:
+            agent_service = await asyncio.to_thread(load_agent_service)
+            generator = agent_service.aget_response_stream(travel_message, email, "travel", conv_id, form_data=data)
+        except Exception as e:
+            return await send_json(send, 500, {"error": str(e)}, extra_headers)
+        await astream_response(send, receive, generator, travel_message, email, conv_id, "travel", extra_headers, title,
+                               route=scope['path'], key=key)
+
+
+application = StreamingASGIApp(flask_app)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+同步 -> 异步桥接开销微基准：每次调用新建线程池 + asyncio.run（原 AsyncSyncWrapper）vs 常驻后台事件循环
+
+被调用的协程只做一次 await asyncio.sleep(0)，测出的就是桥接本身的开销。
+分别在单线程顺序调用和多线程并发调用（模拟多个Flask工作线程）下统计每次调用的耗时。
+
+用法:
+    python benchmarks/bench_async_bridge.py --calls 2000 --threads 1,8,32
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.event_loop import BackgroundEventLoop
+
+
+async def noop():
+    await asyncio.sleep(0)
+
+
+def run_per_call_loop(coro_factory, timeout: int = 60):
+    """原 AsyncSyncWrapper.run_async_in_thread 的实现：每次调用新建线程池和事件循环"""
+    def sync_wrapper():
+        return asyncio.run(coro_factory())
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        future = executor.submit(sync_wrapper)
+        return future.result(timeout=timeout)
+
+
+def measure(call, calls: int, threads: int):
+    """返回 (每次调用耗时列表（微秒）, 总吞吐 calls/s)"""
+    per_thread = max(1, calls // threads)
+
+    def worker():
+        samples = []
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - started) * 1e6)
+        return samples
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: worker(), range(threads)))
+    elapsed = time.perf_counter() - started
+    samples = [sample for result in results for sample in result]
+    return samples, len(samples) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步->异步桥接开销微基准")
+    parser.add_argument('--calls', type=int, default=2000, help='每轮总调用次数')
+    parser.add_argument('--threads', default='1,8,32', help='逗号分隔的调用线程数')
+    args = parser.parse_args()
+
+    background = BackgroundEventLoop("bench-loop")
+    modes = {
+        'per_call_loop': lambda: run_per_call_loop(noop),
+        'background_loop': lambda: background.run(noop()),
+    }
+
+    print(f"{'mode':<18}{'threads':>8}{'p50_us':>10}{'p95_us':>10}{'calls/s':>11}")
+    for threads in [int(x) for x in args.threads.split(',') if x]:
+        for name, call in modes.items():
+            call()  # 预热
+            samples, throughput = measure(call, args.calls, threads)
+            samples.sort()
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            print(f"{name:<18}{threads:>8}{statistics.median(samples):>10.1f}{p95:>10.1f}{throughput:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
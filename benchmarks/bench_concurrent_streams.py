@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+并发SSE流容量基准测试：线程模式(Flask/WSGI) vs 异步模式(ASGI)
+
+用一个按固定间隔产出token的模拟智能体替换真实LLM，分别启动：
+  - threaded: Flask应用 + 固定大小线程池的WSGI服务器（等价于 gunicorn -k gthread --threads N）
+  - async:    asgi.application + uvicorn
+然后同时打开 C 条 /send_message 流，统计在截止时间内完成的流数量、首块延迟和峰值同时活跃流数。
+
+用法:
+    python benchmarks/bench_concurrent_streams.py --concurrency 100,500,2000 --threads 32
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FLASK_SECRET_KEY', 'bench-secret')
+os.environ.setdefault('OPENAI_API_KEY', 'bench-key')
+# 测的是服务模型本身的容量，不让生成调度器限流
+os.environ.setdefault('SCHEDULER_MAX_CONCURRENT', '100000')
+
+import httpx
+import uvicorn
+from werkzeug.serving import BaseWSGIServer
+
+import app as app_module
+import asgi as asgi_module
+import agent.ai_agent as ai_agent_module
+
+
+class FakeAgentService:
+    """按固定间隔产出token的模拟智能体服务，模拟LLM流式生成"""
+
+    def __init__(self, tokens: int, interval: float):
+        self.tokens = tokens
+        self.interval = interval
+
+    def get_response_stream(self, user_message, user_email, agent_type="general", conv_id=None):
+        for _ in range(self.tokens):
+            time.sleep(self.interval)
+            yield "青鸾"
+
+    async def aget_response_stream(self, user_message, user_email, agent_type="general", conv_id=None):
+        for _ in range(self.tokens):
+            await asyncio.sleep(self.interval)
+            yield "青鸾"
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """固定线程数的WSGI服务器：每条打开的流占用一个工作线程"""
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def install_fake_service(tokens: int, interval: float):
+    """替换真实智能体服务和数据库写入，只测量服务层的并发能力"""
+    service = FakeAgentService(tokens, interval)
+    # 路由在调用时才从 agent.ai_agent 导入 get_agent_service，替换模块属性即可
+    ai_agent_module.get_agent_service = lambda: service
+    app_module.enqueue_conversation = lambda *args, **kwargs: True
+    asgi_module.enqueue_conversation = lambda *args, **kwargs: True
+
+
+def session_cookie() -> str:
+    flask_app = app_module.app
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    value = serializer.dumps({'email': 'bench@qq.com', 'current_conv_id': 'bench-conv'})
+    return f"{flask_app.session_interface.get_cookie_name(flask_app)}={value}"
+
+
+def start_threaded_server(port: int, threads: int):
+    server = PooledWSGIServer('127.0.0.1', port, app_module.app, threads)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.shutdown
+
+
+def start_async_server(port: int):
+    config = uvicorn.Config(asgi_module.application, host='127.0.0.1', port=port,
+                            log_level='warning', backlog=8192)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=10)
+    return stop
+
+
+async def run_load(port: int, concurrency: int, deadline: float):
+    """同时打开 concurrency 条流，返回统计结果"""
+    cookie = session_cookie()
+    ttfb, durations = [], []
+    active = 0
+    peak_active = 0
+    completed = 0
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(deadline)) as client:
+        async def one_stream():
+            nonlocal active, peak_active, completed
+            start = time.perf_counter()
+            first = None
+            try:
+                async with client.stream('POST', f'http://127.0.0.1:{port}/send_message',
+                                         json={'message': 'bench', 'agent_type': 'general'},
+                                         headers={'Cookie': cookie}) as response:
+                    async for line in response.aiter_lines():
+                        if first is None and line.startswith('data:'):
+                            first = time.perf_counter() - start
+                            active += 1
+                            peak_active = max(peak_active, active)
+                        if '"done"' in line:
+                            completed += 1
+                            durations.append(time.perf_counter() - start)
+                            break
+            except Exception:
+                pass
+            finally:
+                if first is not None:
+                    active -= 1
+                    ttfb.append(first)
+
+        tasks = [asyncio.create_task(one_stream()) for _ in range(concurrency)]
+        await asyncio.wait(tasks, timeout=deadline)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def pct(values, q):
+        if not values:
+            return float('nan')
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    return {
+        'completed': completed,
+        'peak_active': peak_active,
+        'ttfb_p50': pct(ttfb, 0.5),
+        'ttfb_p95': pct(ttfb, 0.95),
+        'duration_p50': statistics.median(durations) if durations else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发SSE流容量基准测试")
+    parser.add_argument('--concurrency', default='50,200,1000', help='逗号分隔的并发流数量')
+    parser.add_argument('--tokens', type=int, default=40, help='每条流的token数')
+    parser.add_argument('--interval', type=float, default=0.05, help='token间隔（秒）')
+    parser.add_argument('--threads', type=int, default=32, help='线程模式的工作线程数')
+    parser.add_argument('--deadline', type=float, default=30.0, help='每轮测试的截止时间（秒）')
+    parser.add_argument('--port', type=int, default=18500)
+    args = parser.parse_args()
+
+    install_fake_service(args.tokens, args.interval)
+    levels = [int(x) for x in args.concurrency.split(',') if x]
+    ideal = args.tokens * args.interval
+
+    print(f"每条流理想耗时 {ideal:.2f}s，线程模式线程数 {args.threads}，截止时间 {args.deadline:.0f}s")
+    print(f"{'mode':<10}{'streams':>9}{'completed':>11}{'peak':>8}{'ttfb_p50':>10}{'ttfb_p95':>10}{'dur_p50':>9}")
+
+    for mode, port in (('threaded', args.port), ('async', args.port + 1)):
+        stop = start_threaded_server(port, args.threads) if mode == 'threaded' else start_async_server(port)
+        try:
+            for level in levels:
+                result = asyncio.run(run_load(port, level, args.deadline))
+                print(f"{mode:<10}{level:>9}{result['completed']:>11}{result['peak_active']:>8}"
+                      f"{result['ttfb_p50']:>10.3f}{result['ttfb_p95']:>10.3f}{result['duration_p50']:>9.2f}")
+        finally:
+            stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+应用启动耗时基准测试
+
+1. 导入耗时：在全新解释器中执行 `python -X importtime -c "import <module>"`，
+   统计总耗时并按顶层包汇总累计导入时间，列出最慢的几个包。
+   默认同时测量 app（启动路径）和 agent.ai_agent / agent.attraction_guide（推迟到首个智能体请求的部分）。
+2. 首个请求耗时：启动一个新的服务进程，从进程创建开始计时，轮询 GET /login 直到返回200。
+
+每项都在独立子进程中重复多次取中位数，避免受当前进程已导入模块的影响。
+
+用法:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --modules app,asgi --repeat 5 --top 15
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault('FLASK_SECRET_KEY', 'bench-secret')
+    env.setdefault('OPENAI_API_KEY', 'bench-key')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def parse_importtime(stderr: str):
+    """
+    解析 -X importtime 输出，返回 (总耗时秒, {顶层包: 累计秒})
+
+    每行格式: import time: self [us] | cumulative | imported package
+    只统计缩进为0的行（即被直接导入的顶层模块），避免重复累加。
+    """
+    by_package = defaultdict(float)
+    total = 0.0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            cumulative_s = int(cumulative) / 1e6
+        except ValueError:
+            continue
+        if name.startswith('   '):
+            continue
+        package = name.strip().split('.')[0]
+        by_package[package] += cumulative_s
+        total += cumulative_s
+    return total, by_package
+
+
+def measure_import(module: str, repeat: int):
+    """在新解释器中重复导入模块，返回 (墙钟耗时中位数, importtime总耗时中位数, 顶层包耗时中位数)"""
+    walls, totals = [], []
+    packages = defaultdict(list)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                cwd=ROOT, env=child_env(), capture_output=True, text=True)
+        walls.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'unknown error'
+            raise RuntimeError(f"导入 {module} 失败: {error}")
+        total, by_package = parse_importtime(result.stderr)
+        totals.append(total)
+        for package, seconds in by_package.items():
+            packages[package].append(seconds)
+    medians = {package: statistics.median(values) for package, values in packages.items()}
+    return statistics.median(walls), statistics.median(totals), medians
+
+
+SERVER_SCRIPT = """
+import sys
+from werkzeug.serving import make_server
+import {module} as target
+make_server('127.0.0.1', int(sys.argv[1]), target.{attr}).serve_forever()
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(repeat: int, timeout: float = 60.0):
+    """启动新的服务进程，测量从进程创建到 GET /login 首次返回200的耗时（中位数）"""
+    samples = []
+    script = SERVER_SCRIPT.format(module='app', attr='app')
+    for _ in range(repeat):
+        port = free_port()
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', script, str(port)], cwd=ROOT, env=child_env(),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("服务进程提前退出")
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("等待首个请求超时")
+                try:
+                    with urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=5) as response:
+                        if response.status == 200:
+                            samples.append(time.perf_counter() - start)
+                            break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.01)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="应用启动耗时基准测试")
+    parser.add_argument('--modules', default='app,agent.ai_agent,agent.attraction_guide',
+                        help='逗号分隔的待测模块')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数（取中位数）')
+    parser.add_argument('--top', type=int, default=10, help='列出累计耗时最多的顶层包数量')
+    parser.add_argument('--skip-request', action='store_true', help='跳过首个请求耗时测试')
+    args = parser.parse_args()
+
+    for module in [m for m in args.modules.split(',') if m]:
+        try:
+            wall, total, packages = measure_import(module, args.repeat)
+        except RuntimeError as e:
+            print(f"\n{module}: {e}")
+            continue
+        print(f"\nimport {module}: 进程墙钟 {wall * 1000:.0f}ms，importtime累计 {total * 1000:.0f}ms")
+        print(f"  {'package':<32}{'cumulative_ms':>14}")
+        for package, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            print(f"  {package:<32}{seconds * 1000:>14.1f}")
+
+    if not args.skip_request:
+        try:
+            first = measure_first_request(args.repeat)
+            print(f"\n首个请求耗时（进程创建 -> GET /login 200）: {first * 1000:.0f}ms")
+        except RuntimeError as e:
+            print(f"\n首个请求耗时测试失败: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+对话写回队列
+SSE流结束后不再同步写SQLite，而是把这一轮对话放进有界队列，
+由后台写线程把多个请求的对话合并到一个事务里提交（组提交）。
+
+配置（环境变量）:
+    CONVERSATION_QUEUE_SIZE   队列容量（默认1000）
+    CONVERSATION_BATCH_SIZE   单个事务最多包含的对话轮数（默认100）
+    CONVERSATION_LINGER_MS    取到第一条后再等待凑批的时间，毫秒（默认20）
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from database_self import db as default_db
+
+_STOP = object()
+
+
+class ConversationWriter:
+    """后台批量写入对话的写回队列"""
+
+    def __init__(self, database=None, max_queue_size: int = 1000, max_batch_size: int = 100,
+                 linger_ms: float = 20):
+        self.database = database or default_db
+        self.max_batch_size = max_batch_size
+        self.linger = linger_ms / 1000.0
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+
+        # pending 统计已提交但尚未落库的对话轮数，flush() 依赖它判断是否写完
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+        self.stats = {
+            "submitted": 0,
+            "committed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "batches": 0,
+            "batched": 0,
+            "max_batch_size": 0,
+            "last_commit_ms": 0.0,
+            "max_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+        }
+
+    # ---------------- 生产者接口 ----------------
+    def submit(self, email: str, messages: List[Dict[str, Any]], conv_id: str) -> bool:
+        """
+        提交一轮对话，永不阻塞
+
+        Returns:
+            bool: 是否成功入队；队列已满或已关闭时返回False，调用方应在响应结束后调用 write_through
+        """
+        if self._closed:
+            return False
+        self._ensure_started()
+        with self._pending_cond:
+            self._pending += 1
+        try:
+            self.queue.put_nowait((email, messages, conv_id))
+        except queue.Full:
+            self._done(1)
+            self._incr("rejected")
+            return False
+        self._incr("submitted")
+        return True
+
+    def write_through(self, email: str, messages: List[Dict[str, Any]], conv_id: str):
+        """队列满时的同步写入（在SSE响应已经结束后调用，起到反压作用）"""
+        self.database.save_conversation(email, messages, conv_id)
+        self._incr("committed")
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """等待队列中已提交的对话全部落库"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending_cond:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """停止接收新数据，写完队列中剩余内容后退出写线程"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        print(f"💾 对话写回队列已关闭，共提交 {self.stats['committed']} 轮对话")
+
+    # ---------------- 写线程 ----------------
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self.database.get_connection()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _STOP:
+                    return
+                batch = [item]
+                stop = False
+
+                # 凑批：在 linger 时间内尽量多取，达到批大小立即提交
+                deadline = time.monotonic() + self.linger
+                while len(batch) < self.max_batch_size:
+                    try:
+                        item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+                    batch.append(item)
+
+                self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            self.database.save_conversations_batch(batch, conn=conn)
+            committed, failed = len(batch), 0
+        except Exception as e:
+            print(f"批量保存对话失败，改为逐条保存: {e}")
+            committed, failed = 0, 0
+            for item in batch:
+                try:
+                    self.database.save_conversations_batch([item], conn=conn)
+                    committed += 1
+                except Exception as item_error:
+                    print(f"保存对话失败 (conv_id={item[2]}): {item_error}")
+                    failed += 1
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._stats_lock:
+            self.stats["committed"] += committed
+            self.stats["failed"] += failed
+            self.stats["batches"] += 1
+            self.stats["batched"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+            self.stats["last_commit_ms"] = elapsed_ms
+            self.stats["max_commit_ms"] = max(self.stats["max_commit_ms"], elapsed_ms)
+            self.stats["total_commit_ms"] += elapsed_ms
+        self._done(len(batch))
+
+    # ---------------- 统计 ----------------
+    def _incr(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _done(self, count: int):
+        with self._pending_cond:
+            self._pending -= count
+            if self._pending <= 0:
+                self._pending_cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列深度和提交延迟统计"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        batches = stats.pop("batches")
+        batched = stats.pop("batched")
+        total_commit_ms = stats.pop("total_commit_ms")
+        stats.update({
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "pending": self._pending,
+            "batches": batches,
+            "avg_batch_size": round(batched / batches, 2) if batches else 0,
+            "avg_commit_ms": round(total_commit_ms / batches, 2) if batches else 0,
+            "last_commit_ms": round(stats["last_commit_ms"], 2),
+            "max_commit_ms": round(stats["max_commit_ms"], 2),
+        })
+        return stats
+
+
+# 全局写回队列实例
+_conversation_writer = None
+_writer_lock = threading.Lock()
+
+def get_conversation_writer() -> ConversationWriter:
+    """获取全局对话写回队列（懒加载，进程退出时自动刷盘）"""
+    global _conversation_writer
+    if _conversation_writer is None:
+        with _writer_lock:
+            if _conversation_writer is None:
+                _conversation_writer = ConversationWriter(
+                    max_queue_size=int(os.getenv('CONVERSATION_QUEUE_SIZE', '1000')),
+                    max_batch_size=int(os.getenv('CONVERSATION_BATCH_SIZE', '100')),
+                    linger_ms=float(os.getenv('CONVERSATION_LINGER_MS', '20')),
+                )
+                atexit.register(_conversation_writer.close)
+    return _conversation_writer
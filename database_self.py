@@ -1,8 +1,15 @@
 import sqlite3
 import json
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+from metrics import timed, SQLITE_SECONDS, ERRORS
+
+# 同步令牌相对当前时间回退的秒数：写回线程在提交前就取好了消息时间，
+# 读取之后才提交、时间却早于"当前时间"的行仍会被下一次增量同步取到（重复返回的对话由前端按ID去重）
+SYNC_TOKEN_MARGIN_SECONDS = float(os.getenv('SYNC_TOKEN_MARGIN_SECONDS', '10'))
 
 class Database:
     def __init__(self, db_path: str = 'app.db'):
@@ -58,14 +65,96 @@ class Database:
             )
         ''')
         
-        # # 创建索引以提高查询性能
-        # cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_user_email ON conversations (user_email)')
-        # cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id)')
-        # cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)')
+        # 已删除对话的墓碑记录（供历史记录增量同步返回删除项）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS deleted_conversations (
+                id TEXT PRIMARY KEY,
+                user_email TEXT NOT NULL,
+                deleted_at TIMESTAMP NOT NULL
+            )
+        ''')
+        
+        self._migrate_conversation_summary(cursor)
+        
+        # 创建索引以提高查询性能
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_user_email ON conversations (user_email)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_user_last_message ON conversations (user_email, last_message_at DESC, id DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_deleted_conversations_user ON deleted_conversations (user_email, deleted_at)')
         
         conn.commit()
         conn.close()
     
+    def _migrate_conversation_summary(self, cursor):
+        """为对话表添加预计算的摘要列（标题、预览、最后消息时间、消息数），并回填旧数据"""
+        cursor.execute('PRAGMA table_info(conversations)')
+        columns = {row['name'] for row in cursor.fetchall()}
+        
+        new_columns = {
+            'title': 'TEXT',
+            'preview': 'TEXT',
+            'last_message_at': 'TIMESTAMP',
+            'message_count': 'INTEGER NOT NULL DEFAULT 0',
+        }
+        added = False
+        for name, column_type in new_columns.items():
+            if name not in columns:
+                cursor.execute(f'ALTER TABLE conversations ADD COLUMN {name} {column_type}')
+                added = True
+        
+        if not added:
+            return
+        
+        # 一次性回填已有对话的摘要
+        cursor.execute('''
+            UPDATE conversations SET
+                message_count = (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id),
+                last_message_at = COALESCE(
+                    (SELECT MAX(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id),
+                    conversations.created_at
+                )
+        ''')
+        cursor.execute('''
+            SELECT c.id,
+                (SELECT text FROM messages m WHERE m.conversation_id = c.id AND m.is_user = 1 ORDER BY m.id LIMIT 1) AS first_user,
+                (SELECT text FROM messages m WHERE m.conversation_id = c.id AND m.is_user = 0 ORDER BY m.id LIMIT 1) AS first_reply
+            FROM conversations c
+        ''')
+        cursor.executemany(
+            'UPDATE conversations SET title = ?, preview = ? WHERE id = ?',
+            [
+                (self._derive_title(row['first_user'] or ''), self._derive_preview(row['first_reply'] or ''), row['id'])
+                for row in cursor.fetchall()
+            ]
+        )
+    
+    @staticmethod
+    def _derive_title(text: str, max_length: int = 40) -> str:
+        """从用户首条消息生成对话标题"""
+        for line in text.strip().splitlines():
+            line = line.strip().strip('#*').strip()
+            if line:
+                return line[:max_length] + ('...' if len(line) > max_length else '')
+        return '新对话'
+    
+    @staticmethod
+    def _derive_preview(text: str, max_length: int = 100) -> str:
+        """从助手首条回复生成预览文本"""
+        text = ' '.join(text.split())
+        return text[:max_length] + ('...' if len(text) > max_length else '')
+    
+    @staticmethod
+    def _now() -> str:
+        """毫秒精度的UTC时间戳，与 CURRENT_TIMESTAMP 格式兼容且可按字符串排序"""
+        return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    
+    @staticmethod
+    def _sync_token() -> str:
+        """增量同步令牌：当前时间减去安全余量，覆盖读取时尚未提交的写入"""
+        return (datetime.utcnow() - timedelta(seconds=SYNC_TOKEN_MARGIN_SECONDS)).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'add_user')
     def add_user(self, email: str, password: str) -> bool:
         """添加新用户"""
         try:
@@ -86,9 +175,11 @@ class Database:
             return False
         except Exception as e:
             print(f"Error adding user: {e}")
+            ERRORS.inc(component='sqlite', operation='add_user')
             conn.close()
             return False
     
+    @timed(SQLITE_SECONDS, 'sqlite', 'verify_user')
     def verify_user(self, email: str, password: str) -> bool:
         """验证用户登录"""
         try:
@@ -108,42 +199,63 @@ class Database:
             return False
         except Exception as e:
             print(f"Error verifying user: {e}")
+            ERRORS.inc(component='sqlite', operation='verify_user')
             conn.close()
             return False
     
+    def _insert_conversation_rows(self, cursor, email: str, messages: List[Dict[str, Any]], conv_id: str):
+        """在给定游标上写入一轮对话（不提交事务）"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        
+        # 对话不存在时创建（INSERT OR IGNORE 避免并发写入时的竞争）
+        cursor.execute(
+            'INSERT OR IGNORE INTO conversations (id, user_email, date) VALUES (?, ?, ?)',
+            (conv_id, email, today)
+        )
+        
+        # 对话被删除后又继续使用同一ID时，移除墓碑
+        cursor.execute('DELETE FROM deleted_conversations WHERE id = ?', (conv_id,))
+        
+        # 保存消息
+        now = self._now()
+        cursor.executemany(
+            'INSERT INTO messages (conversation_id, text, is_user, agent_type, created_at) VALUES (?, ?, ?, ?, ?)',
+            [
+                (
+                    conv_id,
+                    message.get('text', ''),
+                    message.get('is_user', False),
+                    message.get('agent_type', 'general'),
+                    now
+                )
+                for message in messages
+            ]
+        )
+        
+        # 更新预计算的对话摘要（标题和预览只在第一次写入时生成）
+        first_user = next((m for m in messages if m.get('is_user')), None)
+        first_reply = next((m for m in messages if not m.get('is_user')), None)
+        title = None
+        if first_user is not None:
+            title = first_user.get('title') or self._derive_title(first_user.get('text', ''))
+        preview = self._derive_preview(first_reply.get('text', '')) if first_reply is not None else None
+        cursor.execute(
+            '''UPDATE conversations SET
+                message_count = message_count + ?,
+                last_message_at = ?,
+                title = COALESCE(title, ?),
+                preview = COALESCE(preview, ?)
+            WHERE id = ?''',
+            (len(messages), now, title, preview, conv_id)
+        )
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'save_conversation')
     def save_conversation(self, email: str, messages: List[Dict[str, Any]], conv_id: str):
         """保存对话和消息"""
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
-            
-            today = datetime.now().strftime('%Y-%m-%d')
-            
-            # 检查对话是否已存在
-            cursor.execute(
-                'SELECT id FROM conversations WHERE id = ?',
-                (conv_id,)
-            )
-            
-            if not cursor.fetchone():
-                # 创建新对话
-                cursor.execute(
-                    'INSERT INTO conversations (id, user_email, date) VALUES (?, ?, ?)',
-                    (conv_id, email, today)
-                )
-            
-            # 保存消息
-            for message in messages:
-                cursor.execute(
-                    'INSERT INTO messages (conversation_id, text, is_user, agent_type) VALUES (?, ?, ?, ?)',
-                    (
-                        conv_id,
-                        message.get('text', ''),
-                        message.get('is_user', False),
-                        message.get('agent_type', 'general')
-                    )
-                )
-            
+            self._insert_conversation_rows(cursor, email, messages, conv_id)
             conn.commit()
             conn.close()
         except Exception as e:
@@ -151,66 +263,258 @@ class Database:
             conn.close()
             raise
     
+    @timed(SQLITE_SECONDS, 'sqlite', 'save_conversations_batch')
+    def save_conversations_batch(self, items: List[Tuple[str, List[Dict[str, Any]], str]], conn=None) -> int:
+        """
+        在一个事务中批量保存多轮对话（供后台写回队列组提交使用）
+        
+        Args:
+            items: [(email, messages, conv_id), ...]
+            conn: 可复用的数据库连接，为None时新建并在结束后关闭
+            
+        Returns:
+            int: 写入的对话轮数
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            for email, messages, conv_id in items:
+                self._insert_conversation_rows(cursor, email, messages, conv_id)
+            conn.commit()
+            return len(items)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if own_conn:
+                conn.close()
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'get_history')
     def get_history(self, email: str) -> List[Dict[str, Any]]:
-        """获取用户的历史对话"""
+        """获取用户的全部历史对话（含消息，兼容旧接口；单次查询，不再逐个对话查询消息）"""
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
-            # 获取所有对话及其消息
             cursor.execute('''
-                SELECT 
-                    c.id,
-                    c.date,
-                    c.created_at,
-                    COUNT(m.id) as message_count
-                FROM conversations c
-                LEFT JOIN messages m ON c.id = m.conversation_id
-                WHERE c.user_email = ?
-                GROUP BY c.id
-                ORDER BY c.created_at DESC
+                SELECT id, date, created_at, message_count
+                FROM conversations
+                WHERE user_email = ?
+                ORDER BY created_at DESC
             ''', (email,))
             
             conversations = []
+            by_id = {}
             for row in cursor.fetchall():
-                # 获取对话的消息
-                cursor.execute('''
-                    SELECT text, is_user, agent_type, created_at
-                    FROM messages 
-                    WHERE conversation_id = ?
-                    ORDER BY created_at ASC
-                ''', (row['id'],))
-                
-                messages = []
-                for msg_row in cursor.fetchall():
-                    messages.append({
-                        'text': msg_row['text'],
-                        'is_user': bool(msg_row['is_user']),
-                        'agent_type': msg_row['agent_type'],
-                        'created_at': msg_row['created_at']
-                    })
-                
-                conversations.append({
+                conversation = {
                     'id': row['id'],
                     'date': row['date'],
                     'created_at': row['created_at'],
                     'message_count': row['message_count'],
-                    'messages': messages
+                    'messages': []
+                }
+                conversations.append(conversation)
+                by_id[row['id']] = conversation
+            
+            cursor.execute('''
+                SELECT m.conversation_id, m.text, m.is_user, m.agent_type, m.created_at
+                FROM messages m
+                JOIN conversations c ON m.conversation_id = c.id
+                WHERE c.user_email = ?
+                ORDER BY m.created_at ASC, m.id ASC
+            ''', (email,))
+            
+            for msg_row in cursor.fetchall():
+                by_id[msg_row['conversation_id']]['messages'].append({
+                    'text': msg_row['text'],
+                    'is_user': bool(msg_row['is_user']),
+                    'agent_type': msg_row['agent_type'],
+                    'created_at': msg_row['created_at']
                 })
             
             conn.close()
             return conversations
         except Exception as e:
             print(f"Error getting history: {e}")
+            ERRORS.inc(component='sqlite', operation='get_history')
             conn.close()
             return []
     
+    @staticmethod
+    def _summary_from_row(row) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'date': row['date'],
+            'title': row['title'] or '新对话',
+            'preview': row['preview'] or '',
+            'created_at': row['created_at'],
+            'last_message_at': row['last_message_at'],
+            'message_count': row['message_count'],
+        }
+    
+    @staticmethod
+    def encode_cursor(last_message_at: str, conv_id: str) -> str:
+        """将分页位置编码为不透明的游标字符串"""
+        raw = json.dumps([last_message_at, conv_id]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """解析游标字符串，格式错误时抛出 ValueError"""
+        try:
+            last_message_at, conv_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return str(last_message_at), str(conv_id)
+        except Exception:
+            raise ValueError("无效的分页游标")
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'get_conversation_summaries')
+    def get_conversation_summaries(self, email: str, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        按最后消息时间倒序分页获取对话摘要（不含消息内容）
+        
+        Args:
+            email: 用户邮箱
+            limit: 每页数量
+            cursor: 上一页返回的 next_cursor，为None时从最新开始
+            
+        Returns:
+            dict: {'conversations': [...], 'next_cursor': str或None, 'sync_token': str}
+        """
+        # 先生成同步令牌（带安全余量），之后提交的改动一定能被下一次增量同步取到
+        sync_token = self._sync_token()
+        conn = self.get_connection()
+        try:
+            params: List[Any] = [email]
+            where = 'WHERE user_email = ?'
+            if cursor:
+                last_message_at, conv_id = self.decode_cursor(cursor)
+                where += ' AND (last_message_at < ? OR (last_message_at = ? AND id < ?))'
+                params.extend([last_message_at, last_message_at, conv_id])
+            params.append(limit + 1)
+            
+            rows = conn.execute(f'''
+                SELECT id, date, title, preview, created_at, last_message_at, message_count
+                FROM conversations
+                {where}
+                ORDER BY last_message_at DESC, id DESC
+                LIMIT ?
+            ''', params).fetchall()
+            
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = None
+            if has_more:
+                next_cursor = self.encode_cursor(rows[-1]['last_message_at'], rows[-1]['id'])
+            
+            return {
+                'conversations': [self._summary_from_row(row) for row in rows],
+                'next_cursor': next_cursor,
+                'sync_token': sync_token,
+            }
+        finally:
+            conn.close()
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'get_conversation_changes')
+    def get_conversation_changes(self, email: str, since: str, limit: int = 200) -> Dict[str, Any]:
+        """
+        增量同步：返回 since 之后有新消息的对话摘要，以及 since 之后被删除的对话ID
+        
+        since 通常是时间戳；变更过多分批返回时，中途的令牌是 (最后消息时间, 对话ID) 游标，
+        下一批按与排序相同的 (last_message_at, id) 继续，同一毫秒的多个对话不会被跳过
+        
+        Returns:
+            dict: {'conversations': [...], 'deleted': [...], 'sync_token': str, 'has_more': bool}
+        """
+        sync_token = deleted_until = self._sync_token()
+        try:
+            since, since_id = self.decode_cursor(since)
+        except ValueError:
+            # 普通时间戳令牌：id 条件为 NULL，只取时间严格晚于令牌的对话
+            since_id = None
+        conn = self.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT id, date, title, preview, created_at, last_message_at, message_count
+                FROM conversations
+                WHERE user_email = ? AND (last_message_at > ? OR (last_message_at = ? AND id > ?))
+                ORDER BY last_message_at ASC, id ASC
+                LIMIT ?
+            ''', (email, since, since, since_id, limit + 1)).fetchall()
+            
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if has_more:
+                # 变更过多时分批同步：令牌推进到本批最后一条
+                deleted_until = rows[-1]['last_message_at']
+                sync_token = self.encode_cursor(deleted_until, rows[-1]['id'])
+            
+            deleted = [
+                row['id'] for row in conn.execute(
+                    'SELECT id FROM deleted_conversations WHERE user_email = ? AND deleted_at > ? AND deleted_at <= ?',
+                    (email, since, deleted_until)
+                ).fetchall()
+            ]
+            
+            return {
+                'conversations': [self._summary_from_row(row) for row in rows],
+                'deleted': deleted,
+                'sync_token': sync_token,
+                'has_more': has_more,
+            }
+        finally:
+            conn.close()
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'get_conversation_messages_for_user')
+    def get_conversation_messages_for_user(self, email: str, conv_id: str) -> Optional[List[Dict[str, Any]]]:
+        """获取属于该用户的某个对话的全部消息；对话不存在或不属于该用户时返回None"""
+        conn = self.get_connection()
+        try:
+            owner = conn.execute(
+                'SELECT id FROM conversations WHERE id = ? AND user_email = ?',
+                (conv_id, email)
+            ).fetchone()
+            if not owner:
+                return None
+            
+            rows = conn.execute('''
+                SELECT text, is_user, agent_type, created_at
+                FROM messages
+                WHERE conversation_id = ?
+                ORDER BY created_at ASC, id ASC
+            ''', (conv_id,)).fetchall()
+            return [
+                {
+                    'text': row['text'],
+                    'is_user': bool(row['is_user']),
+                    'agent_type': row['agent_type'],
+                    'created_at': row['created_at']
+                }
+                for row in rows
+            ]
+        finally:
+            conn.close()
+    
+    def _record_deletions(self, cursor, email: str, conv_ids: List[str]):
+        """记录被删除对话的墓碑"""
+        now = self._now()
+        cursor.executemany(
+            'INSERT OR REPLACE INTO deleted_conversations (id, user_email, deleted_at) VALUES (?, ?, ?)',
+            [(conv_id, email, now) for conv_id in conv_ids]
+        )
+    
+    @timed(SQLITE_SECONDS, 'sqlite', 'clear_user_history')
     def clear_user_history(self, email: str) -> bool:
         """清除用户的所有历史记录"""
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
+            # 记录墓碑，供其他标签页增量同步
+            cursor.execute('SELECT id FROM conversations WHERE user_email = ?', (email,))
+            self._record_deletions(cursor, email, [row['id'] for row in cursor.fetchall()])
+            
             #首先删除所有与会话相关的消息
             cursor.execute(
                 'DELETE FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE user_email = ?)',
@@ -228,9 +532,11 @@ class Database:
             return True
         except Exception as e:
             print(f"Error clearing user history: {e}")
+            ERRORS.inc(component='sqlite', operation='clear_user_history')
             conn.close()
             return False
     
+    @timed(SQLITE_SECONDS, 'sqlite', 'get_conversation_messages')
     def get_conversation_messages(self, conv_id: str) -> List[Dict[str, Any]]:
         """获取特定对话的所有消息"""
         try:
@@ -257,15 +563,22 @@ class Database:
             return messages
         except Exception as e:
             print(f"Error getting conversation messages: {e}")
+            ERRORS.inc(component='sqlite', operation='get_conversation_messages')
             conn.close()
             return []
     
+    @timed(SQLITE_SECONDS, 'sqlite', 'delete_conversation')
     def delete_conversation(self, conv_id: str) -> bool:
         """删除特定对话"""
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
+            cursor.execute('SELECT user_email FROM conversations WHERE id = ?', (conv_id,))
+            owner = cursor.fetchone()
+            if owner:
+                self._record_deletions(cursor, owner['user_email'], [conv_id])
+            
             # 首先删除该对话的所有消息
             cursor.execute(
                 'DELETE FROM messages WHERE conversation_id = ?',
@@ -283,9 +596,11 @@ class Database:
             return True
         except Exception as e:
             print(f"Error deleting conversation: {e}")
+            ERRORS.inc(component='sqlite', operation='delete_conversation')
             conn.close()
             return False
     
+    @timed(SQLITE_SECONDS, 'sqlite', 'delete_conversation_for_user')
     def delete_conversation_for_user(self, email: str, conv_id: str) -> bool:
         """删除特定用户的特定对话（验证权限）"""
         try:
@@ -313,15 +628,18 @@ class Database:
                 'DELETE FROM conversations WHERE id = ? AND user_email = ?',
                 (conv_id, email)
             )
+            self._record_deletions(cursor, email, [conv_id])
             
             conn.commit()
             conn.close()
             return True
         except Exception as e:
             print(f"Error deleting conversation for user: {e}")
+            ERRORS.inc(component='sqlite', operation='delete_conversation_for_user')
             conn.close()
             return False
     
+    @timed(SQLITE_SECONDS, 'sqlite', 'get_user_stats')
     def get_user_stats(self, email: str) -> Dict[str, Any]:
         """获取用户统计信息"""
         try:
@@ -361,6 +679,7 @@ class Database:
             }
         except Exception as e:
             print(f"Error getting user stats: {e}")
+            ERRORS.inc(component='sqlite', operation='get_user_stats')
             conn.close()
             return {
                 'conversation_count': 0,
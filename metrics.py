@@ -0,0 +1,262 @@
+"""
+性能指标模块
+进程内记录请求延迟、首块延迟、流式输出量、智能体生成速度、Redis/SQLite调用延迟和错误数，
+通过 /metrics 接口以 Prometheus 文本格式输出，不依赖第三方客户端库。
+
+多进程部署（gunicorn多worker）时每个进程各自统计，由Prometheus按实例分别抓取。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+FAST_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类：按标签值分组保存数据"""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}']
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可任意设置的当前值"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [各桶计数..., 总和]，桶计数在输出时再累加
+                series = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """上下文管理器：记录代码块耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_series(self, key, value) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value[:-1]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_number(bound)))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_number(value[-1])}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，负责统一输出"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# ------------------------ 全局指标 ------------------------
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', '非流式请求处理耗时（流式接口为返回响应头的耗时）',
+    ('route', 'method', 'status'))
+
+STREAM_DURATION_SECONDS = registry.histogram(
+    'sse_stream_duration_seconds', 'SSE流从开始到结束的总耗时', ('route', 'agent_type'))
+STREAM_FIRST_CHUNK_SECONDS = registry.histogram(
+    'sse_time_to_first_chunk_seconds', 'SSE流发出第一个文本块前的等待时间', ('route', 'agent_type'))
+STREAM_CHUNKS = registry.histogram(
+    'sse_stream_chunks', '每个SSE流发出的文本帧数', ('route', 'agent_type'), COUNT_BUCKETS)
+STREAM_BYTES = registry.histogram(
+    'sse_stream_bytes', '每个SSE流发出的字节数', ('route', 'agent_type'), BYTES_BUCKETS)
+
+AGENT_TOKENS_PER_SECOND = registry.histogram(
+    'agent_tokens_per_second', '智能体生成速度（按LLM流式块数近似token数）', ('agent_type',), RATE_BUCKETS)
+AGENT_GENERATION_SECONDS = registry.histogram(
+    'agent_generation_duration_seconds', '智能体生成回复的耗时（不含信息收集）', ('agent_type',))
+COLLECTOR_SECONDS = registry.histogram(
+    'agent_collector_duration_seconds', '旅行规划信息收集（MCP工具调用）耗时', ('agent_type',))
+
+REDIS_SECONDS = registry.histogram(
+    'redis_call_duration_seconds', 'Redis记忆存储调用耗时', ('operation',), FAST_LATENCY_BUCKETS)
+SQLITE_SECONDS = registry.histogram(
+    'sqlite_call_duration_seconds', 'SQLite数据库调用耗时', ('operation',), FAST_LATENCY_BUCKETS)
+
+ERRORS = registry.counter(
+    'errors_total', '各组件发生的错误数', ('component', 'operation'))
+
+CONVERSATION_QUEUE_DEPTH = registry.gauge(
+    'conversation_writer_queue_depth', '对话写回队列中等待落库的对话轮数')
+
+
+def timed(histogram: Histogram, component: str, operation: str):
+    """装饰器：记录函数耗时，函数抛出异常时同时计入错误数"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                ERRORS.inc(component=component, operation=operation)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+
+class StreamTimer:
+    """记录一次SSE流的首块延迟、帧数、字节数和总耗时"""
+
+    def __init__(self, route: str, agent_type: str):
+        self.labels = {'route': route, 'agent_type': agent_type}
+        self.started = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+        self.chunks = 0
+        self.bytes = 0
+
+    def chunk(self, frame: str):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+            STREAM_FIRST_CHUNK_SECONDS.observe(self.first_chunk_at - self.started, **self.labels)
+        self.chunks += 1
+        self.bytes += len(frame.encode('utf-8'))
+
+    def error(self):
+        ERRORS.inc(component='stream', operation=self.labels['route'])
+
+    def finish(self):
+        STREAM_DURATION_SECONDS.observe(time.perf_counter() - self.started, **self.labels)
+        STREAM_CHUNKS.observe(self.chunks, **self.labels)
+        STREAM_BYTES.observe(self.bytes, **self.labels)
+
+
+class GenerationTimer:
+    """记录智能体一次生成的速度：从第一个块到最后一个块的块数/秒"""
+
+    def __init__(self, agent_type: str):
+        self.agent_type = agent_type
+        self.started = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+        self.chunks = 0
+
+    def chunk(self):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+        self.chunks += 1
+
+    def finish(self):
+        now = time.perf_counter()
+        AGENT_GENERATION_SECONDS.observe(now - self.started, agent_type=self.agent_type)
+        if self.first_chunk_at is not None and self.chunks > 1 and now > self.first_chunk_at:
+            AGENT_TOKENS_PER_SECOND.observe((self.chunks - 1) / (now - self.first_chunk_at), agent_type=self.agent_type)
+
+
+def render() -> str:
+    """输出全部指标"""
+    return registry.render()
@@ -0,0 +1,102 @@
+"""
+工作进程启动预热模块
+默认情况下 AgentService、MCP工具、Redis连接、到LLM服务端的连接都在首个请求时才创建，
+第一个用户要额外等待MCP子进程启动和TLS握手。开启预热后，工作进程导入应用时在后台线程中完成：
+- 初始化 AgentService（全局单例，只初始化一次）
+- 加载MCP工具
+- 检查Redis连接
+- 与 OPENAI_API_URL 建立连接
+
+就绪状态通过 /healthz/ready 暴露，负载均衡器只把流量转发到已预热的工作进程。
+
+配置（环境变量）:
+    PREWARM_ON_START  是否在启动时预热（默认 false）
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+
+APP_READY = metrics.registry.gauge('app_ready', '工作进程是否已完成预热（1为就绪）')
+PREWARM_SECONDS = metrics.registry.gauge('prewarm_seconds', '工作进程启动预热耗时')
+
+
+class Prewarmer:
+    """在后台线程中执行一次预热，并记录就绪状态"""
+
+    PENDING, RUNNING, READY, FAILED = 'pending', 'running', 'ready', 'failed'
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.state = self.PENDING if enabled else self.READY
+        self.steps: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.elapsed_ms: Optional[int] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        APP_READY.set(0 if enabled else 1)
+
+    def start(self):
+        """启动后台预热线程（重复调用无效）"""
+        with self._lock:
+            if not self.enabled or self._thread is not None:
+                return
+            self.state = self.RUNNING
+            self._thread = threading.Thread(target=self._run, name='prewarm', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待预热结束，返回是否就绪"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def _run(self):
+        started = time.perf_counter()
+        print("🔥 开始预热工作进程...")
+        try:
+            from agent.ai_agent import get_agent_service
+            self.steps = get_agent_service().prewarm()
+            self.state = self.READY
+        except Exception as e:
+            # AgentService 本身无法初始化（如未配置API密钥）时进程不可用，保持未就绪
+            print(f"❌ 工作进程预热失败: {e}")
+            metrics.ERRORS.inc(component='prewarm', operation='agent_service')
+            self.error = str(e)
+            self.state = self.FAILED
+        self.elapsed_ms = int((time.perf_counter() - started) * 1000)
+        PREWARM_SECONDS.set(self.elapsed_ms / 1000.0)
+        APP_READY.set(1 if self.ready else 0)
+        print(f"🔥 预热结束: {self.state}，耗时 {self.elapsed_ms}ms")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'prewarm': self.enabled,
+            'state': self.state,
+            'elapsed_ms': self.elapsed_ms,
+            'steps': self.steps,
+            'error': self.error,
+        }
+
+
+# 全局预热器实例
+_prewarmer = None
+_prewarmer_lock = threading.Lock()
+
+def get_prewarmer() -> Prewarmer:
+    """获取全局预热器（懒加载）"""
+    global _prewarmer
+    if _prewarmer is None:
+        with _prewarmer_lock:
+            if _prewarmer is None:
+                enabled = os.getenv('PREWARM_ON_START', 'false').lower() in ('1', 'true', 'yes')
+                _prewarmer = Prewarmer(enabled)
+    return _prewarmer
@@ -312,6 +312,15 @@ def interactive_menu():
         except Exception as e:
             print(f"❌ 操作失败: {e}")
 
+def invalidate_collector_cache(destination: str = None, topic: str = None):
+    """失效跨用户的旅行信息收集缓存"""
+    from agent.collector_cache import CollectorCache, CACHE_TOPICS
+    if topic and topic not in CACHE_TOPICS:
+        print(f"❌ 未知类别: {topic}（可选: {', '.join(CACHE_TOPICS)}）")
+        return
+    removed = CollectorCache().invalidate(destination, topic)
+    print(f"🗑️ 已删除 {removed} 条信息收集缓存（目的地: {destination or '全部'}，类别: {topic or '全部'}）")
+
 def main():
     """主函数"""
     if len(sys.argv) > 1:
@@ -325,12 +334,17 @@ def main():
             view_all_sessions(redis_manager)
         elif command == "search" and len(sys.argv) > 2:
             search_memories(redis_manager, sys.argv[2])
+        elif command == "invalidate-collector":
+            destination = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != "all" else None
+            topic = sys.argv[3] if len(sys.argv) > 3 else None
+            invalidate_collector_cache(destination, topic)
         else:
             print("用法:")
             print("  python redis_viewer.py              # 交互式模式")
             print("  python redis_viewer.py stats        # 查看统计信息")
             print("  python redis_viewer.py list         # 列出所有会话")
             print("  python redis_viewer.py search 关键词 # 搜索记忆")
+            print("  python redis_viewer.py invalidate-collector [目的地|all] [类别]  # 失效旅行信息收集缓存")
     else:
         # 交互式模式
         interactive_menu()
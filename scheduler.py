@@ -0,0 +1,256 @@
+"""
+生成任务调度模块
+在智能体生成前做准入控制，避免单个用户占满并发、流量突增直接变成上游LLM限流错误：
+- 全局并发上限：同时运行的生成任务数
+- 按智能体类型分优先级：交互式对话优先于旅行规划，旅行规划优先于PDF生成
+- 同一优先级内按用户做加权公平排队（WFQ）：同一用户的多个请求依次后移，不会挤占其他用户
+- 有界等待队列：队列已满时立即拒绝，由路由返回 429 + Retry-After
+
+同时支持同步（Flask工作线程）和异步（ASGI事件循环）两种等待方式。
+
+配置（环境变量）:
+    SCHEDULER_MAX_CONCURRENT  同时运行的生成任务数（默认16）
+    SCHEDULER_MAX_QUEUE       等待队列容量（默认64）
+"""
+
+import asyncio
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+
+# 数值越小越优先
+AGENT_PRIORITIES = {
+    'general': 0,
+    'attraction_guide': 0,
+    'travel': 1,
+    'pdf_generator': 2,
+}
+DEFAULT_PRIORITY = 1
+
+QUEUE_WAIT_SECONDS = metrics.registry.histogram(
+    'scheduler_queue_wait_seconds', '生成任务在调度队列中的等待时间', ('agent_type',))
+SCHEDULER_REJECTED = metrics.registry.counter(
+    'scheduler_rejected_total', '因等待队列已满被拒绝的生成请求数', ('agent_type',))
+SCHEDULER_ABANDONED = metrics.registry.counter(
+    'scheduler_abandoned_total', '排队期间客户端断开而取消的生成请求数', ('agent_type',))
+SCHEDULER_RUNNING = metrics.registry.gauge(
+    'scheduler_running', '正在运行的生成任务数')
+SCHEDULER_QUEUED = metrics.registry.gauge(
+    'scheduler_queued', '等待调度的生成任务数')
+
+
+class SchedulerFullError(Exception):
+    """等待队列已满"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"服务繁忙，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """一次生成任务的调度凭据：排队 -> 准入 -> 释放"""
+
+    QUEUED, RUNNING, RELEASED = 'queued', 'running', 'released'
+
+    def __init__(self, scheduler: 'GenerationScheduler', user: str, agent_type: str,
+                 priority: int, start_tag: float, finish_tag: float, seq: int):
+        self.scheduler = scheduler
+        self.user = user
+        self.agent_type = agent_type
+        self.priority = priority
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.state = self.QUEUED
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self._event = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future: Optional[asyncio.Future] = None
+
+    @property
+    def admitted(self) -> bool:
+        return self.state == self.RUNNING
+
+    @property
+    def wait_ms(self) -> int:
+        """排队等待时间（毫秒）"""
+        end = self.admitted_at if self.admitted_at is not None else time.monotonic()
+        return int((end - self.enqueued_at) * 1000)
+
+    def position(self) -> int:
+        """当前在等待队列中的位置（从1开始），已准入时为0"""
+        return self.scheduler.position(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """同步等待准入，超时返回False（可继续调用以实现心跳）"""
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout: Optional[float] = None) -> bool:
+        """异步等待准入，超时返回False；被取消时调用方应执行 release()"""
+        with self.scheduler._lock:
+            if self._event.is_set():
+                return True
+            if self._future is None:
+                self._loop = asyncio.get_running_loop()
+                self._future = self._loop.create_future()
+            future = self._future
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self):
+        """生成结束或客户端断开时释放（排队中的请求会被移出队列）"""
+        self.scheduler.release(self)
+
+    def cancel(self):
+        """客户端在排队期间离开：撤销排队（已准入时等同于 release）"""
+        if self.state == self.QUEUED:
+            SCHEDULER_ABANDONED.inc(agent_type=self.agent_type)
+        self.release()
+
+    def _admit(self):
+        """由调度器在持锁状态下调用"""
+        self.state = self.RUNNING
+        self.admitted_at = time.monotonic()
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(True)
+
+
+class GenerationScheduler:
+    """全局并发上限 + 优先级 + 按用户加权公平排队"""
+
+    def __init__(self, max_concurrent: int = 16, max_queue: int = 64,
+                 priorities: Dict[str, int] = None, user_weights: Dict[str, float] = None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.priorities = priorities or AGENT_PRIORITIES
+        self.user_weights = user_weights or {}
+
+        self._lock = threading.Lock()
+        self._queue = []
+        self._running = 0
+        self._seq = itertools.count()
+
+        # WFQ状态：全局虚拟时间 + 每个用户最近一个请求的虚拟完成时间
+        self._virtual_time = 0.0
+        self._user_finish: Dict[str, float] = {}
+        self._user_active: Dict[str, int] = {}
+
+        # 平均占用时长（指数滑动平均），用于估算 Retry-After
+        self._avg_hold = 10.0
+
+    def reserve(self, user: str, agent_type: str) -> Reservation:
+        """
+        申请一个生成名额：有空闲时直接准入，否则进入等待队列
+
+        Raises:
+            SchedulerFullError: 等待队列已满
+        """
+        with self._lock:
+            if self._running >= self.max_concurrent and len(self._queue) >= self.max_queue:
+                SCHEDULER_REJECTED.inc(agent_type=agent_type)
+                raise SchedulerFullError(self._retry_after())
+
+            weight = self.user_weights.get(user, 1.0)
+            start_tag = max(self._virtual_time, self._user_finish.get(user, 0.0))
+            finish_tag = start_tag + 1.0 / weight
+            self._user_finish[user] = finish_tag
+            self._user_active[user] = self._user_active.get(user, 0) + 1
+
+            reservation = Reservation(self, user, agent_type, self.priorities.get(agent_type, DEFAULT_PRIORITY),
+                                      start_tag, finish_tag, next(self._seq))
+            self._queue.append(reservation)
+            self._dispatch()
+            self._update_gauges()
+            return reservation
+
+    def release(self, reservation: Reservation):
+        with self._lock:
+            if reservation.state == Reservation.RELEASED:
+                return
+            if reservation.state == Reservation.RUNNING:
+                self._running -= 1
+                hold = time.monotonic() - reservation.admitted_at
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * hold
+            else:
+                self._queue.remove(reservation)
+            reservation.state = Reservation.RELEASED
+
+            user = reservation.user
+            self._user_active[user] -= 1
+            if self._user_active[user] == 0:
+                # 用户没有进行中的请求时清理其WFQ状态，避免字典无限增长
+                del self._user_active[user]
+                self._user_finish.pop(user, None)
+
+            self._dispatch()
+            self._update_gauges()
+
+    def position(self, reservation: Reservation) -> int:
+        with self._lock:
+            if reservation.state != Reservation.QUEUED:
+                return 0
+            key = self._order_key(reservation)
+            return 1 + sum(1 for other in self._queue if self._order_key(other) < key)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'running': self._running,
+                'queued': len(self._queue),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'avg_hold_seconds': round(self._avg_hold, 2),
+            }
+
+    # ---------------- 内部方法（持锁调用） ----------------
+    @staticmethod
+    def _order_key(reservation: Reservation):
+        return reservation.priority, reservation.finish_tag, reservation.seq
+
+    def _dispatch(self):
+        while self._queue and self._running < self.max_concurrent:
+            reservation = min(self._queue, key=self._order_key)
+            self._queue.remove(reservation)
+            self._running += 1
+            self._virtual_time = max(self._virtual_time, reservation.start_tag)
+            reservation._admit()
+            QUEUE_WAIT_SECONDS.observe(reservation.wait_ms / 1000.0, agent_type=reservation.agent_type)
+
+    def _retry_after(self) -> int:
+        waves = (len(self._queue) + 1) / self.max_concurrent
+        return max(1, min(60, math.ceil(self._avg_hold * waves)))
+
+    def _update_gauges(self):
+        SCHEDULER_RUNNING.set(self._running)
+        SCHEDULER_QUEUED.set(len(self._queue))
+
+
+# 全局调度器实例
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> GenerationScheduler:
+    """获取全局生成任务调度器（懒加载）"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GenerationScheduler(
+                    max_concurrent=int(os.getenv('SCHEDULER_MAX_CONCURRENT', '16')),
+                    max_queue=int(os.getenv('SCHEDULER_MAX_QUEUE', '64')),
+                )
+    return _scheduler
@@ -0,0 +1,163 @@
+"""
+SSE帧编码模块
+负责把智能体输出的文本块编码为SSE帧：
+- 按时间窗口/字节数合并细碎的token，减少每个token一次的JSON编码和写socket
+- 紧凑JSON编码（不转义中文），中文内容的传输字节数约为原来的一半
+- 可选原始文本帧（event: text），完全省去JSON编码
+- 智能体产出的字典（如 {"progress": ...} 进度事件）不参与合并，先发出已缓冲的文本再原样透传
+
+配置（环境变量）:
+    SSE_COALESCE_MS     合并时间窗口，毫秒，0表示不按时间合并（默认30）
+    SSE_COALESCE_BYTES  合并字节阈值，0表示每个块单独发送（默认512）
+    SSE_FRAME_MODE      json 或 raw（默认json）
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, Union
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+    'Connection': 'keep-alive',
+}
+
+SSE_MIMETYPE = 'text/event-stream; charset=utf-8'
+
+FRAME_MODES = ('json', 'raw')
+
+
+def encode_event(payload: Dict[str, Any]) -> str:
+    """将字典编码为一条紧凑的SSE data帧（保留非ASCII字符）"""
+    return f"data: {json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def encode_text(text: str) -> str:
+    """将文本编码为原始文本帧，多行文本拆成多个data行，由客户端用换行拼回"""
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return 'event: text\n' + ''.join(f"data: {line}\n" for line in lines) + '\n'
+
+
+class SSEConfig:
+    """SSE帧编码配置"""
+
+    def __init__(self, coalesce_ms: float = 30, coalesce_bytes: int = 512, frame_mode: str = 'json'):
+        if frame_mode not in FRAME_MODES:
+            raise ValueError(f"未知的SSE帧模式: {frame_mode}")
+        self.coalesce_ms = coalesce_ms
+        self.coalesce_bytes = coalesce_bytes
+        self.frame_mode = frame_mode
+
+    @classmethod
+    def from_env(cls) -> 'SSEConfig':
+        """从环境变量读取配置"""
+        return cls(
+            coalesce_ms=float(os.getenv('SSE_COALESCE_MS', '30')),
+            coalesce_bytes=int(os.getenv('SSE_COALESCE_BYTES', '512')),
+            frame_mode=os.getenv('SSE_FRAME_MODE', 'json'),
+        )
+
+
+class SSEFramer:
+    """文本块合并 + SSE帧编码"""
+
+    def __init__(self, config: SSEConfig = None):
+        self.config = config or SSEConfig.from_env()
+        self.max_delay = self.config.coalesce_ms / 1000.0
+        self.max_bytes = self.config.coalesce_bytes
+
+    def chunk(self, text: str) -> str:
+        """编码一个文本块"""
+        if self.config.frame_mode == 'raw':
+            return encode_text(text)
+        return encode_event({'chunk': text})
+
+    def event(self, payload: Dict[str, Any]) -> str:
+        """编码一个控制事件（done/error等）"""
+        return encode_event(payload)
+
+    def _should_flush(self, size: int, started: float) -> bool:
+        if size >= self.max_bytes:
+            return True
+        return self.max_delay > 0 and time.monotonic() - started >= self.max_delay
+
+    def coalesce(self, chunks: Iterable[Union[str, Dict]]) -> Iterator[Union[str, Dict]]:
+        """
+        合并同步生成器产出的文本块
+
+        同步模式下没有定时器，时间窗口在下一个块到达时检查，
+        因此一个块最多被延迟到下一个块到达或生成结束。
+        """
+        buffer = []
+        size = 0
+        started = 0.0
+        for chunk in chunks:
+            if isinstance(chunk, dict):
+                if buffer:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+                yield chunk
+                continue
+            if not chunk:
+                continue
+            if not buffer:
+                started = time.monotonic()
+            buffer.append(chunk)
+            size += len(chunk.encode('utf-8'))
+            if self._should_flush(size, started):
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer)
+
+    async def acoalesce(self, chunks: AsyncIterator[Union[str, Dict]]) -> AsyncIterator[Union[str, Dict]]:
+        """合并异步生成器产出的文本块，时间窗口到期时即使没有新块也会立即发送"""
+        iterator = chunks.__aiter__()
+        buffer = []
+        size = 0
+        deadline = 0.0
+        pending = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+
+                timeout = None
+                if buffer and self.max_delay > 0:
+                    timeout = max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+                if not done:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+                    continue
+
+                task, pending = pending, None
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    break
+
+                if isinstance(chunk, dict):
+                    if buffer:
+                        yield ''.join(buffer)
+                        buffer, size = [], 0
+                    yield chunk
+                    continue
+                if not chunk:
+                    continue
+                if not buffer:
+                    deadline = time.monotonic() + self.max_delay
+                buffer.append(chunk)
+                size += len(chunk.encode('utf-8'))
+                if size >= self.max_bytes:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+
+            if buffer:
+                yield ''.join(buffer)
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
@@ -138,17 +138,18 @@ document.addEventListener('DOMContentLoaded', function () {
 
         try {
             console.log('Sending message:', message); // 调试信息
-            const res = await fetch('/send_message', {
+            const requestInit = {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ 
                     message: message,
                     agent_type: 'general'  // 添加智能体类型
                 })
-            });
+            };
+            const res = await fetch('/send_message', requestInit);
 
             if (!res.ok) {
-                throw new Error(`HTTP error! status: ${res.status}`);
+                throw new Error(httpErrorMessage(res));
             }
 
             removeLoading();
@@ -163,14 +164,14 @@ document.addEventListener('DOMContentLoaded', function () {
             aiMessageDiv.appendChild(bubbleDiv);
             chatBox.appendChild(aiMessageDiv);
             
-            // 使用 EventSource 处理 SSE
-            const reader = res.body.getReader();
-            const decoder = new TextDecoder();
-            let buffer = '';
+            // 读取 SSE，连接中断时自动续传
+            const reader = new SSEStreamReader(res, '/send_message', requestInit);
             let chunkCount = 0; // 调试信息
+            let finished = false;
+            const progress = new CollectorProgress();
             
-            while (true) {
-                const { done, value } = await reader.read();
+            while (!finished) {
+                const { done, events } = await reader.read();
                 
                 if (done) {
                     console.log('Stream finished, total chunks:', chunkCount); // 调试信息
@@ -180,84 +181,90 @@ document.addEventListener('DOMContentLoaded', function () {
                     break;
                 }
                 
-                buffer += decoder.decode(value, { stream: true });
-                const lines = buffer.split('\n\n');
-                buffer = lines.pop(); // 保留不完整的事件
-                
-                for (const line of lines) {
-                    if (line.trim() === '') continue;
-                    
-                    const dataLine = line.split('\n').find(l => l.startsWith('data: '));
-                    if (dataLine) {
-                        try {
-                            const data = JSON.parse(dataLine.slice(6));
-                            console.log('Received SSE data:', data); // 调试信息
-                            
-                            if (data.error) {
-                                console.error('Server error:', data.error); // 调试信息
-                                bubbleDiv.innerHTML = `<div style="color: #e74c3c;">Error: ${data.error}</div>`;
-                                break;
+                for (const data of events) {
+                    try {
+                        console.log('Received SSE data:', data); // 调试信息
+                        
+                        if (data.error) {
+                            console.error('Server error:', data.error); // 调试信息
+                            bubbleDiv.innerHTML = `<div style="color: #e74c3c;">Error: ${data.error}</div>`;
+                            finished = true;
+                            break;
+                        }
+                        
+                        if (data.queued) {
+                            // 排队中：显示当前队列位置，开始生成后会被回复内容覆盖
+                            bubbleDiv.innerHTML = `<div style="color: #999;">排队中，前面还有 ${data.position - 1} 个请求...</div>`;
+                            continue;
+                        }
+                        
+                        if (data.progress) {
+                            // 旅行规划的信息收集进度：正文开始前显示，之后被回复内容覆盖
+                            if (chunkCount === 0 && progress.add(data.progress)) {
+                                bubbleDiv.innerHTML = progress.html();
                             }
+                            continue;
+                        }
+                        
+                        if (data.chunk) {
+                            chunkCount++; // 调试信息
+                            console.log(`Chunk ${chunkCount}:`, data.chunk.substring(0, 50) + '...'); // 调试信息
+                            
+                            // 累积响应文本（类似旅行规划页面的方式）
+                            let responseText = bubbleDiv.getAttribute('data-response-text') || '';
+                            responseText += data.chunk;
+                            bubbleDiv.setAttribute('data-response-text', responseText);
                             
-                            if (data.chunk) {
-                                chunkCount++; // 调试信息
-                                console.log(`Chunk ${chunkCount}:`, data.chunk.substring(0, 50) + '...'); // 调试信息
-                                
-                                // 累积响应文本（类似旅行规划页面的方式）
-                                let responseText = bubbleDiv.getAttribute('data-response-text') || '';
-                                responseText += data.chunk;
-                                bubbleDiv.setAttribute('data-response-text', responseText);
-                                
-                                // 重新解析完整的Markdown内容
-                                const rawHtml = marked.parse(responseText);
-                                const cleanHtml = DOMPurify.sanitize(rawHtml);
-                                bubbleDiv.innerHTML = cleanHtml;
-                                
-                                // 立即应用代码高亮
-                                const codeBlocks = bubbleDiv.querySelectorAll('pre code');
-                                codeBlocks.forEach(block => {
-                                    // 检查是否已经有语言类
-                                    if (!block.className.includes('language-')) {
-                                        // 尝试从父元素或兄弟元素中获取语言信息
-                                        const preElement = block.closest('pre');
-                                        if (preElement && preElement.className.includes('language-')) {
-                                            block.className = preElement.className;
+                            // 重新解析完整的Markdown内容
+                            const rawHtml = marked.parse(responseText);
+                            const cleanHtml = DOMPurify.sanitize(rawHtml);
+                            bubbleDiv.innerHTML = cleanHtml;
+                            
+                            // 立即应用代码高亮
+                            const codeBlocks = bubbleDiv.querySelectorAll('pre code');
+                            codeBlocks.forEach(block => {
+                                // 检查是否已经有语言类
+                                if (!block.className.includes('language-')) {
+                                    // 尝试从父元素或兄弟元素中获取语言信息
+                                    const preElement = block.closest('pre');
+                                    if (preElement && preElement.className.includes('language-')) {
+                                        block.className = preElement.className;
+                                    } else {
+                                        // 默认使用 javascript，但可以根据内容推断
+                                        const codeContent = block.textContent || '';
+                                        if (codeContent.includes('def ') || codeContent.includes('import ') || codeContent.includes('print(')) {
+                                            block.className = 'language-python';
+                                        } else if (codeContent.includes('function ') || codeContent.includes('const ') || codeContent.includes('let ')) {
+                                            block.className = 'language-javascript';
                                         } else {
-                                            // 默认使用 javascript，但可以根据内容推断
-                                            const codeContent = block.textContent || '';
-                                            if (codeContent.includes('def ') || codeContent.includes('import ') || codeContent.includes('print(')) {
-                                                block.className = 'language-python';
-                                            } else if (codeContent.includes('function ') || codeContent.includes('const ') || codeContent.includes('let ')) {
-                                                block.className = 'language-javascript';
-                                            } else {
-                                                block.className = 'language-javascript';
-                                            }
+                                            block.className = 'language-javascript';
                                         }
                                     }
-                                    hljs.highlightElement(block);
-                                });
-                                
-                                const inlineCodes = bubbleDiv.querySelectorAll('code:not(pre code)');
-                                inlineCodes.forEach(code => {
-                                    if (!code.className.includes('language-')) {
-                                        code.className = 'language-javascript';
-                                    }
-                                    hljs.highlightElement(code);
-                                });
-                                
-                                scrollToBottom();
-                            }
+                                }
+                                hljs.highlightElement(block);
+                            });
                             
-                            if (data.done) {
-                                console.log('Stream completed'); // 调试信息
-                                // 流式输出完成，移除光标效果和临时数据
-                                aiMessageDiv.classList.remove('streaming');
-                                bubbleDiv.removeAttribute('data-response-text');
-                                break;
-                            }
-                        } catch (e) {
-                            console.error('Error parsing SSE data:', e, dataLine);
+                            const inlineCodes = bubbleDiv.querySelectorAll('code:not(pre code)');
+                            inlineCodes.forEach(code => {
+                                if (!code.className.includes('language-')) {
+                                    code.className = 'language-javascript';
+                                }
+                                hljs.highlightElement(code);
+                            });
+                            
+                            scrollToBottom();
+                        }
+                        
+                        if (data.done) {
+                            console.log('Stream completed'); // 调试信息
+                            // 流式输出完成，移除光标效果和临时数据
+                            aiMessageDiv.classList.remove('streaming');
+                            bubbleDiv.removeAttribute('data-response-text');
+                            finished = true;
+                            break;
                         }
+                    } catch (e) {
+                        console.error('Error handling SSE data:', e, data);
                     }
                 }
             }
@@ -290,32 +297,43 @@ document.addEventListener('DOMContentLoaded', function () {
     // 发送按钮点击事件
     sendBtn.addEventListener('click', sendMessage);
 
-    /** 删除特定对话 */
-    function deleteConversation(convId, index) {
-        if (!email) return;
+    // 历史记录缓存：已加载的对话摘要、下一页游标、增量同步令牌
+    let historyItems = [];
+    let historyCursor = null;
+    let historySyncToken = null;
+
+    function resetHistoryCache() {
+        historyItems = [];
+        historyCursor = null;
+        historySyncToken = null;
+    }
 
-        fetch('/delete_conversation', {
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text || '';
+        return div.innerHTML;
+    }
+
+    function postJSON(url, body) {
+        return fetch(url, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ 
-                email: email,
-                conversation_id: convId 
-            })
+            body: JSON.stringify(body)
+        }).then(res => res.json());
+    }
+
+    /** 删除特定对话 */
+    function deleteConversation(convId) {
+        if (!email) return;
+
+        postJSON('/delete_conversation', {
+            email: email,
+            conversation_id: convId
         })
-        .then(res => res.json())
         .then(data => {
             if (data.success) {
-                // 从DOM中移除该对话条目
-                const historyEntries = document.querySelectorAll('.history-entry');
-                if (historyEntries[index]) {
-                    historyEntries[index].remove();
-                }
-                
-                // 如果没有更多对话，显示空状态
-                if (document.querySelectorAll('.history-entry').length === 0) {
-                    historyList.innerHTML = '<div style="text-align:center; color:#999; padding:20px;">暂无历史记录</div>';
-                }
-                
+                historyItems = historyItems.filter(conv => conv.id !== convId);
+                renderHistory();
                 console.log('对话删除成功:', convId);
             } else {
                 alert('删除失败：' + (data.error || '未知错误'));
@@ -327,118 +345,169 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
+    /** 渲染已加载的对话摘要列表 */
+    function renderHistory() {
+        if (historyItems.length === 0) {
+            historyList.innerHTML = '<div style="text-align:center; color:#999; padding:20px;">暂无历史记录</div>';
+            return;
+        }
+
+        historyList.innerHTML = historyItems.map((conv, idx) => `
+            <div class="history-entry" data-index="${idx}" data-conv-id="${escapeHtml(conv.id)}" style="padding: 15px; border: 1px solid #e0e0e0; border-radius: 8px; margin-bottom: 10px; transition: background-color 0.2s; position: relative;">
+                <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 10px;">
+                    <div style="font-weight:bold; cursor: pointer;">${escapeHtml(conv.title)} - ${escapeHtml(conv.date)}</div>
+                    <button class="delete-conv-btn" style="background: #e74c3c; color: white; border: none; border-radius: 4px; padding: 4px 8px; font-size: 12px; cursor: pointer;" title="删除此对话">🗑️</button>
+                </div>
+                <div class="conv-content" style="line-height:1.6; max-height:100px; overflow-y:auto; font-size:0.9rem; cursor: pointer;">
+                    ${conv.preview ? `<div style="margin-bottom:6px; padding:6px; border-radius:6px; background-color:#f1f8e9;">青鸾： ${escapeHtml(conv.preview)}</div>` : ''}
+                    <div style="color:#666; font-size:0.85rem;">共 ${conv.message_count} 条消息</div>
+                </div>
+            </div>
+        `).join('') + (historyCursor ? '<button id="load-more-history" style="width:100%; padding:8px; border:1px dashed #ccc; border-radius:8px; background:none; color:#666; cursor:pointer;">加载更多</button>' : '');
+
+        // 为删除按钮添加事件监听器
+        historyList.querySelectorAll('.history-entry').forEach(entry => {
+            const convId = entry.getAttribute('data-conv-id');
+            entry.querySelector('.delete-conv-btn').addEventListener('click', (e) => {
+                e.stopPropagation(); // 阻止事件冒泡
+                if (confirm(`确定要删除这个对话吗？此操作不可撤销。`)) {
+                    deleteConversation(convId);
+                }
+            });
+            // 点击对话内容时再按需加载完整消息
+            entry.querySelector('.conv-content').addEventListener('click', () => openConversation(convId));
+        });
+
+        const loadMoreBtn = document.getElementById('load-more-history');
+        if (loadMoreBtn) {
+            loadMoreBtn.addEventListener('click', () => {
+                loadMoreBtn.disabled = true;
+                loadMoreBtn.textContent = '加载中...';
+                fetchHistoryPage();
+            });
+        }
+    }
+
+    /** 加载下一页对话摘要 */
+    function fetchHistoryPage() {
+        postJSON('/load_history', { cursor: historyCursor, limit: 20 })
+        .then(data => {
+            console.log('History page received:', data); // 调试信息
+
+            if (data.error) {
+                historyList.innerHTML = `<div style="text-align:center; color:#999; padding:20px;">${escapeHtml(data.error)}</div>`;
+                return;
+            }
+
+            historyItems = historyItems.concat(data.conversations);
+            historyCursor = data.next_cursor;
+            // 只记录第一页的同步令牌，之后的变化都通过增量同步获取
+            if (!historySyncToken) historySyncToken = data.sync_token;
+            renderHistory();
+        })
+        .catch(err => {
+            historyList.innerHTML = `<div style="text-align:center; color:#e74c3c; padding:20px;">加载失败：${escapeHtml(err.message)}</div>`;
+        });
+    }
+
+    /** 增量同步：只获取上次同步之后变化或删除的对话 */
+    function syncHistory() {
+        postJSON('/load_history', { since: historySyncToken })
+        .then(data => {
+            if (data.error) {
+                // 同步失败时退回全量加载第一页
+                resetHistoryCache();
+                loadHistory();
+                return;
+            }
+
+            const removed = new Set(data.deleted);
+            data.conversations.forEach(conv => removed.add(conv.id));
+            historyItems = historyItems.filter(conv => !removed.has(conv.id));
+            // 增量结果按时间正序返回，反转后放到列表最前面
+            historyItems = data.conversations.slice().reverse().concat(historyItems);
+            historySyncToken = data.sync_token;
+
+            if (data.has_more) {
+                syncHistory();
+            } else {
+                renderHistory();
+            }
+        })
+        .catch(err => {
+            historyList.innerHTML = `<div style="text-align:center; color:#e74c3c; padding:20px;">加载失败：${escapeHtml(err.message)}</div>`;
+        });
+    }
+
     /** 加载历史记录 */
     function loadHistory() {
         if (!email) return;
 
+        if (historySyncToken) {
+            renderHistory();
+            syncHistory();
+            return;
+        }
+
         historyList.innerHTML = '<div style="text-align:center; color:#999; padding:20px;">加载中...</div>';
+        resetHistoryCache();
+        fetchHistoryPage();
+    }
 
-        fetch('/load_history', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ email })
-        })
-        .then(res => res.json())
+    /** 打开历史对话：按需获取该对话的全部消息 */
+    function openConversation(convId) {
+        console.log('History entry clicked:', convId); // 调试信息
+
+        postJSON('/load_conversation', { conversation_id: convId })
         .then(data => {
-            console.log('History data received:', data); // 调试信息
-            
             if (data.error) {
-                historyList.innerHTML = `<div style="text-align:center; color:#999; padding:20px;">${data.error}</div>`;
+                alert('加载对话失败：' + data.error);
                 return;
             }
 
-            if (!data.history || data.history.length === 0) {
-                historyList.innerHTML = '<div style="text-align:center; color:#999; padding:20px;">暂无历史记录</div>';
-                return;
-            }
+            chatBox.innerHTML = '';
+            data.messages.forEach(msg => {
+                // 确保字段名正确
+                const text = msg.text || msg.content || '';
+                const isUser = msg.is_user || msg.isUser || false;
+                addMessage(text, isUser);
+            });
 
-            historyList.innerHTML = data.history.map((conv, idx) => `
-                <div class="history-entry" data-index="${idx}" data-conv-id="${conv.id}" style="padding: 15px; border: 1px solid #e0e0e0; border-radius: 8px; margin-bottom: 10px; transition: background-color 0.2s; position: relative;">
-                    <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 10px;">
-                        <div style="font-weight:bold; cursor: pointer;">对话 ${idx + 1} - ${conv.date}</div>
-                        <button class="delete-conv-btn" style="background: #e74c3c; color: white; border: none; border-radius: 4px; padding: 4px 8px; font-size: 12px; cursor: pointer;" title="删除此对话">🗑️</button>
-                    </div>
-                    <div class="conv-content" style="line-height:1.6; max-height:100px; overflow-y:auto; font-size:0.9rem; cursor: pointer;">
-                        ${conv.messages.slice(0, 2).map(msg => {
-                            const text = msg.text || msg.content || '';
-                            const isUser = msg.is_user || msg.isUser || false;
-                            return `
-                                <div style="margin-bottom:6px; padding:6px; border-radius:6px; ${isUser ? 'background-color:#e3f2fd;' : 'background-color:#f1f8e9;'}">
-                                    ${isUser ? '你：' : '青鸾：'} ${text.substring(0, 100)}${text.length > 100 ? '...' : ''}
-                                </div>
-                            `;
-                        }).join('')}
-                        ${conv.messages.length > 2 ? `<div style="color:#666; font-size:0.85rem;">+ ${conv.messages.length - 2} 条消息...</div>` : ''}
-                    </div>
-                </div>
-            `).join('');
-
-            // 为删除按钮添加事件监听器
-            document.querySelectorAll('.delete-conv-btn').forEach((btn, i) => {
-                btn.addEventListener('click', (e) => {
-                    e.stopPropagation(); // 阻止事件冒泡
-                    const convId = data.history[i].id;
-                    if (confirm(`确定要删除这个对话吗？此操作不可撤销。`)) {
-                        deleteConversation(convId, i);
-                    }
-                });
+            // 加载历史对话后，确保输入框在底部
+            const inputWrapper = document.getElementById('input-wrapper');
+            inputWrapper.classList.remove('centered');
+            inputWrapper.classList.add('bottom');
+
+            historyModal.style.display = 'none';
+
+            // 加载历史对话后，将焦点设置到输入框
+            messageInput.focus();
+
+            // 确保历史记录中的代码也能正确高亮
+            const codeBlocks = chatBox.querySelectorAll('pre code');
+            codeBlocks.forEach(block => {
+                if (!block.className.includes('language-')) {
+                    block.className = 'language-javascript';
+                }
+                hljs.highlightElement(block);
             });
 
-            // 为对话内容添加点击事件监听器
-            document.querySelectorAll('.conv-content').forEach((content, i) => {
-                content.addEventListener('click', () => {
-                    console.log('History entry clicked:', i); // 调试信息
-                    const selected = data.history[i];
-                    console.log('Selected conversation:', selected); // 调试信息
-                    
-                    chatBox.innerHTML = '';
-                    selected.messages.forEach(msg => {
-                        console.log('Processing message:', msg); // 调试信息
-                        // 确保字段名正确
-                        const text = msg.text || msg.content || '';
-                        const isUser = msg.is_user || msg.isUser || false;
-                        addMessage(text, isUser);
-                    });
-                    
-                    // 加载历史对话后，确保输入框在底部
-                    const inputWrapper = document.getElementById('input-wrapper');
-                    inputWrapper.classList.remove('centered');
-                    inputWrapper.classList.add('bottom');
-                    
-                    historyModal.style.display = 'none';
-                    
-                    // 加载历史对话后，将焦点设置到输入框
-                    messageInput.focus();
-                    
-                    // 确保历史记录中的代码也能正确高亮
-                    const codeBlocks = chatBox.querySelectorAll('pre code');
-                    codeBlocks.forEach(block => {
-                        if (!block.className.includes('language-')) {
-                            block.className = 'language-javascript';
-                        }
-                        hljs.highlightElement(block);
-                    });
-                    
-                    const inlineCodes = chatBox.querySelectorAll('code:not(pre code)');
-                    inlineCodes.forEach(code => {
-                        if (!code.className.includes('language-')) {
-                            code.className = 'language-javascript';
-                        }
-                        hljs.highlightElement(code);
-                    });
-                    
-                    // 确保所有代码元素都被正确高亮
-                    chatBox.querySelectorAll('code').forEach(code => {
-                        if (!code.classList.contains('hljs')) {
-                            hljs.highlightElement(code);
-                        }
-                    });
-                });
+            const inlineCodes = chatBox.querySelectorAll('code:not(pre code)');
+            inlineCodes.forEach(code => {
+                if (!code.className.includes('language-')) {
+                    code.className = 'language-javascript';
+                }
+                hljs.highlightElement(code);
+            });
+
+            // 确保所有代码元素都被正确高亮
+            chatBox.querySelectorAll('code').forEach(code => {
+                if (!code.classList.contains('hljs')) {
+                    hljs.highlightElement(code);
+                }
             });
         })
-        .catch(err => {
-            historyList.innerHTML = `<div style="text-align:center; color:#e74c3c; padding:20px;">加载失败：${err.message}</div>`;
-        });
+        .catch(err => alert('网络错误：' + err.message));
     }
 
     /** 初始化聊天界面 */
@@ -498,6 +567,7 @@ document.addEventListener('DOMContentLoaded', function () {
             .then(data => {
                 if (data.success) {
                     alert('历史记录已清除');
+                    resetHistoryCache();
                     historyList.innerHTML = '<div style="text-align:center; color:#999; padding:20px;">历史记录已清空</div>';
                 } else {
                     alert('清除失败：' + data.error);
@@ -0,0 +1,176 @@
+/**
+ * SSE流解析工具
+ * 服务端可能发送两种帧：
+ *   - JSON帧:   data: {"chunk":"..."} / {"done":true} / {"error":"..."}
+ *               排队时还会收到 {"queued":true,"position":N} 和准入后的 {"queue_wait_ms":N}
+ *   - 原始文本帧: event: text + 若干 data 行（多行之间用换行拼接）
+ * 同一个读取块中可能包含多个帧，也可能只包含半个帧，因此需要缓冲。
+ * 帧带有 id 行（<generation_id>:<序号>），记录在 lastEventId 中用于断线续传。
+ */
+class SSEParser {
+    constructor() {
+        this.buffer = '';
+        this.lastEventId = null;
+    }
+
+    /** 丢弃未完整接收的帧（重新连接后使用） */
+    reset() {
+        this.buffer = '';
+    }
+
+    /** 输入一段解码后的文本，返回其中所有完整帧解析出的事件数组 */
+    feed(text) {
+        this.buffer += text.replace(/\r\n?/g, '\n');
+        const frames = this.buffer.split('\n\n');
+        this.buffer = frames.pop(); // 保留不完整的帧
+        const events = [];
+
+        for (const frame of frames) {
+            if (frame.trim() === '') continue;
+
+            let eventName = 'message';
+            const dataLines = [];
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('id:')) {
+                    this.lastEventId = line.slice(3).trim();
+                } else if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    const value = line.slice(5);
+                    dataLines.push(value.startsWith(' ') ? value.slice(1) : value);
+                }
+            }
+            if (dataLines.length === 0) continue;
+
+            const data = dataLines.join('\n');
+            if (eventName === 'text') {
+                events.push({ chunk: data });
+                continue;
+            }
+            try {
+                events.push(JSON.parse(data));
+            } catch (e) {
+                console.error('Error parsing SSE data:', e, data);
+            }
+        }
+        return events;
+    }
+}
+
+/** 根据HTTP状态生成错误信息；429表示服务繁忙，带上建议的重试时间 */
+function httpErrorMessage(response, fallback) {
+    if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After') || '几';
+        return `服务繁忙，请 ${retryAfter} 秒后重试`;
+    }
+    return fallback || `HTTP error! status: ${response.status}`;
+}
+
+/**
+ * 旅行规划信息收集阶段的进度展示
+ * 服务端推送 {progress: {type, ...}}，规划正文开始前依次显示在回复气泡里，收到第一块正文后被覆盖。
+ */
+class CollectorProgress {
+    constructor() {
+        this.lines = [];
+    }
+
+    static escape(text) {
+        const div = document.createElement('div');
+        div.textContent = text == null ? '' : String(text);
+        return div.innerHTML;
+    }
+
+    /** 记录一条进度事件，返回是否需要重新渲染 */
+    add(progress) {
+        const esc = CollectorProgress.escape;
+        switch (progress.type) {
+            case 'collecting':
+                this.lines.push(progress.mode === 'prefetch'
+                    ? `🔍 正在并发查询 ${progress.calls} 项旅行信息...`
+                    : '🔍 正在收集旅行信息...');
+                break;
+            case 'tool_start':
+                this.lines.push(`🔧 调用 <b>${esc(progress.tool)}</b> ${esc(progress.input)}`);
+                break;
+            case 'tool_end':
+                this.lines.push(progress.error
+                    ? `❌ ${esc(progress.tool)} 失败（${(progress.ms / 1000).toFixed(1)}s）：${esc(progress.error)}`
+                    : progress.cached
+                        ? `✅ ${esc(progress.tool)} 使用缓存结果`
+                        : `✅ ${esc(progress.tool)} 完成（${(progress.ms / 1000).toFixed(1)}s）`);
+                break;
+            case 'cached':
+                this.lines.push('📦 使用相同旅行参数的缓存信息，正在制定行程...');
+                break;
+            case 'finding':
+                this.lines.push(`📝 ${esc(progress.text)}`);
+                break;
+            case 'reused':
+                this.lines.push('♻️ 旅行参数未变化，沿用本次对话已收集的信息，正在制定行程...');
+                break;
+            case 'collected':
+                this.lines.push(`📋 信息收集完成（${(progress.ms / 1000).toFixed(1)}s），正在制定行程...`);
+                break;
+            default:
+                return false;
+        }
+        return true;
+    }
+
+    html() {
+        return `<div class="collector-progress" style="color: #999; font-size: 0.9em;">${this.lines.map(line => `<div>${line}</div>`).join('')}</div>`;
+    }
+}
+
+/**
+ * 可续传的SSE读取器
+ * 连接中途断开时，携带 Last-Event-ID 重新请求同一接口，服务端从断点继续推送同一次生成，
+ * 不会重新生成。read() 返回 {done, events}。
+ */
+class SSEStreamReader {
+    constructor(response, url, init, maxRetries = 3) {
+        this.url = url;
+        this.init = init;
+        this.maxRetries = maxRetries;
+        this.retries = 0;
+        this.parser = new SSEParser();
+        this._attach(response);
+    }
+
+    _attach(response) {
+        this.reader = response.body.getReader();
+        this.decoder = new TextDecoder();
+        this.parser.reset();
+    }
+
+    async _reconnect() {
+        const headers = Object.assign({}, this.init.headers, { 'Last-Event-ID': this.parser.lastEventId });
+        const response = await fetch(this.url, Object.assign({}, this.init, { headers }));
+        if (!response.ok) {
+            // 缓冲已过期或不存在，不再重试
+            if (response.status === 404) this.retries = this.maxRetries;
+            throw new Error(httpErrorMessage(response));
+        }
+        this._attach(response);
+    }
+
+    async read() {
+        while (true) {
+            try {
+                if (!this.reader) await this._reconnect();
+                const { done, value } = await this.reader.read();
+                if (done) return { done: true, events: [] };
+                const events = this.parser.feed(this.decoder.decode(value, { stream: true }));
+                if (events.length) this.retries = 0;
+                return { done: false, events };
+            } catch (err) {
+                if (!this.parser.lastEventId || this.retries >= this.maxRetries) throw err;
+                this.retries++;
+                this.reader = null;
+                console.warn(`SSE连接中断，${this.retries} 秒后续传:`, err);
+                await new Promise(resolve => setTimeout(resolve, 1000 * this.retries));
+            }
+        }
+    }
+}
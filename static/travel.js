@@ -192,16 +192,17 @@ function startTravelPlanning(formData) {
     const loadingMessage = addTravelLoader();
     
     // 发送规划请求
-    fetch('/plan_travel', {
+    const requestInit = {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
         },
         body: JSON.stringify(formData)
-    })
+    };
+    fetch('/plan_travel', requestInit)
     .then(response => {
         if (!response.ok) {
-            throw new Error('网络错误');
+            throw new Error(httpErrorMessage(response, '网络错误'));
         }
         
         // 移除三点式加载动画
@@ -211,13 +212,13 @@ function startTravelPlanning(formData) {
         const responseDiv = addMessage('', false);
         const contentDiv = responseDiv.querySelector('.message-content');
         
-        // 处理流式响应
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        // 处理流式响应（连接中断时自动续传）
+        const reader = new SSEStreamReader(response, '/plan_travel', requestInit);
         let responseText = '';
+        const progress = new CollectorProgress();
         
         function readStream() {
-            reader.read().then(({done, value}) => {
+            reader.read().then(({done, events}) => {
                 if (done) {
                     currentPlan = responseText;
                     isPlanning = false;
@@ -248,28 +249,20 @@ function startTravelPlanning(formData) {
                     return;
                 }
                 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-                
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.slice(6));
-                            if (data.chunk) {
-                                responseText += data.chunk;
-                                contentDiv.innerHTML = marked.parse(responseText);
-                                contentDiv.scrollTop = contentDiv.scrollHeight;
-                            } else if (data.error) {
-                                contentDiv.innerHTML = `<div style="color: red;">错误: ${data.error}</div>`;
-                                isPlanning = false;
-                                planButton.innerHTML = '✨ 重新制定计划';
-                                planButton.disabled = false;
-                                planButton.classList.remove('loading');
-                                return;
-                            }
-                        } catch (e) {
-                            console.log('解析数据出错:', e);
-                        }
+                for (const data of events) {
+                    if (data.progress && !responseText) {
+                        if (progress.add(data.progress)) contentDiv.innerHTML = progress.html();
+                    } else if (data.chunk) {
+                        responseText += data.chunk;
+                        contentDiv.innerHTML = marked.parse(responseText);
+                        contentDiv.scrollTop = contentDiv.scrollHeight;
+                    } else if (data.error) {
+                        contentDiv.innerHTML = `<div style="color: red;">错误: ${data.error}</div>`;
+                        isPlanning = false;
+                        planButton.innerHTML = '✨ 重新制定计划';
+                        planButton.disabled = false;
+                        planButton.classList.remove('loading');
+                        return;
                     }
                 }
                 
@@ -306,7 +299,7 @@ function sendMessage() {
     // 添加三点式加载动画
     const loadingMessage = addTravelLoader();
     
-    fetch('/send_message', {
+    const requestInit = {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -315,10 +308,11 @@ function sendMessage() {
             message: message,
             agent_type: 'travel'
         })
-    })
+    };
+    fetch('/send_message', requestInit)
     .then(response => {
         if (!response.ok) {
-            throw new Error('网络错误');
+            throw new Error(httpErrorMessage(response, '网络错误'));
         }
         
         // 移除加载消息
@@ -328,13 +322,13 @@ function sendMessage() {
         const responseDiv = addMessage('', false);
         const contentDiv = responseDiv.querySelector('.message-content');
         
-        // 处理流式响应
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        // 处理流式响应（连接中断时自动续传）
+        const reader = new SSEStreamReader(response, '/send_message', requestInit);
         let responseText = '';
+        const progress = new CollectorProgress();
         
         function readStream() {
-            reader.read().then(({done, value}) => {
+            reader.read().then(({done, events}) => {
                 if (done) {
                     // 添加到对话历史
                     conversationHistory.push({
@@ -351,24 +345,16 @@ function sendMessage() {
                     return;
                 }
                 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-                
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.slice(6));
-                            if (data.chunk) {
-                                responseText += data.chunk;
-                                contentDiv.innerHTML = marked.parse(responseText);
-                                contentDiv.scrollTop = contentDiv.scrollHeight;
-                            } else if (data.error) {
-                                contentDiv.innerHTML = `<div style="color: red;">错误: ${data.error}</div>`;
-                                return;
-                            }
-                        } catch (e) {
-                            console.log('解析数据出错:', e);
-                        }
+                for (const data of events) {
+                    if (data.progress && !responseText) {
+                        if (progress.add(data.progress)) contentDiv.innerHTML = progress.html();
+                    } else if (data.chunk) {
+                        responseText += data.chunk;
+                        contentDiv.innerHTML = marked.parse(responseText);
+                        contentDiv.scrollTop = contentDiv.scrollHeight;
+                    } else if (data.error) {
+                        contentDiv.innerHTML = `<div style="color: red;">错误: ${data.error}</div>`;
+                        return;
                     }
                 }
                 
@@ -445,7 +431,7 @@ function exportToPDF() {
     // 添加三点式加载动画
     const loadingMessage = addTravelLoader();
     
-    fetch('/send_message', {
+    const requestInit = {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -454,10 +440,11 @@ function exportToPDF() {
             message: pdfRequest,
             agent_type: 'pdf_generator'
         })
-    })
+    };
+    fetch('/send_message', requestInit)
     .then(response => {
         if (!response.ok) {
-            throw new Error('网络错误');
+            throw new Error(httpErrorMessage(response, '网络错误'));
         }
         
         // 移除加载消息
@@ -467,40 +454,87 @@ function exportToPDF() {
         const responseDiv = addMessage('', false);
         const contentDiv = responseDiv.querySelector('.message-content');
         
-        // 处理流式响应
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        // 处理流式响应（连接中断时自动续传）
+        const reader = new SSEStreamReader(response, '/send_message', requestInit);
         let responseText = '';
+        // PDF在后台任务中渲染：pdfStatus 为渲染进度提示，pendingJobId 为流结束时仍未完成的任务
+        let pdfStatus = '';
+        let pendingJobId = null;
+        
+        function render() {
+            contentDiv.innerHTML = marked.parse(responseText + pdfStatus);
+            contentDiv.scrollTop = contentDiv.scrollHeight;
+        }
+        
+        function finish() {
+            // 恢复按钮状态
+            exportBtn.innerHTML = originalText;
+            exportBtn.disabled = false;
+        }
+        
+        function showPdfResult(message) {
+            pdfStatus = '';
+            pendingJobId = null;
+            responseText += `\n\n📄${message}`;
+            render();
+        }
+        
+        // 流式响应结束时PDF仍未渲染完：按任务ID轮询结果
+        function pollPdfJob(jobId) {
+            fetch(`/pdf_jobs/${jobId}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(httpErrorMessage(response, '查询PDF任务失败'));
+                }
+                return response.json();
+            })
+            .then(job => {
+                if (job.status === 'done') {
+                    showPdfResult(job.result);
+                    finish();
+                } else if (job.status === 'failed') {
+                    showPdfResult(`PDF生成失败: ${job.error}`);
+                    finish();
+                } else {
+                    pdfStatus = pdfJobStatusText(job);
+                    render();
+                    setTimeout(() => pollPdfJob(jobId), 2000);
+                }
+            })
+            .catch(error => {
+                showPdfResult(`PDF生成失败: ${error.message}`);
+                finish();
+            });
+        }
         
         function readStream() {
-            reader.read().then(({done, value}) => {
+            reader.read().then(({done, events}) => {
                 if (done) {
-                    // 恢复按钮状态
-                    exportBtn.innerHTML = originalText;
-                    exportBtn.disabled = false;
+                    if (pendingJobId) {
+                        pollPdfJob(pendingJobId);
+                    } else {
+                        finish();
+                    }
                     return;
                 }
                 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-                
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.slice(6));
-                            if (data.chunk) {
-                                responseText += data.chunk;
-                                contentDiv.innerHTML = marked.parse(responseText);
-                                contentDiv.scrollTop = contentDiv.scrollHeight;
-                            } else if (data.error) {
-                                contentDiv.innerHTML = `<div style="color: red;">错误: ${data.error}</div>`;
-                                exportBtn.innerHTML = originalText;
-                                exportBtn.disabled = false;
-                                return;
-                            }
-                        } catch (e) {
-                            console.log('解析数据出错:', e);
-                        }
+                for (const data of events) {
+                    if (data.chunk) {
+                        responseText += data.chunk;
+                        render();
+                    } else if (data.pdf_job) {
+                        // 攻略正文流式输出完毕，PDF渲染任务排队/进行中
+                        pendingJobId = data.pdf_job.id;
+                        pdfStatus = pdfJobStatusText(data.pdf_job);
+                        render();
+                    } else if (data.pdf) {
+                        // PDF渲染完成后推送下载链接
+                        showPdfResult(data.pdf.message);
+                    } else if (data.error) {
+                        contentDiv.innerHTML = `<div style="color: red;">错误: ${data.error}</div>`;
+                        exportBtn.innerHTML = originalText;
+                        exportBtn.disabled = false;
+                        return;
                     }
                 }
                 
@@ -521,6 +555,14 @@ function exportToPDF() {
     });
 } 
 
+// PDF渲染任务的状态提示
+function pdfJobStatusText(job) {
+    if (job.status === 'queued') {
+        return job.position ? `\n\n⏳ PDF排队中（前面还有 ${job.position - 1} 个任务）...` : '\n\n⏳ PDF排队中...';
+    }
+    return '\n\n⏳ 正在渲染PDF...';
+}
+
 // 显示景点讲解对话框
 function showAttractionGuideDialog() {
     const modal = document.getElementById('attractionGuideModal');
@@ -581,7 +623,7 @@ function startAttractionGuideFromModal() {
     const loadingMessage = addTravelLoader();
     
     // 发送景点讲解请求
-    fetch('/attraction_guide', {
+    const requestInit = {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -589,10 +631,11 @@ function startAttractionGuideFromModal() {
         body: JSON.stringify({
             message: guideMessage
         })
-    })
+    };
+    fetch('/attraction_guide', requestInit)
     .then(response => {
         if (!response.ok) {
-            throw new Error('网络错误');
+            throw new Error(httpErrorMessage(response, '网络错误'));
         }
         
         // 移除加载动画
@@ -602,13 +645,12 @@ function startAttractionGuideFromModal() {
         const responseDiv = addMessage('', false);
         const contentDiv = responseDiv.querySelector('.message-content');
         
-        // 处理流式响应
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        // 处理流式响应（连接中断时自动续传）
+        const reader = new SSEStreamReader(response, '/attraction_guide', requestInit);
         let responseText = '';
         
         function readStream() {
-            reader.read().then(({ done, value }) => {
+            reader.read().then(({ done, events }) => {
                 if (done) {
                     console.log('景点讲解完成');
                     
@@ -625,28 +667,18 @@ function startAttractionGuideFromModal() {
                     return;
                 }
                 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-                
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.slice(6));
-                            if (data.chunk) {
-                                responseText += data.chunk;
-                                contentDiv.innerHTML = marked.parse(responseText);
-                                const chatBox = document.getElementById('chat-box');
-                                chatBox.scrollTop = chatBox.scrollHeight;
-                            } else if (data.done) {
-                                console.log('景点讲解流式响应完成');
-                                return;
-                            } else if (data.error) {
-                                contentDiv.innerHTML = `<div style="color: red;">❌ 讲解失败: ${data.error}</div>`;
-                                return;
-                            }
-                        } catch (e) {
-                            console.log('解析数据出错:', e);
-                        }
+                for (const data of events) {
+                    if (data.chunk) {
+                        responseText += data.chunk;
+                        contentDiv.innerHTML = marked.parse(responseText);
+                        const chatBox = document.getElementById('chat-box');
+                        chatBox.scrollTop = chatBox.scrollHeight;
+                    } else if (data.done) {
+                        console.log('景点讲解流式响应完成');
+                        return;
+                    } else if (data.error) {
+                        contentDiv.innerHTML = `<div style="color: red;">❌ 讲解失败: ${data.error}</div>`;
+                        return;
                     }
                 }
                 
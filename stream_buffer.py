@@ -0,0 +1,498 @@
+"""
+可续传的SSE流缓冲
+每次生成由后台生产者驱动，产出的SSE帧按顺序编号写入生成缓冲：
+- 进程内缓冲：供本进程的响应实时跟随（live tail），同时支持线程和协程等待
+- Redis Stream 镜像（key: sse_stream:<generation_id>，条目ID为 0-<序号>）：
+  连接断开后重连到其他worker时，从Redis回放并继续跟随
+
+客户端断开不会中断生成；携带 Last-Event-ID（格式 <generation_id>:<序号>）重连时，
+从断点之后回放并接上实时输出，而不是重新发起一次生成。
+进程内生成记录当前的跟随者数，其他进程的跟随者定期续期 Redis 键 sse_stream:<generation_id>:followed，
+仍在排队的生成据此发现客户端（包括单飞合并进来的请求）都已离开并取消排队。
+
+单飞合并：带合并键的生成（如同一用户重复提交的旅行规划表单）在进行中时，
+相同键的请求直接订阅这次生成的输出，不再触发新的上游调用。
+跨进程时通过 Redis 键 sse_inflight:<key> 登记进行中的生成。
+
+配置（环境变量）:
+    SSE_RESUME_TTL       生成结束后缓冲保留的秒数（默认300）
+    SSE_REMOTE_READERS   异步模式下跟随其他进程生成的读取线程数（默认16）
+"""
+
+import asyncio
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from agent.redis_memory import get_redis_memory_manager
+from sse import encode_event
+import metrics
+
+try:
+    from redis import RedisError
+except ImportError:
+    class RedisError(Exception):
+        """未安装redis时的占位（此时不会产生跨进程的生成）"""
+
+KEY_PREFIX = 'sse_stream:'
+INFLIGHT_PREFIX = 'sse_inflight:'
+END_FIELD = 'end'
+FRAME_FIELD = 'frame'
+FOLLOWED_SUFFIX = ':followed'
+
+Events = List[Tuple[int, str]]
+
+# 异步跟随时每次占用读取线程的最长时间（秒）：线程池占满时其他跟随者最多等这么久
+ASYNC_READ_BLOCK_SECONDS = 1.0
+# 其他进程跟随者登记的有效期（秒，另加单次阻塞读取的时长）
+REMOTE_FOLLOW_TTL = 10
+
+SINGLEFLIGHT_REQUESTS = metrics.registry.counter(
+    'singleflight_requests_total', '带合并键的生成请求数（result=joined 即节省的上游调用次数）', ('result',))
+
+
+def format_event_id(generation_id: str, seq: int) -> str:
+    return f"{generation_id}:{seq}"
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+    """解析 Last-Event-ID，格式不正确时返回None"""
+    if not event_id:
+        return None
+    generation_id, _, seq = event_id.strip().rpartition(':')
+    if not generation_id or not seq.isdigit():
+        return None
+    return generation_id, int(seq)
+
+
+def with_event_id(generation_id: str, seq: int, frame: str) -> str:
+    """为SSE帧加上 id 行，浏览器/客户端据此记录 Last-Event-ID"""
+    return f"id: {format_event_id(generation_id, seq)}\n{frame}"
+
+
+class Generation:
+    """进程内的一次生成：有序帧列表 + 等待新帧的通知"""
+
+    def __init__(self, generation_id: str, owner: str, key: Optional[str] = None):
+        self.id = generation_id
+        self.owner = owner
+        self.key = key
+        self.frames: List[str] = []
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.task = None
+        # 本进程内正在跟随这次生成的响应数，以及最近一次没有跟随者的起始时间
+        self.followers = 0
+        self.unfollowed_since = time.monotonic()
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    def append(self, frame: str) -> int:
+        with self._cond:
+            self.frames.append(frame)
+            seq = len(self.frames)
+            self._notify()
+        return seq
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def attach(self):
+        with self._cond:
+            self.followers += 1
+
+    def detach(self):
+        with self._cond:
+            self.followers -= 1
+            if self.followers == 0:
+                self.unfollowed_since = time.monotonic()
+
+    def abandoned(self, grace: float) -> bool:
+        """超过 grace 秒没有任何响应在跟随（客户端已断开且没有续传回来）"""
+        with self._cond:
+            return self.followers == 0 and time.monotonic() - self.unfollowed_since >= grace
+
+    def _notify(self):
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _snapshot(self, after: int) -> Tuple[Events, bool]:
+        events = [(seq, frame) for seq, frame in enumerate(self.frames[after:], start=after + 1)]
+        return events, self.finished
+
+    def read(self, after: int, timeout: Optional[float] = None) -> Tuple[Events, bool]:
+        """返回序号大于 after 的帧以及生成是否已结束；没有新帧时最多等待 timeout 秒"""
+        with self._cond:
+            if len(self.frames) <= after and not self.finished:
+                self._cond.wait(timeout)
+            return self._snapshot(after)
+
+    async def aread(self, after: int, timeout: Optional[float] = None) -> Tuple[Events, bool]:
+        """read 的协程版本"""
+        with self._cond:
+            if len(self.frames) > after or self.finished:
+                return self._snapshot(after)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            return self._snapshot(after)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def max_block_seconds(redis_client) -> Optional[float]:
+    """单次 XREAD 阻塞的上限：必须小于客户端的 socket_timeout，否则没有新帧的安静期间读取会超时报错"""
+    socket_timeout = redis_client.connection_pool.connection_kwargs.get('socket_timeout')
+    return None if socket_timeout is None else max(0.1, socket_timeout * 0.8)
+
+
+class RemoteGeneration:
+    """其他进程产生的生成：通过 Redis XREAD 回放和跟随"""
+
+    def __init__(self, redis_client, generation_id: str, owner: str):
+        self.redis = redis_client
+        self.id = generation_id
+        self.owner = owner
+        self.key = f"{KEY_PREFIX}{generation_id}"
+        self.max_block = max_block_seconds(redis_client)
+        self._followed_until = 0.0
+
+    def read(self, after: int, timeout: Optional[float] = None) -> Tuple[Events, bool]:
+        """
+        返回序号大于 after 的帧以及生成是否已结束；没有新帧时最多等待 timeout 秒
+        （按 max_block 分段阻塞，Redis出错时抛出 RedisError）
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            block = None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+                if self.max_block is not None:
+                    remaining = min(remaining, self.max_block)
+                # block=0 表示无限等待，至少阻塞1毫秒
+                block = max(1, int(remaining * 1000))
+            self._mark_followed((block or 0) / 1000)
+            result = self.redis.xread({self.key: f"0-{after}"}, block=block)
+            if result or deadline is None or time.monotonic() >= deadline:
+                break
+        events, finished = [], False
+        for _, entries in result or []:
+            for entry_id, fields in entries:
+                if END_FIELD in fields:
+                    finished = True
+                    continue
+                events.append((int(entry_id.split('-')[1]), fields[FRAME_FIELD]))
+        if not result and not self.redis.exists(f"{self.key}:owner"):
+            # 缓冲已过期（owner键在登记时同步写入，比流本身出现得早）
+            finished = True
+        return events, finished
+
+    def _mark_followed(self, wait: float):
+        """登记有响应在跟随（生成所在进程排队时据此判断客户端是否还在）；登记在有效期过半之前不重复写入"""
+        now = time.monotonic()
+        if now + wait + REMOTE_FOLLOW_TTL / 2 < self._followed_until:
+            return
+        ttl = math.ceil(wait) + REMOTE_FOLLOW_TTL
+        self.redis.set(f"{self.key}{FOLLOWED_SUFFIX}", 1, ex=ttl)
+        self._followed_until = now + ttl
+
+    async def aread(self, after: int, timeout: Optional[float] = None) -> Tuple[Events, bool]:
+        """
+        read 的协程版本：在专用的有界线程池中执行，不占用 asyncio.to_thread 的默认线程池；
+        每次最多阻塞 ASYNC_READ_BLOCK_SECONDS 秒后归还线程，大量跟随者轮流使用
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        while True:
+            step = None if deadline is None else max(0.001, min(deadline - loop.time(), ASYNC_READ_BLOCK_SECONDS))
+            events, finished = await loop.run_in_executor(remote_read_executor(), self.read, after, step)
+            if events or finished or deadline is None or loop.time() >= deadline:
+                return events, finished
+
+
+class StreamBuffer:
+    """生成缓冲管理：启动生产者、登记进程内生成、镜像到Redis、按 Last-Event-ID 查找"""
+
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+        self._generations = {}
+        self._lock = threading.Lock()
+        # 合并键 -> 进行中的生成；登记过程包含Redis调用，用单独的锁串行化
+        self._inflight = {}
+        self._claim_lock = threading.Lock()
+
+        manager = get_redis_memory_manager()
+        self.redis = manager.redis_client if manager.use_redis else None
+        self._mirror_queue: "queue.Queue" = queue.Queue()
+        if self.redis is not None:
+            threading.Thread(target=self._mirror_loop, name="sse-stream-mirror", daemon=True).start()
+
+    # ---------------- 生产端 ----------------
+    def create(self, owner: str, key: Optional[str] = None, mirror_owner: bool = True) -> Generation:
+        self._evict_expired()
+        generation = Generation(uuid.uuid4().hex, owner, key)
+        with self._lock:
+            self._generations[generation.id] = generation
+        if mirror_owner:
+            self._mirror(('create', generation.id, owner))
+        return generation
+
+    def claim(self, owner: str, key: str):
+        """
+        单飞登记：同一合并键已有进行中的生成时返回 (该生成, False)，调用方只需跟随其输出；
+        否则登记一个新生成并返回 (新生成, True)，调用方负责用 start/astart 驱动它
+        """
+        with self._claim_lock:
+            generation = self._inflight.get(key)
+            if generation is not None:
+                SINGLEFLIGHT_REQUESTS.inc(result='joined')
+                return generation, False
+
+            if self.redis is not None:
+                try:
+                    existing_id = self.redis.get(f"{INFLIGHT_PREFIX}{key}")
+                    if existing_id and self.redis.exists(f"{KEY_PREFIX}{existing_id}:owner"):
+                        SINGLEFLIGHT_REQUESTS.inc(result='joined')
+                        return RemoteGeneration(self.redis, existing_id, owner), False
+                except Exception as e:
+                    print(f"读取进行中的生成失败: {e}")
+
+            generation = self.create(owner, key, mirror_owner=False)
+            self._inflight[key] = generation
+            if self.redis is not None:
+                try:
+                    # 同步写入，保证其他进程的重复请求能立即找到这次生成
+                    pipe = self.redis.pipeline(transaction=False)
+                    pipe.set(f"{KEY_PREFIX}{generation.id}:owner", owner, ex=self.ttl)
+                    pipe.set(f"{INFLIGHT_PREFIX}{key}", generation.id, ex=self.ttl)
+                    pipe.execute()
+                except Exception as e:
+                    print(f"登记进行中的生成失败: {e}")
+            SINGLEFLIGHT_REQUESTS.inc(result='leader')
+            return generation, True
+
+    def append(self, generation: Generation, frame: str) -> int:
+        seq = generation.append(frame)
+        self._mirror(('append', generation.id, seq, frame, generation.key))
+        return seq
+
+    def finish(self, generation: Generation):
+        if generation.key is not None:
+            with self._claim_lock:
+                if self._inflight.get(generation.key) is generation:
+                    del self._inflight[generation.key]
+        generation.finish()
+        self._mirror(('finish', generation.id, len(generation.frames) + 1, generation.key))
+
+    def start(self, owner: str, frames: Iterable[str], generation: Optional[Generation] = None) -> Generation:
+        """在后台线程中消费同步帧生成器（客户端断开不影响生成）；generation 为 claim 得到的新生成"""
+        generation = generation or self.create(owner)
+
+        def produce():
+            try:
+                for frame in frames:
+                    self.append(generation, frame)
+            except Exception as e:
+                print(f"SSE生成中断 (generation={generation.id}): {e}")
+            finally:
+                self.finish(generation)
+
+        threading.Thread(target=produce, name=f"sse-producer-{generation.id[:8]}", daemon=True).start()
+        return generation
+
+    def astart(self, owner: str, frames, on_done=None, generation: Optional[Generation] = None) -> Generation:
+        """在事件循环上以独立任务消费异步帧生成器（客户端断开不影响生成）"""
+        generation = generation or self.create(owner)
+
+        async def produce():
+            try:
+                async for frame in frames:
+                    self.append(generation, frame)
+            except Exception as e:
+                print(f"SSE生成中断 (generation={generation.id}): {e}")
+            finally:
+                self.finish(generation)
+                if on_done is not None:
+                    await on_done()
+
+        # 保存任务引用，避免被垃圾回收
+        generation.task = asyncio.get_running_loop().create_task(produce())
+        return generation
+
+    def followed_remotely(self, generation) -> bool:
+        """其他进程是否有响应在跟随这次生成（单飞合并进来的请求、重连到其他进程的客户端）"""
+        if self.redis is None:
+            return False
+        try:
+            return bool(self.redis.exists(f"{KEY_PREFIX}{generation.id}{FOLLOWED_SUFFIX}"))
+        except Exception as e:
+            # 无法确认时当作仍有人跟随，宁可多生成一次也不让跟随者收到断开错误
+            print(f"读取SSE跟随状态失败 (generation={generation.id}): {e}")
+            return True
+
+    # ---------------- 消费端 ----------------
+    def get(self, generation_id: str, owner: str):
+        """按ID查找生成（先查本进程，再查Redis）；不存在、已过期或不属于该用户时返回None"""
+        with self._lock:
+            generation = self._generations.get(generation_id)
+        if generation is not None:
+            return generation if generation.owner == owner else None
+
+        if self.redis is None:
+            return None
+        try:
+            stored_owner = self.redis.get(f"{KEY_PREFIX}{generation_id}:owner")
+        except Exception as e:
+            print(f"读取SSE缓冲失败: {e}")
+            return None
+        if stored_owner != owner:
+            return None
+        return RemoteGeneration(self.redis, generation_id, owner)
+
+    def tail(self, generation, after: int = 0, heartbeat: float = 15.0):
+        """
+        同步跟随：回放 after 之后的帧并持续输出新帧，空闲时发送注释帧保活；
+        读取Redis出错时推送错误帧后结束（不带 id，客户端可凭 Last-Event-ID 从断点续传）
+        """
+        local = isinstance(generation, Generation)
+        if local:
+            generation.attach()
+        try:
+            while True:
+                try:
+                    events, finished = generation.read(after, heartbeat)
+                except RedisError as e:
+                    yield self._read_error(generation, e)
+                    return
+                for seq, frame in events:
+                    after = seq
+                    yield with_event_id(generation.id, seq, frame)
+                if finished and not events:
+                    return
+                if not events:
+                    yield ": keepalive\n\n"
+        finally:
+            # 客户端断开时响应迭代器被关闭，在此登记跟随者离开
+            if local:
+                generation.detach()
+
+    async def atail(self, generation, after: int = 0, heartbeat: float = 15.0):
+        """tail 的异步版本"""
+        local = isinstance(generation, Generation)
+        if local:
+            generation.attach()
+        try:
+            while True:
+                try:
+                    events, finished = await generation.aread(after, heartbeat)
+                except RedisError as e:
+                    yield self._read_error(generation, e)
+                    return
+                for seq, frame in events:
+                    after = seq
+                    yield with_event_id(generation.id, seq, frame)
+                if finished and not events:
+                    return
+                if not events:
+                    yield ": keepalive\n\n"
+        finally:
+            if local:
+                generation.detach()
+
+    # ---------------- 内部方法 ----------------
+    @staticmethod
+    def _read_error(generation, error: Exception) -> str:
+        print(f"读取SSE缓冲失败 (generation={generation.id}): {error}")
+        metrics.ERRORS.inc(component='stream_buffer', operation='read')
+        return encode_event({'error': '连接中断，请稍后重试'})
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                generation_id for generation_id, generation in self._generations.items()
+                if generation.finished and now - generation.finished_at > self.ttl
+            ]
+            for generation_id in expired:
+                del self._generations[generation_id]
+
+    def _mirror(self, op):
+        if self.redis is not None:
+            self._mirror_queue.put(op)
+
+    def _mirror_loop(self):
+        """把帧按顺序写入Redis Stream；每次把队列中积压的操作放进一个pipeline提交"""
+        while True:
+            ops = [self._mirror_queue.get()]
+            while True:
+                try:
+                    ops.append(self._mirror_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for op in ops:
+                    key = f"{KEY_PREFIX}{op[1]}"
+                    if op[0] == 'create':
+                        pipe.set(f"{key}:owner", op[2], ex=self.ttl)
+                    elif op[0] == 'append':
+                        pipe.xadd(key, {FRAME_FIELD: op[3]}, id=f"0-{op[2]}")
+                        pipe.expire(key, self.ttl)
+                        pipe.expire(f"{key}:owner", self.ttl)
+                        if op[4] is not None:
+                            pipe.expire(f"{INFLIGHT_PREFIX}{op[4]}", self.ttl)
+                    else:
+                        pipe.xadd(key, {END_FIELD: '1'}, id=f"0-{op[2]}")
+                        pipe.expire(key, self.ttl)
+                        pipe.expire(f"{key}:owner", self.ttl)
+                        if op[3] is not None:
+                            pipe.delete(f"{INFLIGHT_PREFIX}{op[3]}")
+                pipe.execute()
+            except Exception as e:
+                print(f"SSE缓冲写入Redis失败: {e}")
+
+
+# 异步跟随其他进程生成的读取线程池（懒加载）
+_remote_read_executor: Optional[ThreadPoolExecutor] = None
+_remote_read_executor_lock = threading.Lock()
+
+def remote_read_executor() -> ThreadPoolExecutor:
+    global _remote_read_executor
+    if _remote_read_executor is None:
+        with _remote_read_executor_lock:
+            if _remote_read_executor is None:
+                _remote_read_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('SSE_REMOTE_READERS', '16')), thread_name_prefix='sse-remote-read')
+    return _remote_read_executor
+
+
+# 全局生成缓冲实例
+_stream_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_stream_buffer() -> StreamBuffer:
+    """获取全局SSE生成缓冲（懒加载）"""
+    global _stream_buffer
+    if _stream_buffer is None:
+        with _buffer_lock:
+            if _stream_buffer is None:
+                _stream_buffer = StreamBuffer(ttl=int(os.getenv('SSE_RESUME_TTL', '300')))
+    return _stream_buffer
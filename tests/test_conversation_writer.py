@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+from conversation_writer import ConversationWriter
+from database_self import Database
+
+EMAIL = 'user@example.com'
+
+
+class RecordingDatabase(Database):
+    """记录每次批量提交的对话轮数；gate 未打开时批量提交阻塞（模拟慢磁盘）"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.batches = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def save_conversations_batch(self, items, conn=None):
+        self.entered.set()
+        self.gate.wait(5)
+        self.batches.append(len(items))
+        return super().save_conversations_batch(items, conn=conn)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = RecordingDatabase(str(tmp_path / 'app.db'))
+    database.add_user(EMAIL, 'secret')
+    return database
+
+
+def turn(text):
+    return [{'text': text, 'is_user': True, 'agent_type': 'general'},
+            {'text': f"回复：{text}", 'is_user': False, 'agent_type': 'general'}]
+
+
+def stored_conversations(database):
+    return sorted(conv['id'] for conv in database.get_history(EMAIL))
+
+
+def test_turns_from_many_threads_are_committed_in_one_transaction(database):
+    writer = ConversationWriter(database, linger_ms=500)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def submit(i):
+        barrier.wait()
+        results.append(writer.submit(EMAIL, turn(f"问题{i}"), f"conv-{i}"))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert writer.flush(5)
+    assert results == [True] * 8
+    assert database.batches == [8]
+    assert writer.get_stats()['batches'] == 1
+    assert stored_conversations(database) == [f"conv-{i}" for i in range(8)]
+    writer.close()
+
+
+def test_close_flushes_pending_turns(database):
+    writer = ConversationWriter(database, linger_ms=200)
+    for i in range(3):
+        assert writer.submit(EMAIL, turn(f"问题{i}"), f"conv-{i}")
+
+    writer.close()
+    assert stored_conversations(database) == ['conv-0', 'conv-1', 'conv-2']
+    assert writer.get_stats()['committed'] == 3
+    # 关闭后不再接收新的对话
+    assert not writer.submit(EMAIL, turn("问题3"), 'conv-3')
+
+
+def test_full_queue_rejects_and_write_through_persists(database):
+    database.gate.clear()
+    writer = ConversationWriter(database, max_queue_size=1, linger_ms=0)
+    assert writer.submit(EMAIL, turn("问题0"), 'conv-0')
+    # 写线程已取走第一轮并卡在提交中，队列里只能再放一轮
+    assert database.entered.wait(5)
+    assert writer.submit(EMAIL, turn("问题1"), 'conv-1')
+
+    assert not writer.submit(EMAIL, turn("问题2"), 'conv-2')
+    assert writer.get_stats()['rejected'] == 1
+    writer.write_through(EMAIL, turn("问题2"), 'conv-2')
+    assert stored_conversations(database) == ['conv-2']
+
+    database.gate.set()
+    assert writer.flush(5)
+    assert stored_conversations(database) == ['conv-0', 'conv-1', 'conv-2']
+    writer.close()
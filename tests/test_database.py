@@ -0,0 +1,46 @@
+import pytest
+
+from database_self import Database
+
+EMAIL = 'user@example.com'
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'app.db'))
+    database.add_user(EMAIL, 'secret')
+    return database
+
+
+def save_turn(database, conv_id, last_message_at):
+    database.save_conversation(EMAIL, [{'text': '问题', 'is_user': True},
+                                       {'text': '回答', 'is_user': False}], conv_id)
+    conn = database.get_connection()
+    conn.execute('UPDATE conversations SET last_message_at = ? WHERE id = ?', (last_message_at, conv_id))
+    conn.commit()
+    conn.close()
+
+
+def test_changes_paging_keeps_conversations_with_the_same_timestamp(database):
+    # 同一毫秒写入的对话（组提交的同一批）跨越分批边界
+    for conv_id in ('a', 'b', 'c'):
+        save_turn(database, conv_id, '2025-05-01 10:00:00.000')
+    save_turn(database, 'd', '2025-05-01 10:00:01.000')
+
+    synced = []
+    token, has_more = '2025-05-01 09:00:00.000', True
+    while has_more:
+        changes = database.get_conversation_changes(EMAIL, token, limit=2)
+        synced += [conv['id'] for conv in changes['conversations']]
+        token, has_more = changes['sync_token'], changes['has_more']
+
+    assert synced == ['a', 'b', 'c', 'd']
+
+
+def test_changes_after_plain_token_exclude_that_instant(database):
+    save_turn(database, 'a', '2025-05-01 10:00:00.000')
+    save_turn(database, 'b', '2025-05-01 10:00:01.000')
+
+    changes = database.get_conversation_changes(EMAIL, '2025-05-01 10:00:00.000')
+    assert [conv['id'] for conv in changes['conversations']] == ['b']
+    assert not changes['has_more']
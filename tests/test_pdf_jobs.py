@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+
+import pytest
+
+from agent.pdf_jobs import JOB_PREFIX, PROCESSING_KEY, QUEUE_KEY, PdfJobQueue
+
+
+class MemoryOnly:
+    """不使用Redis的记忆管理器：队列退化为进程内存储"""
+    use_redis = False
+    redis_client = None
+
+
+def test_dispatch_releases_slot_when_pop_fails():
+    queue = PdfJobQueue(MemoryOnly(), workers=1)
+    calls = []
+
+    def failing_pop(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            raise ConnectionError("redis down")
+        queue._closed = True
+        return None
+
+    queue._pop = failing_pop
+    thread = threading.Thread(target=queue._dispatch_loop, daemon=True)
+    thread.start()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert len(calls) == 2
+    assert queue._slots.acquire(blocking=False)
+
+
+def _real_redis_memory():
+    redis = pytest.importorskip("redis")
+    client = redis.Redis.from_url(os.getenv('TEST_REDIS_URL', 'redis://localhost:6379/15'),
+                                  decode_responses=True, socket_connect_timeout=1, socket_timeout=5)
+    try:
+        client.ping()
+    except redis.RedisError:
+        pytest.skip("需要可用的Redis（TEST_REDIS_URL）")
+    return type('Memory', (), {'use_redis': True, 'redis_client': client})()
+
+
+def test_claimed_job_is_not_recovered_by_another_worker():
+    memory = _real_redis_memory()
+    client = memory.redis_client
+    client.delete(QUEUE_KEY, PROCESSING_KEY)
+    queue = PdfJobQueue(memory, workers=0)
+    job_id = queue.submit('user@example.com', '[]')
+    try:
+        assert queue._pop(timeout=0.1) == job_id
+        assert float(client.hget(f"{JOB_PREFIX}{job_id}", 'lease_until')) > time.time()
+
+        # 另一个进程的 recover 不能把刚取出、还没开始渲染的任务重新排队
+        assert PdfJobQueue(memory, workers=0).recover() == 0
+        assert client.lrange(PROCESSING_KEY, 0, -1) == [job_id]
+        assert client.llen(QUEUE_KEY) == 0
+    finally:
+        client.delete(QUEUE_KEY, PROCESSING_KEY, f"{JOB_PREFIX}{job_id}")
@@ -0,0 +1,81 @@
+import pytest
+
+from scheduler import GenerationScheduler, Reservation, SchedulerFullError
+
+
+def drain(scheduler, holder, reservations):
+    """依次释放正在运行的请求，返回其余请求的准入顺序"""
+    order = []
+    running = holder
+    pending = list(reservations)
+    while pending:
+        running.release()
+        admitted = [r for r in pending if r.admitted]
+        assert len(admitted) == 1
+        running = admitted[0]
+        pending.remove(running)
+        order.append(running)
+    running.release()
+    return order
+
+
+def test_light_user_is_not_queued_behind_heavy_user():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=10)
+    holder = scheduler.reserve('other@example.com', 'general')
+    heavy = [scheduler.reserve('heavy@example.com', 'general') for _ in range(5)]
+    light = scheduler.reserve('light@example.com', 'general')
+
+    assert light.position() == 2
+    order = drain(scheduler, holder, heavy + [light])
+    assert order.index(light) == 1
+    assert [r for r in order if r is not light] == heavy
+
+
+def test_interactive_requests_go_first():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=10)
+    holder = scheduler.reserve('holder@example.com', 'general')
+    pdf = scheduler.reserve('a@example.com', 'pdf_generator')
+    travel = scheduler.reserve('b@example.com', 'travel')
+    chat = scheduler.reserve('c@example.com', 'general')
+
+    assert [chat.position(), travel.position(), pdf.position()] == [1, 2, 3]
+    assert drain(scheduler, holder, [pdf, travel, chat]) == [chat, travel, pdf]
+
+
+def test_full_queue_is_rejected():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=2)
+    scheduler.reserve('a@example.com', 'general')
+    scheduler.reserve('b@example.com', 'general')
+    scheduler.reserve('c@example.com', 'general')
+
+    with pytest.raises(SchedulerFullError) as excinfo:
+        scheduler.reserve('d@example.com', 'general')
+    assert excinfo.value.retry_after >= 1
+    assert scheduler.get_stats()['queued'] == 2
+
+
+def test_cancel_while_queued_leaves_the_queue():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=1)
+    holder = scheduler.reserve('a@example.com', 'general')
+    waiting = scheduler.reserve('b@example.com', 'general')
+
+    waiting.cancel()
+    assert waiting.state == Reservation.RELEASED
+    assert scheduler.get_stats()['queued'] == 0
+    # 撤销后队列有空位，可以再排队
+    scheduler.reserve('c@example.com', 'general')
+    assert holder.admitted
+
+
+def test_cancel_after_admission_frees_the_slot():
+    scheduler = GenerationScheduler(max_concurrent=1, max_queue=10)
+    holder = scheduler.reserve('a@example.com', 'general')
+    waiting = scheduler.reserve('b@example.com', 'general')
+    assert not waiting.wait(0)
+
+    holder.cancel()
+    assert waiting.wait(0)
+    stats = scheduler.get_stats()
+    assert (stats['running'], stats['queued']) == (1, 0)
+    waiting.release()
+    assert scheduler.get_stats()['running'] == 0
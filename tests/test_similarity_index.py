@@ -0,0 +1,34 @@
+import threading
+
+from agent.similarity_index import SimilarityIndex
+
+
+def test_concurrent_saves_leave_a_loadable_file(tmp_path):
+    path = str(tmp_path / 'similarity_index.json')
+    writers = []
+    for worker in range(4):
+        index = SimilarityIndex(path)
+        for i in range(50):
+            index.add(worker * 100 + i, f"c{worker}-{i}", 'travel', f"杭州{i + 1}天怎么玩", f"第{worker}个进程的回答")
+        writers.append(index)
+
+    errors = []
+
+    def save_repeatedly(index):
+        try:
+            for _ in range(20):
+                index.save()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save_repeatedly, args=(index,)) for index in writers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    loaded = SimilarityIndex(path)
+    assert loaded.load()
+    assert len(loaded.docs) == 50
+    assert list(tmp_path.iterdir()) == [tmp_path / 'similarity_index.json']
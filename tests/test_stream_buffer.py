@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+redis = pytest.importorskip("redis")
+
+from stream_buffer import END_FIELD, FRAME_FIELD, KEY_PREFIX, Generation, RemoteGeneration, StreamBuffer
+
+
+class FakeStreamRedis:
+    """按 redis-py 的行为模拟 XREAD：阻塞超过 socket_timeout 还没有数据时抛出 TimeoutError"""
+
+    def __init__(self, socket_timeout):
+        self.socket_timeout = socket_timeout
+        self.connection_pool = type('Pool', (), {'connection_kwargs': {'socket_timeout': socket_timeout}})()
+        self.entries = {}
+        self.values = {}
+        self.blocks = []
+        self.error = None
+        self._cond = threading.Condition()
+
+    def xadd(self, key, fields, id):
+        with self._cond:
+            self.entries.setdefault(key, []).append((id, fields))
+            self._cond.notify_all()
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def exists(self, key):
+        # 生成的 owner 键一直存在
+        return int(key.endswith(':owner') or key in self.values)
+
+    def xread(self, streams, block=None):
+        if self.error is not None:
+            raise self.error
+        (key, last_id), = streams.items()
+        after = int(last_id.split('-')[1])
+        self.blocks.append(block)
+        wait = (block or 0) / 1000
+        timed_out = self.socket_timeout is not None and wait > self.socket_timeout
+        deadline = time.monotonic() + (self.socket_timeout if timed_out else wait)
+        with self._cond:
+            while True:
+                found = [(i, f) for i, f in self.entries.get(key, []) if int(i.split('-')[1]) > after]
+                if found:
+                    return [[key, found]]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if timed_out:
+                        raise redis.TimeoutError("Timeout reading from socket")
+                    return []
+                self._cond.wait(remaining)
+
+
+@pytest.fixture
+def buffer():
+    return StreamBuffer()
+
+
+def test_remote_follower_survives_gap_longer_than_socket_timeout(buffer):
+    client = FakeStreamRedis(socket_timeout=0.3)
+    generation = RemoteGeneration(client, 'g1', 'user@example.com')
+    key = f"{KEY_PREFIX}g1"
+    client.xadd(key, {FRAME_FIELD: 'data: a\n\n'}, id='0-1')
+
+    def produce():
+        time.sleep(0.8)
+        client.xadd(key, {FRAME_FIELD: 'data: b\n\n'}, id='0-2')
+        client.xadd(key, {END_FIELD: '1'}, id='0-3')
+
+    threading.Thread(target=produce, daemon=True).start()
+    frames = list(buffer.tail(generation, heartbeat=2.0))
+
+    assert [frame for frame in frames if not frame.startswith(':')] == ['id: g1:1\ndata: a\n\n', 'id: g1:2\ndata: b\n\n']
+    assert max(client.blocks) < client.socket_timeout * 1000
+
+
+def test_remote_read_error_ends_stream_with_error_frame(buffer):
+    client = FakeStreamRedis(socket_timeout=0.3)
+    client.error = redis.ConnectionError("connection reset")
+    frames = list(buffer.tail(RemoteGeneration(client, 'g2', 'user@example.com')))
+
+    assert len(frames) == 1
+    assert '"error"' in frames[0] and not frames[0].startswith('id:')
+
+
+def test_remote_follower_keeps_generation_followed(buffer):
+    client = FakeStreamRedis(socket_timeout=0.3)
+    buffer.redis = client
+    generation = Generation('g4', 'user@example.com', key='k')
+    # 本进程没有跟随者：只有其他进程还在跟随时才不算客户端已离开
+    assert generation.abandoned(0)
+    assert not buffer.followed_remotely(generation)
+
+    RemoteGeneration(client, 'g4', 'user@example.com').read(0, 0.05)
+    assert buffer.followed_remotely(generation)
+
+
+def _real_redis():
+    client = redis.Redis.from_url(os.getenv('TEST_REDIS_URL', 'redis://localhost:6379/15'),
+                                  decode_responses=True, socket_connect_timeout=1, socket_timeout=5)
+    try:
+        client.ping()
+    except redis.RedisError:
+        pytest.skip("需要可用的Redis（TEST_REDIS_URL）")
+    return client
+
+
+def test_remote_follower_survives_quiet_period_on_real_redis(buffer):
+    client = _real_redis()
+    generation_id = uuid.uuid4().hex
+    key = f"{KEY_PREFIX}{generation_id}"
+    client.set(f"{key}:owner", 'user@example.com', ex=60)
+    client.xadd(key, {FRAME_FIELD: 'data: a\n\n'}, id='0-1')
+
+    def produce():
+        time.sleep(6)
+        client.xadd(key, {FRAME_FIELD: 'data: b\n\n'}, id='0-2')
+        client.xadd(key, {END_FIELD: '1'}, id='0-3')
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        generation = RemoteGeneration(client, generation_id, 'user@example.com')
+        frames = list(buffer.tail(generation, heartbeat=15.0))
+    finally:
+        client.delete(key, f"{key}:owner")
+
+    assert [frame for frame in frames if not frame.startswith(':')] == \
+        [f'id: {generation_id}:1\ndata: a\n\n', f'id: {generation_id}:2\ndata: b\n\n']
+
+
+def test_async_remote_followers_do_not_use_default_executor(buffer):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = FakeStreamRedis(socket_timeout=0.3)
+    key = f"{KEY_PREFIX}g3"
+
+    async def follow():
+        return [frame async for frame in buffer.atail(RemoteGeneration(client, 'g3', 'user@example.com'), heartbeat=2.0)
+                if not frame.startswith(':')]
+
+    async def main():
+        # 默认线程池只有一个线程并且一直被占用：跟随者仍然要能收到帧
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        release = threading.Event()
+        blocker = asyncio.ensure_future(asyncio.to_thread(release.wait, 30))
+        await asyncio.sleep(0.05)
+        followers = asyncio.gather(*(follow() for _ in range(40)))
+        await asyncio.sleep(0.5)
+        client.xadd(key, {FRAME_FIELD: 'data: a\n\n'}, id='0-1')
+        client.xadd(key, {END_FIELD: '1'}, id='0-2')
+        try:
+            results = await asyncio.wait_for(followers, 5)
+        finally:
+            release.set()
+        await blocker
+        return results
+
+    results = asyncio.run(main())
+    assert results == [['id: g3:1\ndata: a\n\n']] * 40
@@ -0,0 +1,123 @@
+import pytest
+
+from agent.trip_context import COLLECT, EXTEND, REUSE, CollectorReuse, TripParams, collector_cache_fields, find_places
+
+# 同一段旅行对话里的追问：提到的是行程内的地点，不是换了目的地
+FOLLOW_UPS = [
+    "行程第三天改成去西湖玩",
+    "把行程里下午改成去博物馆吧",
+    "中午去吃火锅吧",
+    "我们到了以后怎么去机场",
+]
+
+PREVIOUS_INFO = "## 航班\n...\n## 酒店住宿\n...\n## 景点\n西湖、灵隐寺\n## 餐厅美食\n..."
+
+
+def collected_state(params: TripParams, info: str = PREVIOUS_INFO):
+    return {'collected_params': params.to_json(), 'collected_info': info}
+
+
+@pytest.mark.parametrize("message", FOLLOW_UPS)
+def test_from_text_follow_up_has_no_destination(message):
+    assert TripParams.from_text(message).destination == ''
+
+
+@pytest.mark.parametrize("message, destination", [
+    ("下个月去苏州玩", "苏州"),
+    ("五一去杭州", "杭州"),
+    ("去苏州市玩", "苏州"),
+    ("想去婺源旅游三天", "婺源"),
+    ("去西湖旅游", "西湖"),
+    ("目的地改成成都", "成都"),
+    ("杭州三日游攻略", "杭州"),
+    ("帮我规划去日本的行程", "日本"),
+])
+def test_from_text_destination(message, destination):
+    assert TripParams.from_text(message).destination == destination
+
+
+def test_from_text_other_fields():
+    params = TripParams.from_text("从上海去北京玩3天，两个人，预算5000")
+    assert (params.origin, params.destination, params.days, params.travelers, params.budget) == \
+        ('上海', '北京', 3, 2, 5000)
+
+
+def test_from_text_itinerary_day_is_not_trip_length():
+    assert TripParams.from_text("行程第三天改成去西湖玩").days == 0
+
+
+def test_find_places_prefers_longest_name():
+    assert find_places("从上海到西双版纳，北京都可以") == ['上海', '西双版纳', '北京']
+
+
+@pytest.mark.parametrize("message", FOLLOW_UPS)
+def test_plan_follow_up_keeps_previous_params(message):
+    previous = TripParams(origin='上海', destination='杭州', days=3, travelers=2)
+    plan = CollectorReuse().plan(collected_state(previous), message)
+    assert plan.action in (REUSE, EXTEND)
+    assert plan.params == previous
+
+
+def test_plan_follow_up_asking_new_topic_extends():
+    previous = TripParams(destination='杭州', days=3)
+    plan = CollectorReuse().plan(collected_state(previous, "## 景点\n西湖"), "中午去吃火锅吧，推荐几家餐厅")
+    assert plan.action == EXTEND
+    assert plan.topics == ('restaurants',)
+
+
+def test_plan_changed_days_extends_affected_topics():
+    previous = TripParams(destination='杭州', days=3)
+    plan = CollectorReuse().plan(collected_state(previous), "改成玩5天")
+    assert plan.action == EXTEND
+    assert plan.params.days == 5
+    assert plan.topics == ('flights', 'hotels')
+
+
+def test_plan_new_destination_collects():
+    previous = TripParams(origin='上海', destination='杭州', days=3)
+    plan = CollectorReuse().plan(collected_state(previous), "换成去成都玩吧")
+    assert plan.action == COLLECT
+    assert plan.params.destination == '成都'
+    assert plan.params.days == 0
+
+
+def test_plan_refresh_collects():
+    previous = TripParams(destination='杭州', days=3)
+    plan = CollectorReuse().plan(collected_state(previous), "帮我重新查一下")
+    assert plan.action == COLLECT
+    assert plan.refresh
+
+
+def test_from_text_date_range_without_repeated_year():
+    params = TripParams.from_text("2025年5月1日到5月3日从上海去杭州")
+    assert (params.start_date, params.end_date) == ('2025-05-01', '2025-05-03')
+
+
+def test_from_text_preferences():
+    params = TripParams.from_text("从上海去杭州玩3天，想住民宿，不吃辣")
+    assert params.extras == {'accommodation_type': ['民宿'], 'dietary_restrictions': ['不吃辣']}
+
+
+def test_collector_cache_fields_complete_request():
+    fields = collector_cache_fields("帮我规划一下从上海去杭州玩3天的行程，两个人，预算5000")
+    assert fields is not None
+    assert (fields['origin'], fields['destination'], fields['days'], fields['travelers']) == ('上海', '杭州', 3, 2)
+
+
+def test_collector_cache_fields_include_preferences_and_topics():
+    plain = collector_cache_fields("从上海去杭州玩3天，两个人")
+    with_preferences = collector_cache_fields("从上海去杭州玩3天，两个人，想住民宿")
+    with_topics = collector_cache_fields("从上海去杭州玩3天，两个人，推荐美食")
+    assert plain != with_preferences
+    assert plain != with_topics
+    assert with_topics['topics'] == ['restaurants']
+
+
+@pytest.mark.parametrize("message", [
+    "去杭州玩3天，两个人",           # 没有出发地
+    "从上海去杭州，两个人",           # 没有日期或天数
+    "从上海去杭州玩3天，想看樱花",     # 有参数之外的要求
+    "五一从上海去成都旅游",           # "五一"不是能识别的日期
+])
+def test_collector_cache_fields_incomplete_request(message):
+    assert collector_cache_fields(message) is None